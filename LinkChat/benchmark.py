@@ -0,0 +1,441 @@
+"""
+Pruebas de rendimiento de Link-Chat.
+
+Uso:
+    python3 benchmark.py parser [--frames N] [--chunk-size N]
+    python3 benchmark.py suite [--peers N] [--engine threads|asyncio] [--transport hub|veth]
+                               [--scenarios a,b,...] [--json resultados.json]
+
+'suite' levanta N nodos completos (hilos de red o motor asyncio) sobre un transporte local
+y ejecuta escenarios de transferencia y chat. Cada escenario corre en su propio proceso,
+así el pico de memoria y el tiempo de CPU son solo suyos. El JSON incluye el commit para
+poder comparar resultados entre versiones.
+"""
+import argparse
+import json
+import os
+import platform
+import queue
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from config import *
+from protocol import ETH_HEADER, FILE_DATA_HEADER, parse_frame, parse_file_data
+
+# Escenarios de 'suite': nombre -> (descripción, pérdida en el concentrador)
+SCENARIOS = {
+    "bulk": ("un archivo grande", 0.0),
+    "small_files": ("muchos archivos pequeños a la vez", 0.0),
+    "folder": ("una carpeta", 0.0),
+    "chat_flood": ("ráfaga de chat durante un archivo grande", 0.0),
+    "loss_1": ("un archivo con un 1% de pérdida", 0.01),
+    "loss_5": ("un archivo con un 5% de pérdida", 0.05),
+}
+
+# Prefijo de los mensajes de chat de la prueba (le sigue la hora de envío)
+CHAT_PROBE = "bench "
+
+
+def _legacy_parse(raw_data):
+    """Análisis de una trama tal como lo hacía receive_thread antes (copiando en cada corte)."""
+    raw_data = bytes(raw_data)  # recvfrom devolvía un objeto bytes nuevo por trama
+    dest_mac, src_mac, eth_type = struct.unpack('!6s6sH', raw_data[:14])
+    payload = raw_data[14:]
+    msg_type = payload[:1]
+    if msg_type == MSG_TYPE_FILE_DATA:
+        seq_num = struct.unpack('!I', payload[1:5])[0]
+        return seq_num, payload[5:]
+    return None
+
+def _zero_copy_parse(frame):
+    """Análisis con parse_frame: el trozo sigue siendo una vista sobre la trama."""
+    dest_mac, src_mac, msg_type, payload = parse_frame(frame)
+    if msg_type == MSG_TYPE_FILE_DATA[0]:
+        return parse_file_data(payload)
+    return None
+
+def bench_parser(frame_count, chunk_size):
+    """
+    Mide cuántas tramas FILE_DATA por segundo atraviesan el analizador, sin red ni disco.
+    Returns:
+        dict: Resultados por variante (tramas/s y MB/s de trozos).
+    """
+    frame = bytearray(ETH_HEADER.pack(b'\x02' * 6, b'\x04' * 6, LINK_CHAT_ETHERTYPE)
+                      + MSG_TYPE_FILE_DATA + FILE_DATA_HEADER.pack(1, 7) + bytes(chunk_size))
+    view = memoryview(frame)
+
+    results = {}
+    for name, parse in (("legacy", _legacy_parse), ("zero_copy", _zero_copy_parse)):
+        start = time.perf_counter()
+        for _ in range(frame_count):
+            parse(view)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "frames_per_sec": frame_count / elapsed,
+            "mb_per_sec": frame_count * chunk_size / elapsed / 1e6,
+        }
+    return results
+
+# --- Nodos simulados ---
+
+def _start_node(endpoint, engine, gui_queue):
+    """
+    Arranca un nodo completo sobre un extremo del transporte, con el mismo estado y los
+    mismos hilos (o el motor asyncio) que main.py. Todos los nodos comparten 'gui_queue'.
+    Returns:
+        dict: El estado del nodo.
+    """
+    from network_threads import receive_thread, send_thread, discovery_thread, chat_thread, coalescer_thread
+    from send_scheduler import SendScheduler
+    from gui_events import TransferProgress
+    from finalizer import Finalizer
+    from engine import AsyncEngine
+    from rate_limit import RateLimiter
+    from peers import PeerTable
+    from discovery import Discovery
+    from reliable_chat import ReliableChat
+    from metrics import MetricsRegistry
+
+    state = {
+        "peers": PeerTable(PEER_TIMEOUT),
+        "discovery": Discovery(DISCOVERY_INTERVAL, DISCOVERY_MAX_INTERVAL, DISCOVERY_REDUNDANCY),
+        "chat": ReliableChat(),
+        "file_transfer_state": {},
+        "file_transfer_lock": threading.Lock(),
+        "pending_file_requests": {},
+        "pending_file_requests_lock": threading.Lock(),
+        "finalizer": Finalizer(),
+        "send_scheduler": SendScheduler(),
+        # Sin límites de velocidad: se mide lo que da el enlace
+        "rate_limiter": RateLimiter(None),
+        "gui_queue": gui_queue,
+        "transfer_progress": TransferProgress(gui_queue),
+        "network_engine": engine,
+        "engine": None,
+        "metrics": MetricsRegistry(),
+        "my_mac": endpoint.mac,
+        "mtu": endpoint.mtu,
+        "socket": endpoint.sock,
+    }
+    sock, my_mac = endpoint.sock, endpoint.mac
+    if engine == 'asyncio':
+        AsyncEngine(sock, my_mac, state).start()
+        return state
+    threading.Thread(target=receive_thread, args=(sock, my_mac, state), daemon=True).start()
+    threading.Thread(target=send_thread, args=(sock, state), daemon=True).start()
+    threading.Thread(target=discovery_thread, args=(sock, my_mac, state), daemon=True).start()
+    threading.Thread(target=chat_thread, args=(sock, my_mac, state), daemon=True).start()
+    threading.Thread(target=coalescer_thread, args=(sock, my_mac, state), daemon=True).start()
+    return state
+
+def _percentile(values, fraction):
+    # Percentil por rango más cercano sobre una lista ordenada
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+def _write_random(path, size):
+    # Datos aleatorios: la compresión no debe inflar la velocidad medida
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            block = min(remaining, 1 << 20)
+            f.write(os.urandom(block))
+            remaining -= block
+
+def _chat_flood(sender, dest_mac, rate, stop):
+    """Envía mensajes de chat privados a 'rate' mensajes/s hasta que 'stop' se activa."""
+    from network_threads import send_chat
+    interval = 1.0 / rate
+    sent = 0
+    next_send = time.perf_counter()
+    while not stop.is_set():
+        send_chat(sender['socket'], sender['my_mac'], sender, dest_mac,
+                  f"{CHAT_PROBE}{time.perf_counter():.6f}".encode('utf-8'))
+        sent += 1
+        next_send += interval
+        stop.wait(max(0.0, next_send - time.perf_counter()))
+    return sent
+
+def run_scenario(name, args):
+    """
+    Ejecuta un escenario en este proceso: el nodo 0 recibe y los demás envían.
+    Returns:
+        dict: MB/s útiles, tramas/s del bucle de recepción, latencia del chat (p50/p99),
+        CPU por GB, pico de memoria y contadores del transporte.
+    """
+    from network_threads import start_file_transfer, start_folder_transfer
+    from gui_events import WakeupQueue
+    import transport
+
+    os.environ['RUN_MODE'] = 'CLI'  # Las descargas se aceptan solas
+    _, loss = SCENARIOS[name]
+    workdir = tempfile.mkdtemp(prefix='linkchat-bench-')
+    source_dir = os.path.join(workdir, 'src')
+    os.makedirs(source_dir)
+    # Las descargas se guardan en el directorio actual
+    os.chdir(workdir)
+
+    # Los datos se preparan antes de medir nada
+    jobs = []  # (índice del emisor, 'file' o 'folder', ruta, bytes)
+    senders = max(1, args.peers - 1)
+    if name == 'small_files':
+        for i in range(args.small_count):
+            path = os.path.join(source_dir, f'small_{i}.bin')
+            _write_random(path, args.small_kb * 1024)
+            jobs.append((1 + i % senders, 'file', path, args.small_kb * 1024))
+    elif name == 'folder':
+        folder = os.path.join(source_dir, 'folder')
+        for i in range(args.folder_files):
+            subdir = os.path.join(folder, f'dir_{i % 5}')
+            os.makedirs(subdir, exist_ok=True)
+            _write_random(os.path.join(subdir, f'file_{i}.bin'), args.folder_kb * 1024)
+        jobs.append((1, 'folder', folder, args.folder_files * args.folder_kb * 1024))
+    else:
+        size_mb = args.loss_mb if loss else args.bulk_mb
+        path = os.path.join(source_dir, 'bulk.bin')
+        _write_random(path, size_mb << 20)
+        jobs.append((1, 'file', path, size_mb << 20))
+
+    hub = pair = None
+    if args.transport == 'veth':
+        pair = transport.VethPair(prefix='lcbench')
+        endpoints = list(pair.open())
+    else:
+        hub = transport.LoopbackHub(loss=loss, latency=args.latency / 1000, seed=args.seed)
+        endpoints = [hub.attach() for _ in range(args.peers)]
+
+    gui_queue = WakeupQueue()
+    nodes = [_start_node(endpoint, args.engine, gui_queue) for endpoint in endpoints]
+    receiver = nodes[0]
+    try:
+        # Esperar a que los emisores descubran al receptor (capacidades, chat fiable)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and not all(receiver['my_mac'] in node['peers'] for node in nodes[1:]):
+            time.sleep(0.02)
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        frames_before = receiver['receiver'].stats()['packets']
+        started = time.perf_counter()
+        for index, kind, path, _ in jobs:
+            node = nodes[index]
+            start = start_folder_transfer if kind == 'folder' else start_file_transfer
+            start(node['socket'], node['my_mac'], node, receiver['my_mac'], path)
+
+        stop_chat = threading.Event()
+        chat_result = {}
+        if name == 'chat_flood':
+            # El chat sale del último nodo: con más de dos nodos no comparte cola con el archivo
+            chat_thread = threading.Thread(
+                target=lambda: chat_result.update(sent=_chat_flood(nodes[-1], receiver['my_mac'], args.chat_rate, stop_chat)),
+                daemon=True)
+            chat_thread.start()
+
+        latencies = []
+        errors = []
+        failed = []
+        # Solo cuentan para el caudal los bytes de las transferencias que terminaron bien
+        sizes = {os.path.basename(os.path.normpath(path)): size for _, _, path, size in jobs}
+        delivered_bytes = 0
+        pending = len(jobs)
+        deadline = time.monotonic() + args.timeout
+        while pending and time.monotonic() < deadline:
+            try:
+                event = gui_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            kind = event[0]
+            if kind == 'file_sent':
+                pending -= 1
+                delivered_bytes += sizes.get(event[1], 0)
+            elif kind == 'file_send_failed':
+                pending -= 1
+                failed.append(event[1])
+                errors.append(event[2])
+            elif kind == 'chat_message' and CHAT_PROBE in event[1]:
+                sent_at = float(event[1].rsplit(CHAT_PROBE, 1)[1])
+                latencies.append(time.perf_counter() - sent_at)
+            elif kind == 'error':
+                errors.append(event[1])
+        elapsed = time.perf_counter() - started
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+        if name == 'chat_flood':
+            stop_chat.set()
+            chat_thread.join()
+            # Los últimos mensajes pueden estar aún en camino
+            drain_until = time.monotonic() + 1.0
+            while time.monotonic() < drain_until:
+                try:
+                    event = gui_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if event[0] == 'chat_message' and CHAT_PROBE in event[1]:
+                    latencies.append(time.perf_counter() - float(event[1].rsplit(CHAT_PROBE, 1)[1]))
+
+        cpu_seconds = ((usage_after.ru_utime + usage_after.ru_stime)
+                       - (usage_before.ru_utime + usage_before.ru_stime))
+        result = {
+            "description": SCENARIOS[name][0],
+            "completed": pending == 0 and not failed,
+            "files": len(jobs),
+            "failed": failed,
+            "bytes": delivered_bytes,
+            "seconds": elapsed,
+            "mb_per_sec": delivered_bytes / elapsed / 1e6,
+            "frames_per_sec": (receiver['receiver'].stats()['packets'] - frames_before) / elapsed,
+            # Toda la CPU del proceso: emisores, receptor y transporte
+            "cpu_seconds": cpu_seconds,
+            "cpu_sec_per_gb": cpu_seconds / (delivered_bytes / 1e9) if delivered_bytes else None,
+            # ru_maxrss viene en KB en Linux
+            "peak_rss_mb": usage_after.ru_maxrss / 1024,
+            "errors": errors,
+        }
+        if name == 'chat_flood':
+            latencies.sort()
+            result["chat"] = {
+                "sent": chat_result.get('sent', 0),
+                "received": len(latencies),
+                "p50_ms": _percentile(latencies, 0.50) * 1000 if latencies else None,
+                "p99_ms": _percentile(latencies, 0.99) * 1000 if latencies else None,
+                "max_ms": latencies[-1] * 1000 if latencies else None,
+            }
+        if hub is not None:
+            result["transport"] = hub.stats()
+        return result
+    finally:
+        for node in nodes:
+            if node.get('engine') is not None:
+                node['engine'].close()
+            node['send_scheduler'].close()
+        for endpoint in endpoints:
+            endpoint.close()
+        if hub is not None:
+            hub.close()
+        if pair is not None:
+            pair.close()
+        os.chdir('/')
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _commit():
+    # El commit actual, para poder comparar resultados entre versiones
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_suite(args):
+    """
+    Ejecuta cada escenario en un proceso aparte y reúne los resultados.
+    Returns:
+        dict: Metadatos de la ejecución y resultados por escenario.
+    """
+    options = ['--peers', str(args.peers), '--engine', args.engine, '--transport', args.transport,
+               '--bulk-mb', str(args.bulk_mb), '--loss-mb', str(args.loss_mb),
+               '--small-count', str(args.small_count), '--small-kb', str(args.small_kb),
+               '--folder-files', str(args.folder_files), '--folder-kb', str(args.folder_kb),
+               '--chat-rate', str(args.chat_rate), '--latency', str(args.latency),
+               '--seed', str(args.seed), '--timeout', str(args.timeout)]
+    results = {}
+    for name in args.scenarios:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), 'scenario', name] + options,
+                               capture_output=True, text=True)
+        # El resultado es la última línea de la salida; lo demás son avisos de la red
+        lines = child.stdout.strip().splitlines()
+        try:
+            results[name] = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            results[name] = {"completed": False, "errors": [child.stderr.strip()[-2000:]]}
+        _print_result(name, results[name])
+    return {
+        "commit": _commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"peers": args.peers, "engine": args.engine, "transport": args.transport,
+                   "bulk_mb": args.bulk_mb, "loss_mb": args.loss_mb, "small_count": args.small_count,
+                   "small_kb": args.small_kb, "folder_files": args.folder_files, "folder_kb": args.folder_kb,
+                   "chat_rate": args.chat_rate, "latency_ms": args.latency, "seed": args.seed},
+        "scenarios": results,
+    }
+
+def _print_result(name, result):
+    if not result.get('completed'):
+        print(f"{name:>12}: NO TERMINÓ {'; '.join(result.get('errors', []))[:200]}")
+        return
+    line = (f"{name:>12}: {result['mb_per_sec']:>8,.1f} MB/s  {result['frames_per_sec']:>10,.0f} tramas/s"
+            f"  {result['cpu_sec_per_gb']:>7,.1f} s CPU/GB  {result['peak_rss_mb']:>7,.1f} MB RSS")
+    chat = result.get('chat')
+    if chat and chat['p50_ms'] is not None:
+        line += f"  chat p50 {chat['p50_ms']:.1f} ms p99 {chat['p99_ms']:.1f} ms ({chat['received']}/{chat['sent']})"
+    print(line)
+
+def _scenario_list(text):
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"escenarios desconocidos: {', '.join(unknown)}")
+    return names
+
+def _add_suite_options(parser):
+    parser.add_argument("--peers", type=int, default=3, help="Nodos simulados (el primero recibe)")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default=NETWORK_ENGINE)
+    parser.add_argument("--transport", choices=("hub", "veth"), default="hub",
+                        help="hub: en memoria, sin root; veth: par veth en netns (root, 2 nodos)")
+    parser.add_argument("--bulk-mb", type=int, default=32)
+    parser.add_argument("--loss-mb", type=int, default=8)
+    parser.add_argument("--small-count", type=int, default=200)
+    parser.add_argument("--small-kb", type=int, default=16)
+    parser.add_argument("--folder-files", type=int, default=50)
+    parser.add_argument("--folder-kb", type=int, default=64)
+    parser.add_argument("--chat-rate", type=float, default=200.0, help="Mensajes de chat por segundo")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia del concentrador en ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Segundos como máximo por escenario")
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de rendimiento de Link-Chat")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_bench = subparsers.add_parser("parser", help="Tramas/s a través del analizador de tramas")
+    parser_bench.add_argument("--frames", type=int, default=1_000_000)
+    parser_bench.add_argument("--chunk-size", type=int, default=FILE_CHUNK_SIZE)
+
+    parser_suite = subparsers.add_parser("suite", help="Escenarios de transferencia y chat entre nodos simulados")
+    _add_suite_options(parser_suite)
+    parser_suite.add_argument("--scenarios", type=_scenario_list, default=list(SCENARIOS),
+                              help=f"Separados por comas (por defecto todos: {','.join(SCENARIOS)})")
+    parser_suite.add_argument("--json", metavar="RUTA", help="Guarda los resultados en JSON ('-' para la salida estándar)")
+
+    parser_scenario = subparsers.add_parser("scenario", help="Ejecuta un solo escenario en este proceso (lo usa 'suite')")
+    parser_scenario.add_argument("name", choices=list(SCENARIOS))
+    _add_suite_options(parser_scenario)
+
+    args = parser.parse_args()
+
+    if args.benchmark in ("suite", "scenario") and args.transport == "veth" and args.peers != 2:
+        parser.error("el transporte veth solo conecta dos nodos (--peers 2)")
+
+    if args.benchmark == "parser":
+        results = bench_parser(args.frames, args.chunk_size)
+        for name, result in results.items():
+            print(f"{name:>10}: {result['frames_per_sec']:>12,.0f} tramas/s  {result['mb_per_sec']:>10,.1f} MB/s")
+    elif args.benchmark == "scenario":
+        print(json.dumps(run_scenario(args.name, args)))
+    elif args.benchmark == "suite":
+        report = bench_suite(args)
+        if args.json == "-":
+            print(json.dumps(report, indent=2))
+        elif args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
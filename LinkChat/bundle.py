@@ -0,0 +1,103 @@
+import threading
+import time
+from config import *
+from protocol import BUNDLE_ENTRY
+
+
+def pack_bundle(payloads):
+    """
+    Junta varios mensajes (cada uno con su byte de tipo) en el payload de una trama BUNDLE.
+    Cada mensaje va precedido de su longitud.
+    """
+    parts = [MSG_TYPE_BUNDLE]
+    for payload in payloads:
+        parts.append(BUNDLE_ENTRY.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+class Coalescer:
+    """
+    Junta en una sola trama los mensajes pequeños que van al mismo destino.
+    El primer mensaje de cada destino espera como mucho 'delay' segundos a que lleguen otros;
+    si la trama se llena antes, sale enseguida. Un mensaje que viaja solo sale tal cual,
+    sin la cabecera del BUNDLE. No envía nada por sí mismo: add() y due() devuelven
+    lo que hay que enviar, en orden.
+    """
+    def __init__(self, max_frame, delay=COALESCE_DELAY, max_message=COALESCE_MAX_MESSAGE):
+        # Tamaño máximo del payload de una trama (la MTU)
+        self.max_frame = max_frame
+        self.delay = delay
+        self.max_message = max_message
+        self._condition = threading.Condition()
+        # {mac: {"deadline", "payloads", "size"}}
+        self._pending = {}
+        # Función opcional que se llama al abrir un grupo nuevo, para quien no espera con wait()
+        self.on_wake = None
+        self.frames = 0
+        self.messages = 0
+
+    def _take(self, dest_mac):
+        batch = self._pending.pop(dest_mac)
+        payloads = batch['payloads']
+        self.frames += 1
+        self.messages += len(payloads)
+        return (dest_mac, payloads[0] if len(payloads) == 1 else pack_bundle(payloads))
+
+    def add(self, dest_mac, payload):
+        """
+        Añade un mensaje para dest_mac.
+        Returns:
+            list: Las tramas (dest_mac, payload) que hay que enviar ya, en orden.
+        """
+        entry_size = BUNDLE_ENTRY.size + len(payload)
+        ready = []
+        with self._condition:
+            batch = self._pending.get(dest_mac)
+            if len(payload) > self.max_message or 1 + entry_size > self.max_frame:
+                # Un mensaje grande no espera, pero no puede adelantar a los que ya esperan
+                if batch is not None:
+                    ready.append(self._take(dest_mac))
+                ready.append((dest_mac, payload))
+                return ready
+            if batch is not None and batch['size'] + entry_size > self.max_frame:
+                ready.append(self._take(dest_mac))
+                batch = None
+            if batch is None:
+                batch = self._pending[dest_mac] = {
+                    "deadline": time.monotonic() + self.delay,
+                    "payloads": [],
+                    "size": 1,
+                }
+                self._condition.notify()
+                if self.on_wake is not None:
+                    self.on_wake()
+            batch['payloads'].append(payload)
+            batch['size'] += entry_size
+        return ready
+
+    def due(self):
+        """
+        Recoge las tramas cuyo plazo ha vencido.
+        Returns:
+            tuple: (ready, wait). ready es la lista de (dest_mac, payload) que hay que enviar;
+            wait, los segundos hasta el siguiente plazo (None si no queda nada esperando).
+        """
+        now = time.monotonic()
+        ready = []
+        next_deadline = None
+        with self._condition:
+            for dest_mac, batch in list(self._pending.items()):
+                if batch['deadline'] <= now:
+                    ready.append(self._take(dest_mac))
+                elif next_deadline is None or batch['deadline'] < next_deadline:
+                    next_deadline = batch['deadline']
+        return ready, None if next_deadline is None else max(0.0, next_deadline - now)
+
+    def wait(self, timeout):
+        """Espera hasta timeout segundos (o sin límite si es None) a que llegue un mensaje nuevo."""
+        with self._condition:
+            # Si llegó algo después de due(), no hay que esperar: toca calcular su plazo
+            if timeout is None and self._pending:
+                return
+            self._condition.wait(timeout)
@@ -0,0 +1,75 @@
+import os
+import struct
+from config import *
+from transfer_window import SACK_HEADER, unpack_sack
+
+# Cabecera del archivo de checkpoint: firma, tamaño del archivo, tamaño de trozo y resumen del contenido.
+# Le sigue el SACK con los trozos recibidos (acumulado + mapa de bits), igual que en la red.
+CHECKPOINT_HEADER = struct.Struct('!4sQI32s')
+CHECKPOINT_MAGIC = b'LCP1'
+
+
+def checkpoint_path(path):
+    """Ruta del checkpoint que acompaña a la descarga parcial 'path'."""
+    return path + FILE_CHECKPOINT_SUFFIX
+
+def checkpoint_data(file_size, chunk_size, digest, window):
+    """
+    Toma una instantánea de qué trozos han llegado, lista para write_checkpoint.
+    Args:
+        window (ReceiveWindow): El estado de la recepción.
+    Returns:
+        bytes: El contenido del checkpoint.
+    """
+    return CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, file_size, chunk_size, digest) + window.snapshot()
+
+def write_checkpoint(path, data):
+    """
+    Escribe el checkpoint de 'path'. Los datos que da por recibidos ya deben estar en disco
+    (fdatasync del archivo parcial), para que nunca cuente un trozo que se perdería con un
+    corte de luz.
+    """
+    # Se escribe aparte y se renombra, así nunca queda un checkpoint a medias
+    temp_path = checkpoint_path(path) + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, checkpoint_path(path))
+
+def save_checkpoint(fd, path, file_size, chunk_size, digest, window):
+    """
+    Guarda qué trozos de 'path' han llegado, volcando antes a disco los datos escritos.
+    Args:
+        fd (int): Descriptor del archivo parcial.
+        window (ReceiveWindow): El estado de la recepción.
+    """
+    os.fdatasync(fd)
+    write_checkpoint(path, checkpoint_data(file_size, chunk_size, digest, window))
+
+def load_checkpoint(path, file_size, digest):
+    """
+    Busca un checkpoint de 'path' para el mismo contenido (tamaño y resumen).
+    Returns:
+        tuple | None: (chunk_size, cumulative, bitmap), o None si no hay nada que reanudar.
+    """
+    try:
+        with open(checkpoint_path(path), 'rb') as f:
+            data = f.read()
+        if os.path.getsize(path) != file_size:
+            return None
+    except OSError:
+        return None
+
+    if len(data) < CHECKPOINT_HEADER.size + SACK_HEADER.size:
+        return None
+    magic, saved_size, chunk_size, saved_digest = CHECKPOINT_HEADER.unpack_from(data, 0)
+    if magic != CHECKPOINT_MAGIC or saved_size != file_size or saved_digest != digest or chunk_size == 0:
+        return None
+    cumulative, bitmap = unpack_sack(memoryview(data)[CHECKPOINT_HEADER.size:])
+    return chunk_size, cumulative, bitmap
+
+def remove_checkpoint(path):
+    """Borra el checkpoint de 'path', si existe."""
+    try:
+        os.remove(checkpoint_path(path))
+    except FileNotFoundError:
+        pass
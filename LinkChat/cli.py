@@ -1,10 +1,10 @@
-import struct
+import json
 import threading
 import time
 import os  # Necesitamos os para el manejo de archivos
 from config import *
 from utils import mac_bits_cadena, mac_cadena_bits
-from network_threads import file_sender_thread  # Importamos el hilo emisor
+from network_threads import start_file_transfer, start_folder_transfer, transfer_summary, send_chat
 
 def handle_user_input(sock, my_mac, state):
     """
@@ -18,12 +18,82 @@ def handle_user_input(sock, my_mac, state):
 
             if user_input.lower() == '/list':
                 print("--- Hosts Descubiertos ---")
-                with state['known_hosts_lock']:
-                    if not state['known_hosts']:
-                        print("No se han descubierto otros usuarios.")
-                    else:
-                        for i, mac_bytes in enumerate(state['known_hosts']):
-                            print(f"  {i}: {mac_bits_cadena(mac_bytes)}")
+                peers = state['peers'].snapshot()
+                if not peers:
+                    print("No se han descubierto otros usuarios.")
+                now = time.monotonic()
+                for peer in peers:
+                    rtt = f", RTT {peer['rtt'] * 1000:.1f} ms" if peer['rtt'] is not None else ""
+                    mtu = f", MTU {peer['caps']['mtu']}" if peer['caps'] else ""
+                    print(f"  {peer['id']}: {mac_bits_cadena(peer['mac'])} "
+                          f"(visto hace {now - peer['last_seen']:.0f} s{rtt}{mtu})")
+                print("------------------------")
+
+            elif user_input.lower() == '/stats':
+                receiver = state.get('receiver')
+                if receiver is None:
+                    print("[!] El receptor todavía no está activo.")
+                    continue
+                stats = receiver.stats()
+                print(f"--- Recepción ({stats['backend']}) ---")
+                print(f"  Tramas procesadas: {stats['packets']}")
+                print(f"  Tramas vistas por el kernel: {stats['kernel_packets']}")
+                print(f"  Tramas descartadas por el kernel: {stats['drops']}")
+                dispatcher = state.get('dispatcher')
+                if dispatcher is not None:
+                    for name, type_stats in dispatcher.stats().items():
+                        if name == 'unknown':
+                            print(f"  Tipo desconocido: {type_stats}")
+                        else:
+                            print(f"  {name}: {type_stats['count']} tramas, {type_stats['avg_us']:.1f} µs de media")
+                if state.get('engine') is not None:
+                    print(f"  Motor asyncio: {state['engine'].active_tasks()} tareas en marcha")
+                finalizer = state['finalizer'].stats()
+                print(f"  Descargas finalizándose: {finalizer['pending']} (terminadas: {finalizer['completed']})")
+                sched = state['send_scheduler'].stats()
+                print(f"--- Envío ({sched['flows']} transferencias activas, {sched['errors']} errores) ---")
+                for name in ('control', 'chat', 'bulk'):
+                    class_stats = sched[name]
+                    print(f"  {name}: {class_stats['sent']} enviadas, {class_stats['queued']} en cola, "
+                          f"espera media {class_stats['avg_ms']:.2f} ms (máx. {class_stats['max_ms']:.1f} ms)")
+                print("------------------------")
+
+            elif user_input.lower() == '/metrics':
+                # La misma instantánea que se exporta por el socket de métricas
+                print(json.dumps(state['metrics'].snapshot(), indent=2, ensure_ascii=False))
+
+            elif user_input.lower() == '/limit' or user_input.lower().startswith('/limit '):
+                # /limit                      -> muestra los límites
+                # /limit <bytes/s|off>        -> límite global
+                # /limit <bytes/s|off> <id>   -> límite para un vecino
+                limiter = state['rate_limiter']
+                parts = user_input.split()
+                if len(parts) == 1:
+                    global_rate, peer_rates = limiter.limits()
+                    print(f"  Global: {global_rate or 'sin límite'}")
+                    for mac_bytes, rate in peer_rates.items():
+                        print(f"  {mac_bits_cadena(mac_bytes)}: {rate} B/s")
+                    continue
+                try:
+                    rate = None if parts[1].lower() == 'off' else int(parts[1])
+                    mac_bytes = None
+                    if len(parts) > 2:
+                        mac_bytes = state['peers'].mac_for_id(int(parts[2]))
+                        if mac_bytes is None:
+                            raise ValueError(parts[2])
+                    limiter.set_limit(mac_bytes, rate)
+                    target = mac_bits_cadena(mac_bytes) if mac_bytes else "global"
+                    print(f"Límite {target}: {f'{rate} B/s' if rate else 'sin límite'}")
+                except (ValueError, IndexError):
+                    print("[!] Uso: /limit [<bytes_por_segundo>|off] [user_id]")
+
+            elif user_input.lower().startswith('/search '):
+                # Busca en todo el historial guardado en disco
+                text = user_input.split(' ', 1)[1]
+                results = state['history'].search(text)
+                print(f"--- Historial: '{text}' ({len(results)} resultados) ---")
+                for stamp, line in results:
+                    print(f"  [{time.strftime('%d/%m %H:%M:%S', time.localtime(stamp))}] {line}")
                 print("------------------------")
 
             elif user_input.lower().startswith('/msg '):
@@ -34,23 +104,18 @@ def handle_user_input(sock, my_mac, state):
                 
                 user_id, message = parts[1], parts[2]
                 try:
-                    user_id = int(user_id)
-                    with state['known_hosts_lock']:
-                        hosts_list = list(state['known_hosts'].keys())
-                        if 0 <= user_id < len(hosts_list):
-                            dest_mac = hosts_list[user_id]
-                            header = struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE)
-                            packet = header + MSG_TYPE_CHAT + message.encode('utf-8')
-                            sock.send(packet)
-                        else:
-                            print(f"[!] ID de usuario '{user_id}' no válido.")
+                    dest_mac = state['peers'].mac_for_id(int(user_id))
+                    if dest_mac is not None:
+                        send_chat(sock, my_mac, state, dest_mac, message.encode('utf-8'))
+                    else:
+                        print(f"[!] ID de usuario '{user_id}' no válido.")
                 except (ValueError, IndexError):
                     print(f"[!] ID de usuario '{user_id}' no válido.")
 
             elif user_input.lower().startswith('/send '):
                 parts = user_input.split(' ', 2)
                 if len(parts) < 3:
-                    print("[!] Uso: /send <user_id> <ruta_del_archivo>")
+                    print("[!] Uso: /send <user_id> <ruta_del_archivo_o_carpeta>")
                     continue
                 
                 user_id_str, file_path = parts[1], parts[2]
@@ -61,32 +126,18 @@ def handle_user_input(sock, my_mac, state):
                     continue
 
                 try:
-                    user_id = int(user_id_str)
-                    with state['known_hosts_lock']:
-                        hosts_list = list(state['known_hosts'].keys())
-                        if not (0 <= user_id < len(hosts_list)):
-                            print(f"[!] ID de usuario '{user_id}' no válido.")
-                            continue
-                        dest_mac = hosts_list[user_id]
-
-                    # Iniciar la lógica de envío de archivo
-                    file_name = os.path.basename(file_path)
-                    file_size = os.path.getsize(file_path)
-
-                    # Payload: bandera (no es carpeta), tamaño y nombre
-                    payload = b'\x00' + struct.pack('!Q', file_size) + file_name.encode('utf-8') + b'\x00'
-                    header = struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE)
-                    # Enviamos el paquete de inicio
-                    sock.send(header + MSG_TYPE_FILE_START + payload)
-
-                   
-                    sender_thread = threading.Thread(
-                        target=file_sender_thread,
-                        args=(sock, my_mac, dest_mac, file_path, state)
-                    )
-                    sender_thread.daemon = True
-                    sender_thread.start()
-                    print(f"Solicitud para enviar '{file_name}' a {mac_bits_cadena(dest_mac)} enviada.")
+                    dest_mac = state['peers'].mac_for_id(int(user_id_str))
+                    if dest_mac is None:
+                        print(f"[!] ID de usuario '{user_id_str}' no válido.")
+                        continue
+
+                    # Iniciar la lógica de envío de archivo o carpeta (puede haber varios envíos a la vez)
+                    file_name = os.path.basename(os.path.normpath(file_path))
+                    if os.path.isdir(file_path):
+                        transfer_id = start_folder_transfer(sock, my_mac, state, dest_mac, file_path)
+                    else:
+                        transfer_id = start_file_transfer(sock, my_mac, state, dest_mac, file_path)
+                    print(f"Solicitud para enviar '{file_name}' a {mac_bits_cadena(dest_mac)} enviada (transferencia {transfer_id}).")
 
                 except (ValueError, IndexError):
                     print(f"[!] ID de usuario '{user_id_str}' no válido.")
@@ -94,9 +145,7 @@ def handle_user_input(sock, my_mac, state):
                     print(f"[!] Error al iniciar envío de archivo: {e}")
 
             else: # Mensaje broadcast
-                header = struct.pack('!6s6sH', BROADCAST_MAC, my_mac, LINK_CHAT_ETHERTYPE)
-                packet = header + MSG_TYPE_CHAT + user_input.encode('utf-8')
-                sock.send(packet)
+                send_chat(sock, my_mac, state, BROADCAST_MAC, user_input.encode('utf-8'))
 
         except (KeyboardInterrupt, EOFError):
             print("\nSaliendo...")
@@ -118,9 +167,14 @@ def process_incoming_cli(state):
             if event_type == 'new_user':
                 mac_str = mac_bits_cadena(event[1])
                 print(f"\r[+] Nuevo host descubierto: {mac_str}\n> ", end='', flush=True)
+
+            elif event_type == 'user_left':
+                mac_str = mac_bits_cadena(event[1])
+                print(f"\r[-] {mac_str} ya no responde y se quitó de la lista.\n> ", end='', flush=True)
             
             elif event_type == 'chat_message':
                 print(f"\r{event[1]}\n> ", end='', flush=True)
+                state['history'].add(event[1])
             
             elif event_type == 'file_download_started':
                 file_name = event[1]
@@ -130,6 +184,13 @@ def process_incoming_cli(state):
                 file_name = event[1]
                 print(f"\r[+] Archivo '{file_name}' recibido correctamente.\n> ", end='', flush=True)
 
+            elif event_type == 'file_sent':
+                file_name, stats = event[1], event[2]
+                print(f"\r[+] '{file_name}' enviado: {transfer_summary(stats)}.\n> ", end='', flush=True)
+
+            elif event_type == 'file_send_failed':
+                print(f"\r[ERROR] {event[2]}\n> ", end='', flush=True)
+
             elif event_type == 'error':
                  print(f"\r[ERROR] {event[1]}\n> ", end='', flush=True)
 
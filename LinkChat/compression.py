@@ -0,0 +1,115 @@
+import lzma
+import os
+import zlib
+from config import *
+
+# --- Compresión de trozos de archivo ---
+# Cada trozo se comprime por separado: así el receptor puede descomprimirlo y escribirlo
+# en su posición en cuanto llega, sin esperar a los anteriores.
+
+# Códigos de compresión que viajan en FILE_START (propuesto) y FILE_ACK (aceptado).
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+CODEC_NAMES = {CODEC_NONE: 'none', CODEC_ZLIB: 'zlib', CODEC_LZMA: 'lzma'}
+
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": FILE_COMPRESSION_LEVEL}]
+
+
+def _is_padding(data):
+    # Las NIC rellenan con ceros las tramas de menos de 60 bytes: un trozo muy comprimido
+    # puede llegar con ese relleno detrás del final del flujo.
+    return not data.strip(b'\x00')
+
+def _zlib_compressor(chunk_size):
+    # Deflate sin cabecera, con una ventana del tamaño del trozo: inicializar una ventana
+    # mayor para comprimir un solo trozo cuesta más de lo que se gana.
+    # (zlib.compress solo acepta wbits desde Python 3.11.)
+    wbits = -max(9, min(15, chunk_size.bit_length()))
+
+    def compress(data):
+        compressor = zlib.compressobj(FILE_COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+        return compressor.compress(data) + compressor.flush()
+    return compress
+
+def _zlib_decompress(data, max_length):
+    # Con la ventana máxima se puede descomprimir cualquier ventana menor
+    decompressor = zlib.decompressobj(-15)
+    try:
+        output = decompressor.decompress(data, max_length)
+    except zlib.error as e:
+        raise ValueError(f"trozo comprimido dañado: {e}")
+    if not decompressor.eof or decompressor.unconsumed_tail or not _is_padding(decompressor.unused_data):
+        raise ValueError("trozo comprimido dañado o mayor de lo anunciado")
+    return output
+
+def _lzma_compressor(chunk_size):
+    return lambda data: lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+def _lzma_decompress(data, max_length):
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+    try:
+        output = decompressor.decompress(data, max_length=max_length)
+    except lzma.LZMAError as e:
+        raise ValueError(f"trozo comprimido dañado: {e}")
+    if not decompressor.eof or not _is_padding(decompressor.unused_data):
+        raise ValueError("trozo comprimido dañado o mayor de lo anunciado")
+    return output
+
+# Para cada código: (fábrica del compresor según el tamaño de trozo, descompresor).
+CODECS = {
+    CODEC_ZLIB: (_zlib_compressor, _zlib_decompress),
+    CODEC_LZMA: (_lzma_compressor, _lzma_decompress),
+}
+
+def codec_from_name(name):
+    """Devuelve el código de compresión configurado ('zlib', 'lzma' o None)."""
+    for codec, codec_name in CODEC_NAMES.items():
+        if codec_name == (name or 'none'):
+            return codec
+    raise ValueError(f"Compresión desconocida: {name}")
+
+def compressor_for(codec, chunk_size):
+    """Función que comprime un trozo con el código dado, o None si no hay compresión."""
+    if codec == CODEC_NONE:
+        return None
+    return CODECS[codec][0](chunk_size)
+
+def decompressor_for(codec):
+    """
+    Función que descomprime un trozo con el código dado, o None si no hay compresión.
+    Se llama como decompress(data, max_length): nunca produce más de max_length bytes y lanza
+    ValueError si el trozo daría más (una bomba de descompresión) o está incompleto.
+    """
+    if codec == CODEC_NONE:
+        return None
+    return CODECS[codec][1]
+
+def choose_codec(path, file_size, chunk_size, codec=None):
+    """
+    Decide si vale la pena comprimir un archivo. Comprime unas muestras repartidas por el
+    archivo, trozo a trozo como se enviarían, y solo propone la compresión si se reducen
+    al menos a FILE_COMPRESSION_MAX_RATIO de su tamaño.
+    Returns:
+        int: El código a proponer (CODEC_NONE si el archivo no se comprime bien).
+    """
+    if codec is None:
+        codec = codec_from_name(FILE_COMPRESSION)
+    if codec == CODEC_NONE or file_size == 0:
+        return CODEC_NONE
+
+    compress = compressor_for(codec, chunk_size)
+    raw_bytes = packed_bytes = 0
+    with open(path, 'rb') as f:
+        for i in range(FILE_COMPRESSION_SAMPLES):
+            offset = file_size * i // FILE_COMPRESSION_SAMPLES
+            sample = os.pread(f.fileno(), FILE_COMPRESSION_SAMPLE_SIZE, offset)
+            for start in range(0, len(sample), chunk_size):
+                block = sample[start:start + chunk_size]
+                raw_bytes += len(block)
+                # Un trozo que no se reduce viaja sin comprimir
+                packed_bytes += min(len(block), len(compress(block)))
+    if raw_bytes == 0 or packed_bytes > raw_bytes * FILE_COMPRESSION_MAX_RATIO:
+        return CODEC_NONE
+    return codec
@@ -20,19 +20,323 @@ MSG_TYPE_FILE_DATA = b'\x04'
 MSG_TYPE_FILE_END = b'\x05'
 # Mensaje para confirmar que el receptor acepta la transferencia del archivo.
 MSG_TYPE_FILE_ACK = b'\x06'
+# Mensaje con la confirmación acumulada y selectiva (SACK) de los trozos recibidos.
+MSG_TYPE_FILE_SACK = b'\x07'
+# Mensaje con el que el receptor confirma que recibió el FILE_END y guardó el archivo.
+MSG_TYPE_FILE_DONE = b'\x08'
+# Trozo de archivo comprimido con la compresión negociada (mismo formato que FILE_DATA).
+MSG_TYPE_FILE_DATA_COMPRESSED = b'\x09'
+# Sonda de descubrimiento: quien la recibe responde enseguida con un DISCOVERY_REPLY.
+MSG_TYPE_DISCOVERY_PROBE = b'\x0a'
+# Respuesta unicast a una sonda de descubrimiento.
+MSG_TYPE_DISCOVERY_REPLY = b'\x0b'
+# Mensaje de chat privado con entrega fiable: lleva sesión e id y el receptor lo confirma.
+MSG_TYPE_CHAT_RELIABLE = b'\x0c'
+# Confirmación de uno o varios mensajes de chat fiables (formato SACK).
+MSG_TYPE_CHAT_ACK = b'\x0d'
+# Fragmento de un mensaje que no cabe en una trama (chat o control). Lleva dentro
+# un trozo del payload original, con su propio byte de tipo.
+MSG_TYPE_FRAGMENT = b'\x0e'
+# Varios mensajes pequeños para el mismo destino en una sola trama. Cada uno va
+# precedido de su longitud y empieza, como siempre, por su byte de tipo.
+MSG_TYPE_BUNDLE = b'\x0f'
+
+# --- Descubrimiento de Vecinos ---
+
+# Versión del protocolo que se anuncia en los paquetes de descubrimiento.
+PROTOCOL_VERSION = 1
+
+# Capacidades que se anuncian en el descubrimiento (bits de un byte).
+CAP_RESUME = 0x01
+CAP_FOLDERS = 0x02
+CAP_COMPRESSION_ZLIB = 0x04
+CAP_COMPRESSION_LZMA = 0x08
+CAP_RELIABLE_CHAT = 0x10
+CAP_BUNDLE = 0x20
+
+# Al arrancar, el host envía DISCOVERY_PROBES sondas en broadcast separadas DISCOVERY_PROBE_SPACING
+# segundos. Cada vecino responde por unicast tras una espera al azar de hasta DISCOVERY_REPLY_JITTER
+# segundos, para que las respuestas de un segmento con muchos hosts no lleguen todas a la vez.
+DISCOVERY_PROBES = 2
+DISCOVERY_PROBE_SPACING = 0.3
+DISCOVERY_REPLY_JITTER = 0.2
+
+# Intervalo mínimo y máximo, en segundos, entre dos anuncios periódicos. El intervalo se duplica
+# mientras la red no cambia, y el anuncio se suprime si en el intervalo ya se han oído
+# DISCOVERY_REDUNDANCY anuncios de otros hosts.
+DISCOVERY_INTERVAL = 10
+DISCOVERY_MAX_INTERVAL = 60
+DISCOVERY_REDUNDANCY = 3
+
+# A un vecino del que no se sabe nada desde hace PEER_PROBE_AFTER segundos se le envía una sonda
+# unicast cada PEER_PROBE_INTERVAL segundos. Si en PEER_TIMEOUT segundos no responde, se quita de la lista.
+PEER_PROBE_AFTER = 2 * DISCOVERY_INTERVAL
+PEER_PROBE_INTERVAL = 5
+PEER_TIMEOUT = 3 * DISCOVERY_INTERVAL + 5
+
+# --- Chat Fiable ---
+
+# Los mensajes privados a vecinos que anuncian CAP_RELIABLE_CHAT se confirman y se reenvían
+# si se pierden. Los mensajes a toda la red siguen sin confirmación.
+CHAT_RELIABLE = True
+
+# Mensajes por vecino que pueden esperar confirmación a la vez; el resto espera en cola.
+CHAT_WINDOW = 32
+
+# El receptor espera estos segundos antes de confirmar, para confirmar varios mensajes en una trama.
+CHAT_ACK_DELAY = 0.02
+
+# Segundos antes del primer reenvío (se duplican con cada intento, hasta CHAT_MAX_RETRY_TIMEOUT).
+# Si se conoce el RTT del vecino, el primer reenvío se ajusta a él sin bajar de CHAT_MIN_RETRY_TIMEOUT.
+CHAT_RETRY_TIMEOUT = 0.25
+CHAT_MIN_RETRY_TIMEOUT = 0.05
+CHAT_MAX_RETRY_TIMEOUT = 4.0
+
+# Reenvíos sin confirmación antes de dar el mensaje por no entregado.
+CHAT_MAX_RETRIES = 8
+
+# --- Fragmentación de Mensajes ---
+
+# Tamaño máximo de un mensaje fragmentado (chat o control), en bytes.
+FRAGMENT_MAX_MESSAGE = 1024 * 1024
+
+# El receptor guarda como mucho FRAGMENT_MAX_PARTIAL mensajes a medias que entre todos
+# no pasen de FRAGMENT_REASSEMBLY_BYTES, y descarta los que no se completan en FRAGMENT_TIMEOUT segundos.
+FRAGMENT_MAX_PARTIAL = 64
+FRAGMENT_REASSEMBLY_BYTES = 4 * 1024 * 1024
+FRAGMENT_TIMEOUT = 5.0
+
+# --- Agrupación de Mensajes ---
+
+# Los mensajes de chat y de control de hasta COALESCE_MAX_MESSAGE bytes para un mismo vecino
+# esperan como mucho COALESCE_DELAY segundos a otros con el mismo destino y salen juntos en
+# una trama BUNDLE. Solo se agrupan los unicast a vecinos que anuncian CAP_BUNDLE.
+# Los trozos de archivo y sus SACK nunca esperan.
+COALESCE_ENABLED = True
+COALESCE_DELAY = 0.0015
+COALESCE_MAX_MESSAGE = 512
 
 # --- Configuración de Transferencia de Archivos ---
 
 # Define el tamaño máximo en bytes de cada trozo de archivo que enviamos.
 # El tamaño de trama Ethernet estándar es 1518 bytes. Restamos la cabecera (14),
 # el tipo de mensaje (1), el número de secuencia (4) y un margen de seguridad.
+# Es el tamaño que se usa cuando no se puede negociar otro con el receptor.
 FILE_CHUNK_SIZE = 1400
 
+# Bytes que ocupa la cabecera de un paquete FILE_DATA:
+# tipo (1) + id de transferencia (4) + número de secuencia (4).
+FILE_DATA_HEADER_SIZE = 9
+
+# Límite superior del tamaño de trozo negociado (jumbo frames de hasta 9000 bytes de MTU).
+MAX_FILE_CHUNK_SIZE = 9000 - FILE_DATA_HEADER_SIZE
+
+# Qué anuncia un FILE_START (byte de tipo de elemento).
+FILE_KIND_FILE = b'\x00'
+# Una carpeta no se empaqueta: el FILE_START anuncia la carpeta y su tamaño total y cada
+# archivo viaja después como una entrada, con su propia transferencia y su ruta relativa.
+FILE_KIND_FOLDER = b'\x01'
+FILE_KIND_FOLDER_ENTRY = b'\x02'
+# Subcarpeta vacía dentro de una carpeta (no lleva datos).
+FILE_KIND_FOLDER_DIR = b'\x03'
+
 # Define el tiempo en segundos que el emisor esperará la aceptación del receptor
 # antes de cancelar la solicitud de envío de archivo.
 FILE_TRANSFER_TIMEOUT = 30
 
+# Máximo de bytes enviados y todavía sin confirmar (ventana deslizante).
+# La ventana en trozos depende del tamaño de trozo negociado: con jumbo frames
+# hay menos trozos en vuelo, para no desbordar el búfer de recepción del otro lado.
+FILE_WINDOW_BYTES = 256 * 1024
+
+# El receptor envía un SACK cada vez que recibe esta cantidad de trozos en orden
+# (o menos, si la ventana es pequeña). Si detecta huecos o duplicados, responde de inmediato.
+FILE_ACK_EVERY = 16
+
+# Trozos nuevos que una transferencia prepara de una vez y entrega al hilo de envío.
+FILE_SEND_QUANTUM = 16
+
+# Ventana de congestión inicial y mínima, en trozos. El emisor la ajusta con lo que le
+# cuentan los SACK del receptor: crece mientras no hay pérdidas y se reduce a la mitad con cada una.
+FILE_INITIAL_CWND = 16
+FILE_MIN_CWND = 4
+
+# Tiempo máximo en segundos que el emisor espera un SACK antes de reenviar lo que sigue en vuelo.
+# El tiempo real se ajusta al RTT medido, pero nunca baja de FILE_MIN_RETRANSMIT_TIMEOUT.
+FILE_RETRANSMIT_TIMEOUT = 0.2
+FILE_MIN_RETRANSMIT_TIMEOUT = 0.005
+
+# Número de reenvíos seguidos sin respuesta antes de abortar la transferencia.
+FILE_MAX_RETRIES = 25
+
+# Hilos que finalizan las descargas completas (verificación del resumen, cambio de
+# propietario y confirmación) sin detener la recepción de tramas.
+FINALIZE_WORKERS = 2
+
+# --- Límites de Velocidad ---
+
+# Límite global de los envíos de archivos, en bytes por segundo (None = sin límite).
+# El chat y el descubrimiento no cuentan y nunca esperan detrás de una transferencia.
+FILE_RATE_LIMIT = None
+
+# Límites por vecino, en bytes por segundo: {"aa:bb:cc:dd:ee:ff": 1_000_000}.
+FILE_PEER_RATE_LIMITS = {}
+
+# Ráfaga máxima que se permite por encima del límite, en bytes.
+FILE_RATE_BURST = 64 * 1024
+
+# --- Compresión de Trozos ---
+
+# Compresión que se propone en cada transferencia: 'zlib', 'lzma' o None para no comprimir.
+# Compensa cuando el enlace es más lento que la CPU; 'lzma' comprime algo más pero es mucho más lenta.
+FILE_COMPRESSION = 'zlib'
+FILE_COMPRESSION_LEVEL = 1
+
+# Antes de proponerla, el emisor comprime unas muestras del archivo. Si no se reducen
+# al menos a esta fracción de su tamaño (datos ya comprimidos, cifrados...), no se comprime.
+FILE_COMPRESSION_SAMPLES = 8
+FILE_COMPRESSION_SAMPLE_SIZE = 64 * 1024
+FILE_COMPRESSION_MAX_RATIO = 0.9
+
+# --- Reanudación y Verificación de Transferencias ---
+
+# Algoritmo del resumen (hash) que identifica el contenido de un archivo y con el que
+# el receptor comprueba que el archivo completo llegó íntegro.
+FILE_DIGEST_ALGORITHM = 'sha256'
+FILE_DIGEST_SIZE = 32
+
+# Junto a cada descarga a medias se guarda un checkpoint con los trozos ya recibidos.
+# Un FILE_START posterior con el mismo tamaño y resumen continúa desde ahí.
+FILE_CHECKPOINT_SUFFIX = '.linkchat-part'
+
+# Segundos entre dos checkpoints de una descarga en curso.
+FILE_CHECKPOINT_INTERVAL = 1.0
+
+# Segundos sin recibir nada del emisor tras los que una descarga se da por abandonada:
+# se guarda su checkpoint, se cierra su archivo y se retira (un FILE_START posterior la reanuda).
+FILE_IDLE_TIMEOUT = 120.0
+
+# Estado que el receptor devuelve en el FILE_DONE.
+FILE_DONE_OK = 0
+FILE_DONE_CORRUPT = 1
+
+# --- Planificador de Envíos ---
+
+# Bytes que cada transferencia puede enviar en su turno antes de cederlo a las demás
+# (Deficit Round Robin). El control y el chat siempre salen antes que los trozos de archivo.
+SEND_DRR_QUANTUM = 16 * 1500
+
+# Bytes de trozos de archivo que cada transferencia puede tener esperando en el hilo de envío.
+# Al llenarse, el emisor se detiene hasta que salgan: la cola nunca crece sin límite.
+SEND_FLOW_QUEUE_BYTES = 64 * 1024
+
+# Tramas de control o de chat que el hilo de envío saca de la cola de una vez.
+SEND_BATCH_FRAMES = 32
+
+# --- Motor de Red ---
+
+# Cómo se organiza el trabajo de red:
+#  - 'threads': un hilo receptor, uno de descubrimiento, uno de chat y uno por cada archivo que se envía.
+#  - 'asyncio': un único bucle de eventos (más el hilo de envío) en el que la recepción, el
+#    descubrimiento, los temporizadores y cada transferencia son tareas. Escala a cientos de
+#    transferencias simultáneas sin un hilo por cada una.
+# Se puede cambiar sin tocar el código con la variable de entorno NETWORK_ENGINE.
+NETWORK_ENGINE = 'threads'
+
+# --- Interfaz Gráfica ---
+
+# Eventos de la cola de la GUI que se procesan de una vez; si quedan más, se sigue
+# después de que Tk repinte, para que la ventana no se congele con una avalancha.
+GUI_EVENT_BATCH = 200
+
+# Segundos entre avisos de progreso de las descargas a la GUI (como mucho).
+GUI_PROGRESS_INTERVAL = 0.25
+
+# Si Tk no puede vigilar descriptores (createfilehandler), la cola se revisa cada tantos milisegundos.
+GUI_POLL_INTERVAL_MS = 250
+
+# --- Historial del Chat ---
+
+# Líneas que se guardan en memoria y que muestra la ventana de chat. Las más antiguas
+# se quitan de la ventana, pero siguen en el archivo de historial y se pueden buscar.
+HISTORY_MAX_LINES = 2000
+
+# Archivo en el que se guarda todo el historial (None para no guardarlo en disco).
+HISTORY_FILE = 'linkchat_history.log'
+
+# Al pasar de este tamaño el archivo rota y se conserva solo el anterior ('.1').
+HISTORY_FILE_MAX_BYTES = 16 * 1024 * 1024
+
+# Resultados que devuelve como mucho una búsqueda en el historial.
+HISTORY_SEARCH_LIMIT = 100
+
+# --- Métricas ---
+
+# Socket Unix en el que se sirven las métricas: cada conexión recibe una instantánea en
+# JSON y se cierra (por ejemplo, 'socat - UNIX-CONNECT:/run/linkchat-metrics.sock').
+# None para no abrirlo. Se puede cambiar con la variable de entorno METRICS_SOCKET.
+METRICS_SOCKET = None
+
+# Archivo en el que se escribe una instantánea en JSON cada METRICS_SNAPSHOT_INTERVAL
+# segundos, para quien prefiera leer un archivo. None para no escribirlo.
+# Se puede cambiar con la variable de entorno METRICS_SNAPSHOT_FILE.
+METRICS_SNAPSHOT_FILE = None
+METRICS_SNAPSHOT_INTERVAL = 10.0
+
+# Últimos sucesos (vecinos que llegan o se van, transferencias que empiezan o terminan,
+# errores de recepción) que se guardan para la traza.
+METRICS_TRACE_EVENTS = 500
+
+# Transferencias terminadas de las que se conservan las estadísticas.
+METRICS_RECENT_TRANSFERS = 50
+
+# --- Modo Demonio ---
+
+# Interfaz de red de los modos sin ventana (CLI y DAEMON). Se puede cambiar con la
+# variable de entorno INTERFACE.
+HEADLESS_INTERFACE = 'eth0'
+
+# Socket Unix de la API de control del demonio (RUN_MODE=DAEMON): cada línea es una
+# petición en JSON y cada respuesta otra línea. Se puede cambiar con la variable de
+# entorno DAEMON_SOCKET. Solo pueden conectarse el dueño y su grupo.
+DAEMON_SOCKET = '/tmp/linkchat.sock'
+DAEMON_SOCKET_MODE = 0o660
+
+# Si es False, las solicitudes de archivo entrantes no se aceptan solas: se avisan a los
+# suscriptores con un evento 'file_request' y se aceptan con la orden 'accept'.
+DAEMON_AUTO_ACCEPT = True
+
+# Eventos que puede acumular un suscriptor que no lee. Si se pasa, se le desconecta
+# para no frenar a los demás.
+DAEMON_SUBSCRIBER_QUEUE = 10000
+
+# --- Configuración de Recepción ---
+
+# Usar un anillo PACKET_RX_RING (TPACKET_V3) compartido con el kernel para recibir
+# tramas por bloques. Si no está disponible se usa recv_into con búferes preasignados.
+RX_RING_ENABLED = True
+
+# Tamaño de cada bloque del anillo (múltiplo del tamaño de página) y número de bloques.
+RX_RING_BLOCK_SIZE = 1 << 20
+RX_RING_BLOCK_COUNT = 8
+
+# Milisegundos que espera el kernel antes de entregar un bloque que no se ha llenado.
+# Es la latencia máxima que añade el anillo a un mensaje suelto.
+RX_RING_BLOCK_TIMEOUT_MS = 1
+
+# Tramas que se leen de una vez sin bloquear cuando no hay anillo.
+RX_BATCH_SIZE = 64
+
+# Tamaño pedido para el búfer de recepción del socket cuando no hay anillo.
+RX_SOCKET_BUFFER_SIZE = 4 << 20
+
 # --- Constantes de Red ---
 
+# Tamaño de la cabecera Ethernet: MAC destino (6) + MAC origen (6) + EtherType (2).
+ETH_HEADER_SIZE = 14
+
+# MTU que se asume si no se puede consultar la de la interfaz.
+DEFAULT_MTU = 1500
+
 # Dirección MAC para broadcast (enviar a todos en la red local).
-BROADCAST_MAC = b'\xff\xff\xff\xff\xff\xff'
\ No newline at end of file
+BROADCAST_MAC = b'\xff\xff\xff\xff\xff\xff'
@@ -0,0 +1,403 @@
+"""
+Modo demonio de Link-Chat: sin ventana ni terminal, controlado por un socket Unix.
+
+Cada línea que llega por el socket es una petición en JSON y cada respuesta es otra línea:
+    -> {"id": 1, "cmd": "send_file", "to": 0, "path": "/datos/informe.pdf"}
+    <- {"id": 1, "ok": true, "result": {"transfer_id": 123456, "name": "informe.pdf"}}
+    <- {"id": 2, "ok": false, "error": "vecino desconocido: 7"}
+
+Órdenes:
+    peers                               Vecinos descubiertos.
+    send_message  to?, text             Mensaje privado ('to') o a todos (sin 'to').
+    send_file     to, path              Envía un archivo o una carpeta.
+    transfers                           Transferencias en curso y terminadas.
+    accept        peer, transfer_id     Acepta una solicitud entrante (con DAEMON_AUTO_ACCEPT = False).
+    reject        peer, transfer_id     La descarta.
+    stats                               Instantánea de las métricas.
+    subscribe     events?               Convierte la conexión en un flujo de eventos.
+
+'to' y 'peer' pueden ser el id del vecino (como en /list) o su MAC ("aa:bb:cc:dd:ee:ff").
+
+También sirve de cliente para scripts:
+    python3 daemon.py peers
+    python3 daemon.py send_file to=0 path=/datos/informe.pdf
+    python3 daemon.py subscribe
+"""
+import json
+import os
+import queue
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from config import *
+from utils import mac_bits_cadena, mac_cadena_bits
+from metrics import open_unix_listener
+from network_threads import (start_file_transfer, start_folder_transfer, send_chat, accept_incoming_request,
+                             build_file_ack_payload)
+
+
+def event_to_json(event):
+    """
+    Convierte un evento de la cola de la GUI en un diccionario para los suscriptores.
+    Returns:
+        dict | None: El evento, o None si no se publica.
+    """
+    kind = event[0]
+    if kind in ('new_user', 'user_left'):
+        return {"event": kind, "peer": mac_bits_cadena(event[1])}
+    if kind == 'chat_message':
+        return {"event": kind, "text": event[1]}
+    if kind in ('file_download_started', 'file_received', 'folder_received'):
+        return {"event": kind, "name": event[1]}
+    if kind == 'file_sent':
+        return {"event": kind, "name": event[1], "stats": event[2]}
+    if kind == 'file_send_failed':
+        return {"event": kind, "name": event[1], "message": event[2]}
+    if kind == 'file_request':
+        _, src_mac, transfer_id, file_name, file_size, is_folder = event[:6]
+        return {"event": kind, "peer": mac_bits_cadena(src_mac), "transfer_id": transfer_id,
+                "name": file_name, "size": file_size, "is_folder": is_folder}
+    if kind == 'error':
+        return {"event": kind, "message": event[1]}
+    return None
+
+
+class _Subscriber:
+    """Una conexión suscrita a los eventos, con su propia cola acotada."""
+    def __init__(self, events):
+        self.events = set(events) if events else None
+        self.queue = queue.Queue(DAEMON_SUBSCRIBER_QUEUE)
+        self.overflowed = False
+
+    def offer(self, item):
+        if self.events is not None and item['event'] not in self.events:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # No lee: se le desconecta en lugar de frenar a los demás
+            self.overflowed = True
+
+
+class ControlServer:
+    """
+    API de control del demonio sobre un socket Unix, apoyada en el mismo app_state que la GUI
+    y el CLI. Un hilo recoge los eventos de la cola de la GUI (guarda el chat en el historial,
+    anota las solicitudes pendientes y los reparte a los suscriptores) y cada cliente tiene
+    su propio hilo, así muchos scripts pueden usar el mismo proceso a la vez.
+    """
+    def __init__(self, state, path=DAEMON_SOCKET):
+        self.state = state
+        self.path = path
+        self._server = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # Solicitudes entrantes que esperan 'accept' o 'reject': {(mac, id): (hora de llegada, evento)}
+        self._offers = {}
+        self._commands = {
+            "peers": self._cmd_peers,
+            "send_message": self._cmd_send_message,
+            "send_file": self._cmd_send_file,
+            "transfers": self._cmd_transfers,
+            "accept": self._cmd_accept,
+            "reject": self._cmd_reject,
+            "stats": self._cmd_stats,
+        }
+
+    def start(self):
+        """Abre el socket y arranca el hilo de eventos. Las conexiones se atienden con serve_forever()."""
+        self._server = open_unix_listener(self.path, DAEMON_SOCKET_MODE)
+        threading.Thread(target=self._pump_events, daemon=True).start()
+
+    def serve_forever(self):
+        """Acepta clientes hasta que se llame a close()."""
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    # --- Eventos ---
+
+    def _pump_events(self):
+        gui_queue = self.state['gui_queue']
+        while True:
+            event = gui_queue.get()
+            try:
+                if event[0] == 'chat_message':
+                    self.state['history'].add(event[1])
+                elif event[0] == 'file_request':
+                    with self._lock:
+                        self._expire_offers()
+                        self._offers[(event[1], event[2])] = (time.monotonic(), event)
+                elif event[0] == 'user_left':
+                    # Las solicitudes de un vecino que se fue ya no se pueden aceptar
+                    with self._lock:
+                        for key in [key for key in self._offers if key[0] == event[1]]:
+                            del self._offers[key]
+                if event[0] == 'progress':
+                    # El evento no trae datos: se leen los contadores de las descargas
+                    item = {"event": "progress", "downloads": [
+                        {"name": name, "bytes": done, "size": size}
+                        for name, done, size in self.state['transfer_progress'].snapshot()]}
+                else:
+                    item = event_to_json(event)
+                if item is not None:
+                    with self._lock:
+                        subscribers = list(self._subscribers)
+                    for subscriber in subscribers:
+                        subscriber.offer(item)
+            except Exception as e:
+                print(f"Error procesando evento {event[0]}: {e}")
+            finally:
+                gui_queue.task_done()
+
+    # --- Clientes ---
+
+    def _serve_client(self, conn):
+        with conn:
+            reader = conn.makefile('r', encoding='utf-8')
+            for line in reader:
+                if not line.strip():
+                    continue
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("cada petición debe ser un objeto JSON")
+                    request_id = request.get('id')
+                    command = request.get('cmd')
+                    if command == 'subscribe':
+                        self._stream_events(conn, request_id, request.get('events'))
+                        return
+                    handler = self._commands.get(command)
+                    if handler is None:
+                        raise ValueError(f"orden desconocida: {command}")
+                    response = {"id": request_id, "ok": True, "result": handler(request)}
+                except KeyError as e:
+                    response = {"id": request_id, "ok": False, "error": f"falta el campo {e}"}
+                except (ValueError, TypeError, OSError) as e:
+                    response = {"id": request_id, "ok": False, "error": str(e)}
+                try:
+                    conn.sendall(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                except OSError:
+                    return
+
+    def _stream_events(self, conn, request_id, events):
+        subscriber = _Subscriber(events)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            conn.sendall(json.dumps({"id": request_id, "ok": True, "result": "subscribed"}).encode('utf-8') + b'\n')
+            while not subscriber.overflowed:
+                try:
+                    item = subscriber.queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                conn.sendall(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n')
+            conn.sendall(b'{"event": "overflow"}\n')
+        except OSError:
+            # El cliente se fue
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    # --- Órdenes ---
+
+    def _peer_mac(self, value):
+        # Un id de /list o una MAC en texto
+        if isinstance(value, int):
+            mac = self.state['peers'].mac_for_id(value)
+        else:
+            try:
+                mac = mac_cadena_bits(str(value))
+            except ValueError:
+                mac = None
+            if mac is not None and (len(mac) != 6 or mac not in self.state['peers']):
+                mac = None
+        if mac is None:
+            raise ValueError(f"vecino desconocido: {value}")
+        return mac
+
+    def _cmd_peers(self, request):
+        now = time.monotonic()
+        return [{
+            "id": peer['id'],
+            "mac": mac_bits_cadena(peer['mac']),
+            "last_seen": now - peer['last_seen'],
+            "rtt_ms": peer['rtt'] * 1000 if peer['rtt'] is not None else None,
+            "mtu": peer['caps']['mtu'] if peer['caps'] else None,
+        } for peer in self.state['peers'].snapshot()]
+
+    def _cmd_send_message(self, request):
+        state = self.state
+        dest_mac = self._peer_mac(request['to']) if request.get('to') is not None else BROADCAST_MAC
+        send_chat(state['socket'], state['my_mac'], state, dest_mac, str(request['text']).encode('utf-8'))
+        return None
+
+    def _cmd_send_file(self, request):
+        state = self.state
+        dest_mac = self._peer_mac(request['to'])
+        path = os.path.abspath(request['path'])
+        if not os.path.exists(path):
+            raise ValueError(f"no existe: {path}")
+        if os.path.isdir(path):
+            transfer_id = start_folder_transfer(state['socket'], state['my_mac'], state, dest_mac, path)
+        else:
+            transfer_id = start_file_transfer(state['socket'], state['my_mac'], state, dest_mac, path)
+        return {"transfer_id": transfer_id, "name": os.path.basename(os.path.normpath(path))}
+
+    def _cmd_transfers(self, request):
+        state = self.state
+        with state['file_transfer_lock']:
+            outgoing = [{"peer": mac_bits_cadena(mac), "transfer_id": transfer_id, "status": transfer['status']}
+                        for (mac, transfer_id), transfer in state['file_transfer_state'].items()]
+        with state['pending_file_requests_lock']:
+            incoming = [{"peer": mac_bits_cadena(mac), "transfer_id": transfer_id, "name": request['file_name'],
+                         "size": request['file_size'], "bytes": request['downloaded_size'],
+                         "status": request.get('status')}
+                        for (mac, transfer_id), request in state['pending_file_requests'].items()]
+        with self._lock:
+            self._expire_offers()
+            offers = [{"peer": mac_bits_cadena(event[1]), "transfer_id": event[2], "name": event[3], "size": event[4]}
+                      for _, event in self._offers.values()]
+        # Velocidad y resultado de cada transferencia, de las métricas
+        history = state['metrics'].snapshot()['transfers']
+        return {"outgoing": outgoing, "incoming": incoming, "offers": offers,
+                "active": history['active'], "recent": history['recent']}
+
+    def _take_offer(self, request):
+        key = (self._offer_mac(request['peer']), int(request['transfer_id']))
+        with self._lock:
+            self._expire_offers()
+            offer = self._offers.pop(key, None)
+        if offer is None:
+            raise ValueError(f"no hay ninguna solicitud {request['transfer_id']} de {request['peer']}")
+        return offer[1]
+
+    def _expire_offers(self):
+        # Con self._lock tomado. El emisor deja de esperar el ACK a los FILE_TRANSFER_TIMEOUT
+        # segundos: una solicitud más antigua ya no se puede aceptar.
+        oldest = time.monotonic() - FILE_TRANSFER_TIMEOUT
+        for key in [key for key, (received_at, _) in self._offers.items() if received_at < oldest]:
+            del self._offers[key]
+
+    def _offer_mac(self, value):
+        # El vecino de una solicitud puede haberse ido de la tabla: se admite la MAC tal cual
+        if isinstance(value, str) and ':' in value:
+            return mac_cadena_bits(value)
+        return self._peer_mac(value)
+
+    def _cmd_accept(self, request):
+        state = self.state
+        _, src_mac, transfer_id, file_name, file_size, is_folder, chunk_size, digest, codec = self._take_offer(request)
+        kind = FILE_KIND_FOLDER if is_folder else FILE_KIND_FILE
+        incoming = accept_incoming_request(state, src_mac, transfer_id, file_name, file_size, kind,
+                                           chunk_size, digest, codec)
+        eth_header = struct.pack('!6s6sH', src_mac, state['my_mac'], LINK_CHAT_ETHERTYPE)
+        state['send_scheduler'].send(eth_header + MSG_TYPE_FILE_ACK + build_file_ack_payload(
+            transfer_id, incoming['chunk_size'], incoming['window'].cumulative, incoming['codec']))
+        return {"name": file_name, "resumed_from": incoming['downloaded_size']}
+
+    def _cmd_reject(self, request):
+        # Sin ACK, el emisor desiste cuando se le acaba la espera
+        self._take_offer(request)
+        return None
+
+    def _cmd_stats(self, request):
+        return self.state['metrics'].snapshot()
+
+
+def start_daemon_mode(app_state, path=None):
+    """
+    Función principal del modo demonio: atiende la API de control hasta recibir SIGTERM o SIGINT.
+    """
+    server = ControlServer(app_state, path or os.environ.get('DAEMON_SOCKET', DAEMON_SOCKET))
+    server.start()
+
+    # SIGTERM (systemd, docker stop) termina igual que Ctrl+C
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Modo demonio iniciado. API de control en {server.path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nSaliendo...")
+    finally:
+        server.close()
+
+
+# --- Cliente ---
+
+def request(command, socket_path=None, **arguments):
+    """
+    Envía una orden al demonio y devuelve su resultado.
+    Raises:
+        RuntimeError: Si el demonio responde con un error.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path or os.environ.get('DAEMON_SOCKET', DAEMON_SOCKET))
+        client.sendall(json.dumps(dict(arguments, cmd=command)).encode('utf-8') + b'\n')
+        response = json.loads(client.makefile('r', encoding='utf-8').readline())
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+    return response['result']
+
+
+def subscribe(events=None, socket_path=None):
+    """Se suscribe a los eventos del demonio y los devuelve uno a uno (generador)."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path or os.environ.get('DAEMON_SOCKET', DAEMON_SOCKET))
+        client.sendall(json.dumps({"cmd": "subscribe", "events": events}).encode('utf-8') + b'\n')
+        reader = client.makefile('r', encoding='utf-8')
+        reader.readline()
+        for line in reader:
+            yield json.loads(line)
+
+
+def _parse_argument(text):
+    # clave=valor; los valores que parecen JSON (números, true...) se convierten
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    command = sys.argv[1]
+    try:
+        if command == 'subscribe':
+            events = sys.argv[2].split(',') if len(sys.argv) > 2 else None
+            for event in subscribe(events):
+                print(json.dumps(event, ensure_ascii=False), flush=True)
+            return
+        arguments = dict(_parse_argument(argument) for argument in sys.argv[2:])
+        print(json.dumps(request(command, **arguments), indent=2, ensure_ascii=False))
+    except (OSError, RuntimeError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
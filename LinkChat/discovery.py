@@ -0,0 +1,97 @@
+import itertools
+import random
+import threading
+import time
+
+
+class Discovery:
+    """
+    Decide cuándo anunciarse y lleva la cuenta de las sondas enviadas.
+    No envía nada por sí misma: el hilo de descubrimiento le pregunta qué hacer.
+
+    Los anuncios siguen el algoritmo Trickle (RFC 6206): el intervalo empieza en
+    min_interval y se duplica hasta max_interval; dentro de cada intervalo el anuncio
+    sale en un instante al azar de su segunda mitad y se suprime si ya se han oído
+    'redundancy' anuncios de otros. Así, en un segmento con muchos hosts solo unos
+    pocos se anuncian en cada intervalo, en lugar de todos a la vez.
+    """
+    def __init__(self, min_interval, max_interval, redundancy):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.redundancy = redundancy
+        self._lock = threading.Lock()
+        self.interval = min_interval
+        self.sent = 0
+        self.suppressed = 0
+        self._start_interval(time.monotonic())
+        # Sondas en curso: {nonce: hora de envío}
+        self._probes = {}
+        self._nonces = itertools.count(random.getrandbits(31))
+
+    def _start_interval(self, now):
+        self.interval_start = now
+        self.fire_at = now + random.uniform(self.interval / 2, self.interval)
+        self.fired = False
+        self.heard = 0
+
+    def heard_announcement(self, new_peer=False):
+        """
+        Cuenta un anuncio oído en el intervalo actual. Si lo envía un vecino desconocido
+        la red ha cambiado y se vuelve al intervalo mínimo para que se note antes.
+        """
+        with self._lock:
+            self.heard += 1
+            if new_peer and self.interval > self.min_interval:
+                self.interval = self.min_interval
+                self._start_interval(time.monotonic())
+
+    def poll(self):
+        """
+        Avanza el temporizador.
+        Returns:
+            tuple: (announce, wait). announce indica si hay que anunciarse ahora;
+            wait son los segundos hasta el siguiente instante en que hay algo que decidir.
+        """
+        now = time.monotonic()
+        announce = False
+        with self._lock:
+            if not self.fired and now >= self.fire_at:
+                self.fired = True
+                announce = self.heard < self.redundancy
+                if announce:
+                    self.sent += 1
+                else:
+                    self.suppressed += 1
+            interval_end = self.interval_start + self.interval
+            if now >= interval_end:
+                self.interval = min(self.interval * 2, self.max_interval)
+                self._start_interval(now)
+                interval_end = now + self.interval
+            next_event = interval_end if self.fired else self.fire_at
+        return announce, max(0.0, next_event - now)
+
+    def new_probe(self):
+        """Registra una sonda que va a salir y devuelve su identificador."""
+        now = time.monotonic()
+        nonce = next(self._nonces) & 0xFFFFFFFF
+        with self._lock:
+            # Las respuestas a sondas viejas ya no sirven para medir nada
+            for old in [n for n, sent in self._probes.items() if now - sent > self.max_interval]:
+                del self._probes[old]
+            self._probes[nonce] = now
+        return nonce
+
+    def probe_rtt(self, nonce, held):
+        """
+        Calcula el RTT a partir de la respuesta a una sonda.
+        Args:
+            nonce (int): El identificador de la sonda que se responde.
+            held (float): Segundos que el vecino retuvo la respuesta antes de enviarla.
+        Returns:
+            float | None: El RTT en segundos, o None si la sonda no es nuestra.
+        """
+        with self._lock:
+            sent = self._probes.get(nonce)
+        if sent is None:
+            return None
+        return max(0.0, time.monotonic() - sent - held)
@@ -0,0 +1,68 @@
+import time
+
+
+class Dispatcher:
+    """
+    Tabla de despacho de mensajes indexada por el byte de tipo.
+    Cada tipo tiene su manejador, un contador de tramas y el tiempo total de CPU
+    gastado en él, para saber en qué se va el tiempo del hilo receptor.
+    """
+    def __init__(self):
+        self.handlers = [None] * 256
+        self.names = {}
+        self.counts = [0] * 256
+        self.seconds = [0.0] * 256
+        # Tramas con un tipo sin manejador registrado
+        self.unknown = 0
+        # Funciones hook(msg_type, elapsed) llamadas tras cada trama
+        self.hooks = []
+
+    def register(self, msg_type, handler, name=None):
+        """
+        Registra el manejador de un tipo de mensaje.
+        Args:
+            msg_type (bytes | int): El tipo (por ejemplo MSG_TYPE_CHAT) o su valor entero.
+            handler (callable): handler(sock, my_mac, state, dest_mac, src_mac, payload).
+            name (str): Nombre legible para las estadísticas.
+        """
+        if isinstance(msg_type, (bytes, bytearray)):
+            msg_type = msg_type[0]
+        self.handlers[msg_type] = handler
+        self.names[msg_type] = name or f"0x{msg_type:02x}"
+
+    def add_hook(self, hook):
+        """Añade una función hook(msg_type, elapsed) que se llama tras procesar cada trama."""
+        self.hooks.append(hook)
+
+    def dispatch(self, msg_type, sock, my_mac, state, dest_mac, src_mac, payload):
+        """Entrega la trama al manejador de su tipo y actualiza los contadores."""
+        handler = self.handlers[msg_type]
+        if handler is None:
+            self.unknown += 1
+            return
+        start = time.perf_counter()
+        handler(sock, my_mac, state, dest_mac, src_mac, payload)
+        elapsed = time.perf_counter() - start
+        self.counts[msg_type] += 1
+        self.seconds[msg_type] += elapsed
+        for hook in self.hooks:
+            hook(msg_type, elapsed)
+
+    def stats(self):
+        """
+        Devuelve las estadísticas de los tipos que han recibido alguna trama.
+        Returns:
+            dict: {nombre: {"count", "total_ms", "avg_us"}}, más "unknown".
+        """
+        result = {}
+        for msg_type, name in self.names.items():
+            count = self.counts[msg_type]
+            if count:
+                seconds = self.seconds[msg_type]
+                result[name] = {
+                    "count": count,
+                    "total_ms": seconds * 1000,
+                    "avg_us": seconds / count * 1e6,
+                }
+        result["unknown"] = self.unknown
+        return result
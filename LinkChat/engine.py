@@ -0,0 +1,292 @@
+import asyncio
+import threading
+from collections import deque
+from config import *
+from bundle import Coalescer
+from protocol import parse_frame
+from network_threads import (setup_receive, send_thread, send_probe, run_discovery_timers, run_chat_timers,
+                             flush_coalescer, register_outgoing_transfer, send_file_steps, send_folder_steps)
+
+
+class _Mailbox:
+    """
+    Cola de SACK de una transferencia del motor asyncio. La rellenan los manejadores de
+    recepción, que corren en el bucle, y get() espera con un futuro en lugar de sondear.
+    """
+    def __init__(self, loop):
+        self._loop = loop
+        self._items = deque()
+        self._waiter = None
+
+    def put(self, item):
+        self._items.append(item)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def get_nowait(self):
+        """Devuelve el siguiente elemento, o None si la cola está vacía."""
+        return self._items.popleft() if self._items else None
+
+    async def get(self, timeout):
+        """Espera como mucho timeout segundos al siguiente elemento. Devuelve None si no llega."""
+        if not self._items:
+            self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._waiter = None
+        return self._items.popleft()
+
+
+async def _wait_event(event, timeout):
+    # Espera al evento como mucho timeout segundos (sin límite si es None) y lo rearma
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
+
+
+class AsyncEngine:
+    """
+    Motor de red sobre un bucle asyncio que corre en su propio hilo.
+    El socket se registra con loop.add_reader y cada trama se despacha en el bucle con los
+    mismos manejadores que usa el hilo receptor. El descubrimiento, los temporizadores del
+    chat y del agrupador y cada transferencia saliente son tareas; las transferencias esperan
+    sus ACK y SACK con futuros. El único hilo aparte es el de envío (state['send_scheduler']).
+
+    La GUI y el CLI lo usan desde sus propios hilos a través de los métodos seguros entre
+    hilos (start_file_transfer, start_folder_transfer, submit y call_later); send_chat y
+    el planificador de envíos ya lo eran.
+    """
+    def __init__(self, sock, my_mac, state):
+        self.sock = sock
+        self.my_mac = my_mac
+        self.state = state
+        self.loop = asyncio.new_event_loop()
+        self._thread = None
+        # Tareas vivas (el bucle solo guarda referencias débiles)
+        self._tasks = set()
+
+    def start(self):
+        """Arranca el bucle y el hilo de envío. Vuelve cuando el motor ya acepta trabajo."""
+        self.state['engine'] = self
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        sender = threading.Thread(target=send_thread, args=(self.sock, self.state), daemon=True)
+        sender.start()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._setup, ready)
+        self.loop.run_forever()
+
+    def _setup(self, ready):
+        state = self.state
+        receiver = setup_receive(self.sock, state)
+        self._ready_frames = receiver.ready_frames
+        self._dispatch = state['dispatcher'].dispatch
+        self._peer_seen = state['peers'].seen
+        # Se guarda el descriptor: al cerrar, el socket puede estar ya cerrado (fileno() daría -1)
+        self._fd = self.sock.fileno()
+        self.loop.add_reader(self._fd, self._on_readable)
+
+        state['coalescer'] = Coalescer(state.get('mtu') or DEFAULT_MTU)
+        self._spawn(self._discovery())
+        self._spawn(self._chat_timers())
+        self._spawn(self._coalescer_timers())
+        ready.set()
+
+    def close(self):
+        """
+        Deja de leer del socket y para el bucle. Las tareas pendientes se abandonan.
+        Desde otro hilo espera a que el bucle pare, así el socket se puede cerrar justo después.
+        """
+        def stop():
+            self.loop.remove_reader(self._fd)
+            self.loop.stop()
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(stop)
+            if self._thread is not threading.current_thread():
+                self._thread.join(timeout=1.0)
+
+    # --- Puente con los demás hilos ---
+
+    def submit(self, coro):
+        """
+        Lanza una corrutina en el bucle desde cualquier hilo.
+        Returns:
+            concurrent.futures.Future: Su resultado, para quien quiera esperarlo.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_later(self, delay, callback, *args):
+        """Programa callback(*args) en el bucle dentro de delay segundos, desde cualquier hilo."""
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback, *args)
+
+    def active_tasks(self):
+        """Devuelve cuántas tareas (transferencias y temporizadores) están en marcha."""
+        return len(self._tasks)
+
+    def start_file_transfer(self, dest_mac_bytes, file_path, file_name):
+        """
+        Registra la transferencia y lanza su tarea. Se puede llamar desde cualquier hilo.
+        Returns:
+            int: El id de la transferencia.
+        """
+        transfer = self._register_from_thread(dest_mac_bytes)
+        self.submit(self._file_sender(transfer, file_path, file_name))
+        return transfer['id']
+
+    def start_folder_transfer(self, dest_mac_bytes, folder_path):
+        """
+        Registra la transferencia de una carpeta y lanza su tarea. Se puede llamar desde cualquier hilo.
+        Returns:
+            int: El id de la transferencia de la carpeta.
+        """
+        transfer = self._register_from_thread(dest_mac_bytes)
+        self.submit(self._folder_sender(transfer, folder_path))
+        return transfer['id']
+
+    def _register(self, dest_mac_bytes):
+        # Solo en el hilo del bucle: en Python 3.9 un asyncio.Event se ata al bucle del hilo
+        # que lo crea, y en un hilo sin bucle ni siquiera se puede crear.
+        return register_outgoing_transfer(self.state, dest_mac_bytes, _Mailbox(self.loop), asyncio.Event())
+
+    def _register_from_thread(self, dest_mac_bytes):
+        if self._thread is threading.current_thread():
+            return self._register(dest_mac_bytes)
+        async def register():
+            return self._register(dest_mac_bytes)
+        return self.submit(register()).result()
+
+    # --- Recepción y temporizadores ---
+
+    def _spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _on_readable(self):
+        # Despacha todo lo que ya está en el socket sin bloquear el bucle
+        for frame in self._ready_frames():
+            try:
+                dest_mac, src_mac, msg_type, payload = parse_frame(frame)
+                if src_mac == self.my_mac:
+                    continue
+                self._peer_seen(src_mac)
+                self._dispatch(msg_type, self.sock, self.my_mac, self.state, dest_mac, src_mac, payload)
+            except Exception as e:
+                self.state['metrics'].inc('receive_errors')
+                self.state['metrics'].trace('receive_error', error=str(e))
+                self.state['gui_queue'].put(('error', f"Error en el bucle de recepción: {e}"))
+
+    async def _discovery(self):
+        try:
+            # Varias sondas por si alguna se pierde
+            for i in range(DISCOVERY_PROBES):
+                if i:
+                    await asyncio.sleep(DISCOVERY_PROBE_SPACING)
+                send_probe(self.sock, self.my_mac, self.state, BROADCAST_MAC)
+            while True:
+                await asyncio.sleep(run_discovery_timers(self.sock, self.my_mac, self.state))
+        except Exception as e:
+            print(f"Error en la tarea de descubrimiento: {e}")
+
+    def _wakeup_event(self):
+        # Evento del bucle que otros hilos pueden activar
+        event = asyncio.Event()
+        return event, lambda: self.loop.call_soon_threadsafe(event.set)
+
+    async def _chat_timers(self):
+        event, wake = self._wakeup_event()
+        self.state['chat'].on_wake = wake
+        try:
+            while True:
+                await _wait_event(event, run_chat_timers(self.sock, self.my_mac, self.state))
+        except Exception as e:
+            print(f"Error en la tarea de chat: {e}")
+
+    async def _coalescer_timers(self):
+        event, wake = self._wakeup_event()
+        self.state['coalescer'].on_wake = wake
+        try:
+            while True:
+                await _wait_event(event, flush_coalescer(self.my_mac, self.state))
+        except Exception as e:
+            print(f"Error en la tarea del agrupador: {e}")
+
+    # --- Transferencias salientes ---
+    # Los pasos son los de network_threads (send_file_steps y send_folder_steps); aquí solo cambia
+    # cómo se espera: con futuros del bucle y, lo que lee archivos enteros, en el pool de hilos.
+
+    async def _file_sender(self, transfer, file_path, file_name):
+        await self._run_steps(send_file_steps(self.my_mac, transfer, file_path, file_name, self.state))
+
+    async def _folder_sender(self, transfer, folder_path):
+        await self._run_steps(send_folder_steps(self.my_mac, transfer, folder_path, self.state))
+
+    async def _run_steps(self, steps):
+        # Como network_threads.run_blocking, pero cada espera es un await
+        self._tasks.add(asyncio.current_task())
+        try:
+            result = error = None
+            while True:
+                try:
+                    request = steps.send(result) if error is None else steps.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                result = error = None
+                try:
+                    result = await self._perform(*request)
+                except BaseException as e:
+                    # También la cancelación de la tarea: el generador cierra la transferencia
+                    error = e
+        finally:
+            self._tasks.discard(asyncio.current_task())
+
+    async def _perform(self, request, *args):
+        if request == 'ack':
+            transfer, timeout = args
+            if timeout:
+                return await transfer['acks'].get(timeout)
+            item = transfer['acks'].get_nowait()
+            if item is None:
+                # Cedemos el bucle a la recepción y a las demás transferencias
+                await asyncio.sleep(0)
+            return item
+        if request == 'accepted':
+            transfer, timeout = args
+            try:
+                await asyncio.wait_for(transfer['accepted'].wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        if request == 'send_bulk':
+            await self._send_bulk(*args)
+        elif request == 'pause':
+            await asyncio.sleep(args[0])
+        elif request == 'call':
+            # Leer un archivo entero bloquearía el bucle
+            return await self.loop.run_in_executor(None, args[0], *args[1:])
+        elif request == 'register':
+            return self._register(args[0])
+        return None
+
+    async def _send_bulk(self, flow, frames):
+        # Si la cola del flujo está llena, el hilo de envío nos avisa cuando haya sitio
+        scheduler = self.state['send_scheduler']
+        while True:
+            space = self.loop.create_future()
+
+            def on_space():
+                self.loop.call_soon_threadsafe(lambda: space.done() or space.set_result(None))
+
+            if scheduler.offer_bulk(flow, frames, on_space):
+                return
+            await space
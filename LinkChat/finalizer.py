@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+
+class Finalizer:
+    """
+    Pool de hilos que termina las descargas completas fuera del hilo receptor: verificar el
+    resumen de un archivo grande o cambiar el propietario de una carpeta entera puede llevar
+    segundos, y mientras tanto el receptor debe seguir vaciando el socket.
+    Como mucho 'workers' descargas se finalizan a la vez; el resto espera su turno.
+
+    Los checkpoints de las descargas en curso (fdatasync y escritura del archivo de estado)
+    tampoco se guardan en el hilo receptor: los escribe un hilo propio, aparte de los que
+    finalizan, para que una verificación larga no los retrase.
+    """
+    def __init__(self, workers=FINALIZE_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="finalizer")
+        self._checkpoints = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.checkpoints = 0
+
+    def submit(self, function, *args):
+        """Encarga function(*args). La función debe avisar ella misma de sus errores."""
+        with self._lock:
+            self.pending += 1
+        self._executor.submit(function, *args).add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def checkpoint(self, function, *args):
+        """Encarga function(*args) al hilo de los checkpoints. También debe avisar ella de sus errores."""
+        self._checkpoints.submit(function, *args).add_done_callback(self._checkpoint_done)
+
+    def _checkpoint_done(self, future):
+        with self._lock:
+            self.checkpoints += 1
+
+    def stats(self):
+        """Devuelve cuántas descargas esperan o se están finalizando, cuántas terminaron y cuántos checkpoints se guardaron."""
+        with self._lock:
+            return {"pending": self.pending, "completed": self.completed, "checkpoints": self.checkpoints}
+
+    def shutdown(self):
+        """Espera a que terminen las finalizaciones y los checkpoints en curso."""
+        self._executor.shutdown(wait=True)
+        self._checkpoints.shutdown(wait=True)
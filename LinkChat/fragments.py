@@ -0,0 +1,107 @@
+import time
+from config import *
+from protocol import FRAGMENT_HEADER
+
+# Fragmentos como mucho por mensaje: con tramas de al menos 256 bytes de datos
+# (la MTU mínima de IPv4 es 576) ningún mensaje válido necesita más.
+_MAX_FRAGMENTS = FRAGMENT_MAX_MESSAGE // 256
+
+
+def split_payload(fragment_id, payload, max_payload):
+    """
+    Parte un payload (con su byte de tipo) en fragmentos que caben en una trama.
+    Args:
+        fragment_id (int): Identificador del mensaje, único para este emisor.
+        payload (bytes): El mensaje completo.
+        max_payload (int): Tamaño máximo del payload de cada trama (tipo y cabecera incluidos).
+    Returns:
+        list: Los payloads de los fragmentos, listos para enviar en orden.
+    """
+    if len(payload) > FRAGMENT_MAX_MESSAGE:
+        raise ValueError(f"el mensaje ocupa {len(payload)} bytes y el máximo es {FRAGMENT_MAX_MESSAGE}")
+    piece = max_payload - 1 - FRAGMENT_HEADER.size
+    count = (len(payload) + piece - 1) // piece
+    if count > _MAX_FRAGMENTS:
+        raise ValueError(f"el mensaje necesitaría {count} fragmentos y el máximo es {_MAX_FRAGMENTS}")
+    return [MSG_TYPE_FRAGMENT + FRAGMENT_HEADER.pack(fragment_id, index, count)
+            + payload[index * piece:(index + 1) * piece]
+            for index in range(count)]
+
+
+class Reassembler:
+    """
+    Recompone los mensajes fragmentados. La memoria está acotada: un mensaje incompleto
+    se descarta a los 'timeout' segundos, y si hay más de 'max_messages' mensajes a medias
+    o entre todos ocupan más de 'max_bytes', se descartan los más antiguos.
+    Solo la usa el hilo receptor, así que no lleva candado.
+    """
+    def __init__(self, max_bytes=FRAGMENT_REASSEMBLY_BYTES, max_messages=FRAGMENT_MAX_PARTIAL,
+                 timeout=FRAGMENT_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.timeout = timeout
+        # {(mac, fragment_id): entrada}, en orden de llegada del primer fragmento
+        self._partial = {}
+        self.buffered = 0
+        self.completed = 0
+        self.dropped = 0
+
+    def _drop(self, key):
+        entry = self._partial.pop(key)
+        self.buffered -= entry['bytes']
+        self.dropped += 1
+
+    def add(self, src_mac, payload):
+        """
+        Añade un fragmento recibido (payload con su byte de tipo).
+        Returns:
+            bytes | None: El mensaje completo cuando llega su último fragmento; None mientras falten.
+        """
+        fragment_id, index, count = FRAGMENT_HEADER.unpack_from(payload, 1)
+        data = payload[1 + FRAGMENT_HEADER.size:]
+        now = time.monotonic()
+
+        # Los mensajes a medias están en orden de llegada: los caducados van delante
+        for key, entry in list(self._partial.items()):
+            if now - entry['started'] < self.timeout:
+                break
+            self._drop(key)
+
+        if index >= count or count > _MAX_FRAGMENTS:
+            return None
+        key = (src_mac, fragment_id)
+        entry = self._partial.get(key)
+        if entry is None:
+            if count == 1:
+                self.completed += 1
+                return bytes(data)
+            if len(self._partial) >= self.max_messages:
+                self._drop(next(iter(self._partial)))
+            entry = self._partial[key] = {"started": now, "pieces": [None] * count, "missing": count, "bytes": 0}
+        elif len(entry['pieces']) != count:
+            return None
+        if entry['pieces'][index] is not None:
+            return None
+
+        # Hacemos sitio descartando los mensajes más antiguos (nunca el actual)
+        for other in list(self._partial):
+            if self.buffered + len(data) <= self.max_bytes:
+                break
+            if other != key:
+                self._drop(other)
+        if self.buffered + len(data) > self.max_bytes:
+            self._drop(key)
+            return None
+
+        # El fragmento se copia: la trama recibida se reutiliza en cuanto volvemos
+        entry['pieces'][index] = bytes(data)
+        entry['missing'] -= 1
+        entry['bytes'] += len(data)
+        self.buffered += len(data)
+        if entry['missing']:
+            return None
+
+        del self._partial[key]
+        self.buffered -= entry['bytes']
+        self.completed += 1
+        return b''.join(entry['pieces'])
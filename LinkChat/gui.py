@@ -1,16 +1,22 @@
 import tkinter as tk
 # 1. Importar filedialog y os
-from tkinter import scrolledtext, messagebox, Listbox, END, filedialog
+from tkinter import scrolledtext, messagebox, Listbox, END, filedialog, simpledialog
 import os
 import socket
 import sys
 import threading
 import struct
-import shutil
+import queue
+import time
 # 2. Importar los nuevos tipos de mensaje y el file_sender_thread
-from config import LINK_CHAT_ETHERTYPE, BROADCAST_MAC, MSG_TYPE_CHAT, MSG_TYPE_FILE_START, MSG_TYPE_FILE_ACK
-from utils import obtener_direccion_mac, mac_bits_cadena, mac_cadena_bits
-from network_threads import receive_thread, discovery_thread, file_sender_thread
+from config import (LINK_CHAT_ETHERTYPE, BROADCAST_MAC, MSG_TYPE_FILE_ACK,
+                    FILE_KIND_FILE, FILE_KIND_FOLDER, GUI_EVENT_BATCH, GUI_POLL_INTERVAL_MS, HISTORY_MAX_LINES)
+from utils import mac_bits_cadena, mac_cadena_bits
+from network_threads import (receive_thread, send_thread, discovery_thread, chat_thread, coalescer_thread, send_chat,
+                             accept_incoming_request, build_file_ack_payload, start_file_transfer,
+                             start_folder_transfer, transfer_summary)
+from engine import AsyncEngine
+from transport import open_raw
 
 class ChatApplication(tk.Tk):
     """
@@ -61,22 +67,38 @@ class ChatApplication(tk.Tk):
             return
 
         try:
-            my_mac = obtener_direccion_mac(iface_name)
-            s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(LINK_CHAT_ETHERTYPE))
-            s.bind((iface_name, 0))
+            endpoint = open_raw(iface_name)
+            s, my_mac = endpoint.sock, endpoint.mac
 
             # Guardamos la información en el estado de la aplicación
             self.app_state['my_mac'] = my_mac
             self.app_state['socket'] = s
+            self.app_state['mtu'] = endpoint.mtu
 
-            # Iniciamos los hilos de red
-            receiver = threading.Thread(target=receive_thread, args=(s, my_mac, self.app_state))
-            receiver.daemon = True
-            receiver.start()
-
-            discoverer = threading.Thread(target=discovery_thread, args=(s, my_mac))
-            discoverer.daemon = True
-            discoverer.start()
+            if self.app_state.get('network_engine') == 'asyncio':
+                # Un bucle de eventos para recepción, temporizadores y transferencias
+                AsyncEngine(s, my_mac, self.app_state).start()
+            else:
+                # Iniciamos los hilos de red
+                receiver = threading.Thread(target=receive_thread, args=(s, my_mac, self.app_state))
+                receiver.daemon = True
+                receiver.start()
+
+                sender = threading.Thread(target=send_thread, args=(s, self.app_state))
+                sender.daemon = True
+                sender.start()
+
+                discoverer = threading.Thread(target=discovery_thread, args=(s, my_mac, self.app_state))
+                discoverer.daemon = True
+                discoverer.start()
+
+                chat_sender = threading.Thread(target=chat_thread, args=(s, my_mac, self.app_state))
+                chat_sender.daemon = True
+                chat_sender.start()
+
+                coalescer = threading.Thread(target=coalescer_thread, args=(s, my_mac, self.app_state))
+                coalescer.daemon = True
+                coalescer.start()
             
             # Cerramos la ventana de selección y mostramos la principal
             self.selection_window.destroy()
@@ -108,11 +130,17 @@ class ChatApplication(tk.Tk):
         tk.Label(users_frame, text="Usuarios Descubiertos").pack()
         self.users_listbox = Listbox(users_frame)
         self.users_listbox.pack(fill=tk.Y, expand=True)
+        # MACs de la lista, en el mismo orden que sus filas
+        self.listed_macs = []
 
         # Añadimos un botón para limpiar la selección de usuario
         clear_selection_button = tk.Button(users_frame, text="Chat General", command=self.clear_user_selection)
         clear_selection_button.pack(fill=tk.X, pady=5)
 
+        # El historial completo está en disco: la ventana solo muestra las últimas líneas
+        search_button = tk.Button(users_frame, text="Buscar en Historial", command=self.search_history)
+        search_button.pack(fill=tk.X, pady=5)
+
         chat_frame = tk.Frame(chat_area_frame)
         chat_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
@@ -143,13 +171,12 @@ class ChatApplication(tk.Tk):
         # Permitir enviar mensajes presionando la tecla 'Enter'
         self.message_entry.bind("<Return>", self.send_message_event)
 
-        self.process_incoming()
+        self.watch_incoming()
 
     def _send_packet(self, dest_mac, msg_type, payload=b''):
         """
         Función auxiliar para construir y enviar un paquete Ethernet.
         """
-        sock = self.app_state['socket']
         my_mac = self.app_state['my_mac']
         
         # Construye la cabecera Ethernet
@@ -158,75 +185,127 @@ class ChatApplication(tk.Tk):
         # Construye el paquete completo
         packet = eth_header + msg_type + payload
         
-        # Envía el paquete
-        sock.send(packet)
+        # Lo deja en la cola de control del hilo de envío
+        self.app_state['send_scheduler'].send(packet)
 
-    def process_incoming(self):
+    def watch_incoming(self):
         """
-        Revisa la cola de la GUI y actualiza la barra de estado.
+        Hace que Tk despierte a la GUI cuando hay eventos en la cola, vigilando su tubería
+        (ver WakeupQueue). Si no es posible, la cola se revisa cada GUI_POLL_INTERVAL_MS.
         """
-        # 1. Procesar eventos de la cola
-        while not self.app_state['gui_queue'].empty():
+        self._draining = False
+        self._poll_queue = True
+        gui_queue = self.app_state['gui_queue']
+        if hasattr(gui_queue, 'fileno'):
             try:
-                event = self.app_state['gui_queue'].get_nowait()
-                event_type = event[0]
-                
-                if event_type == 'new_user':
-                    mac_bytes = event[1]
-                    self.update_user_list()
-                    self.display_message(f"[Sistema] Nuevo usuario descubierto: {mac_bits_cadena(mac_bytes)}")
-                
-                elif event_type == 'chat_message':
-                    # El mensaje ya viene formateado desde el hilo de red
-                    formatted_message = event[1]
-                    self.display_message(formatted_message)
-                
-                # 2. Añadir el manejo del evento de solicitud de archivo
-                elif event_type == 'file_request':
-                    sender_mac, file_name, file_size, is_folder = event[1], event[2], event[3], event[4]
-                    self.handle_file_request(sender_mac, file_name, file_size, is_folder)
-
-                # 3. Añadir el manejo del evento de recepción de archivo completada
-                elif event_type == 'file_received':
-                    file_name = event[1]
-                    self.display_message(f"[Sistema] Archivo '{file_name}' recibido y guardado.")
-                    messagebox.showinfo("Descarga Completada", f"El archivo '{file_name}' se ha descargado correctamente.")
-                
-                # Nuevo evento para carpetas
-                elif event_type == 'folder_received':
-                    folder_name = event[1]
-                    self.display_message(f"[Sistema] Carpeta '{folder_name}' recibida y descomprimida.")
-                    messagebox.showinfo("Descarga Completada", f"La carpeta '{folder_name}' se ha descargado y descomprimido correctamente.")
-
-                elif event_type == 'error':
-                    error_message = event[1]
-                    self.display_message(f"[ERROR] {error_message}")
-
-            except Exception:
-                pass # Ignorar si la cola está vacía
+                self.tk.createfilehandler(gui_queue.fileno(), tk.READABLE,
+                                          lambda fd, mask: self.process_incoming())
+                self._poll_queue = False
+            except (AttributeError, tk.TclError):
+                pass
+        self.process_incoming()
+
+    def process_incoming(self):
+        """
+        Procesa los eventos de la cola por lotes de como mucho GUI_EVENT_BATCH.
+        """
+        gui_queue = self.app_state['gui_queue']
+        if hasattr(gui_queue, 'clear_wakeup'):
+            gui_queue.clear_wakeup()
+        # Un cuadro de diálogo abierto por un evento vuelve a procesar eventos de Tk;
+        # el lote en curso ya se encarga de lo que quede en la cola.
+        if self._draining:
+            return
+
+        self._draining = True
+        try:
+            for _ in range(GUI_EVENT_BATCH):
+                try:
+                    event = gui_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.handle_event(event)
+                except Exception:
+                    pass # Un evento mal formado no debe detener la GUI
+            else:
+                # Quedan eventos: seguimos en cuanto Tk haya repintado la ventana
+                self.after(1, self.process_incoming)
+                return
+        finally:
+            self._draining = False
+
+        if self._poll_queue:
+            self.after(GUI_POLL_INTERVAL_MS, self.process_incoming)
+
+    def handle_event(self, event):
+        """Aplica en la ventana un evento que dejó en la cola un hilo de red."""
+        event_type = event[0]
+
+        if event_type == 'new_user':
+            mac_bytes = event[1]
+            self.update_user_list()
+            self.display_message(f"[Sistema] Nuevo usuario descubierto: {mac_bits_cadena(mac_bytes)}")
+
+        elif event_type == 'user_left':
+            mac_bytes = event[1]
+            self.update_user_list()
+            self.display_message(f"[Sistema] {mac_bits_cadena(mac_bytes)} ya no está disponible.")
         
-        # 2. Actualizar la barra de estado con el progreso de la descarga
-        self.update_status_bar()
+        elif event_type == 'chat_message':
+            # El mensaje ya viene formateado desde el hilo de red
+            formatted_message = event[1]
+            self.display_message(formatted_message)
         
-        # 3. Volver a llamar a esta función
-        self.after(250, self.process_incoming) # Aumentamos un poco el tiempo a 250ms
+        # 2. Añadir el manejo del evento de solicitud de archivo
+        elif event_type == 'file_request':
+            sender_mac, transfer_id, file_name, file_size, is_folder, chunk_size, digest, codec = event[1:9]
+            self.handle_file_request(sender_mac, transfer_id, file_name, file_size, is_folder, chunk_size, digest, codec)
+
+        # 3. Añadir el manejo del evento de recepción de archivo completada
+        elif event_type == 'file_received':
+            file_name = event[1]
+            self.display_message(f"[Sistema] Archivo '{file_name}' recibido y guardado.")
+            messagebox.showinfo("Descarga Completada", f"El archivo '{file_name}' se ha descargado correctamente.")
+        
+        # Nuevo evento para carpetas
+        elif event_type == 'folder_received':
+            folder_name = event[1]
+            self.display_message(f"[Sistema] Carpeta '{folder_name}' recibida.")
+            messagebox.showinfo("Descarga Completada", f"La carpeta '{folder_name}' se ha descargado correctamente.")
+
+        # Un envío nuestro terminó: mostramos su velocidad y compresión
+        elif event_type == 'file_sent':
+            file_name, stats = event[1], event[2]
+            self.display_message(f"[Sistema] '{file_name}' enviado: {transfer_summary(stats)}.")
+
+        # Un envío nuestro falló: el mensaje ya viene formateado, como los errores
+        elif event_type == 'file_send_failed':
+            self.display_message(f"[ERROR] {event[2]}")
+
+        elif event_type == 'error':
+            error_message = event[1]
+            self.display_message(f"[ERROR] {error_message}")
+
+        # Avance de las descargas (llega, como mucho, cada GUI_PROGRESS_INTERVAL segundos)
+        elif event_type == 'progress':
+            self.update_status_bar()
+
+        # Terminó una búsqueda en el historial lanzada desde el botón
+        elif event_type == 'history_results':
+            self.show_search_results(event[1], event[2])
 
     # Nueva función para actualizar la barra de estado
     def update_status_bar(self):
         """
-        Revisa si hay descargas activas y actualiza la etiqueta de estado.
+        Muestra en la barra de estado el progreso de las descargas activas.
+        Lee los contadores publicados en 'transfer_progress', sin tomar ningún candado.
         """
         active_downloads = []
-        with self.app_state['pending_file_requests_lock']:
-            # Buscamos todas las descargas activas
-            for mac, request in self.app_state['pending_file_requests'].items():
-                file_name = request['file_name']
-                downloaded = request['downloaded_size']
-                total = request['file_size']
-                
-                if total > 0:
-                    percentage = (downloaded / total) * 100
-                    active_downloads.append(f"Descargando '{file_name}': {percentage:.1f}%")
+        for file_name, downloaded, total in self.app_state['transfer_progress'].snapshot():
+            if total > 0:
+                percentage = (downloaded / total) * 100
+                active_downloads.append(f"Descargando '{file_name}': {percentage:.1f}%")
 
         if active_downloads:
             # Si hay descargas, las mostramos
@@ -237,14 +316,23 @@ class ChatApplication(tk.Tk):
 
     def update_user_list(self):
         """
-        Limpia y vuelve a poblar la lista de usuarios con los datos de app_state.
+        Actualiza la lista de usuarios con los datos de app_state, tocando solo las filas
+        que cambian: se quitan los que se fueron y se añaden al final los nuevos.
+        Así no se redibuja la lista entera ni se pierde la selección.
         """
-        self.users_listbox.delete(0, tk.END) # Limpia la lista actual
-        
-        with self.app_state['known_hosts_lock']:
-            for mac_bytes in self.app_state['known_hosts']:
-                mac_str = mac_bits_cadena(mac_bytes)
-                self.users_listbox.insert(tk.END, mac_str)
+        current = [peer['mac'] for peer in self.app_state['peers'].snapshot()]
+        wanted = set(current)
+        # De abajo arriba, para que borrar una fila no mueva las que quedan por revisar
+        for index in range(len(self.listed_macs) - 1, -1, -1):
+            if self.listed_macs[index] not in wanted:
+                self.users_listbox.delete(index)
+                del self.listed_macs[index]
+
+        listed = set(self.listed_macs)
+        for mac in current:
+            if mac not in listed:
+                self.users_listbox.insert(tk.END, mac_bits_cadena(mac))
+                self.listed_macs.append(mac)
 
     def clear_user_selection(self):
         """Deselecciona cualquier usuario en la lista."""
@@ -266,9 +354,44 @@ class ChatApplication(tk.Tk):
 
         # Inserta el mensaje seguido de un salto de línea.
         self.chat_area.insert(tk.END, message + '\n')
+
+        # Solo se muestran las últimas HISTORY_MAX_LINES líneas; el resto sigue en el historial
+        excess = int(self.chat_area.index('end-1c').split('.')[0]) - HISTORY_MAX_LINES
+        if excess > 0:
+            self.chat_area.delete('1.0', f'{excess + 1}.0')
         
         self.chat_area.config(state='disabled')
         self.chat_area.see(tk.END) # Auto-scroll hacia abajo
+        self.app_state['history'].add(message)
+
+    def search_history(self):
+        """
+        Busca un texto en todo el historial (también en lo que ya no se muestra).
+        Leer los archivos del historial puede tardar, así que la búsqueda se hace en otro hilo
+        y los resultados vuelven por la cola de la GUI como un evento 'history_results'.
+        """
+        text = simpledialog.askstring("Buscar en Historial", "Texto a buscar:", parent=self)
+        if not text:
+            return
+        threading.Thread(target=self._search_worker, args=(text,), daemon=True).start()
+
+    def _search_worker(self, text):
+        results = self.app_state['history'].search(text)
+        self.app_state['gui_queue'].put(('history_results', text, results))
+
+    def show_search_results(self, text, results):
+        """Enseña en una ventana aparte los resultados de una búsqueda en el historial."""
+        window = tk.Toplevel(self)
+        window.title(f"Historial: '{text}'")
+        window.geometry("600x400")
+        results_area = scrolledtext.ScrolledText(window, wrap=tk.WORD)
+        results_area.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        if not results:
+            results_area.insert(tk.END, "No se encontró nada.")
+        for stamp, line in results:
+            results_area.insert(tk.END, f"[{time.strftime('%d/%m %H:%M:%S', time.localtime(stamp))}] {line}\n")
+        results_area.config(state='disabled')
+        results_area.see(tk.END)
 
     def send_message_event(self, event):
         """Manejador para el evento de la tecla Enter."""
@@ -300,7 +423,7 @@ class ChatApplication(tk.Tk):
         try:
             # 1. Enviar el paquete a la red
             payload = message.encode('utf-8')
-            self._send_packet(dest_mac_bytes, MSG_TYPE_CHAT, payload)
+            send_chat(self.app_state['socket'], self.app_state['my_mac'], self.app_state, dest_mac_bytes, payload)
 
             # 2. PONER nuestro propio mensaje en la COLA para ser procesado
             #    en el orden correcto por process_incoming.
@@ -340,27 +463,11 @@ class ChatApplication(tk.Tk):
 
             # Obtener información del archivo
             file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
-
-            # Crear el payload del paquete FILE_START: tipo (1 byte, 0=file) + tamaño (8 bytes) + nombre (utf-8) + DELIMITADOR NULO
-            is_folder_flag = b'\x00'
-            payload = is_folder_flag + struct.pack('!Q', file_size) + file_name.encode('utf-8') + b'\x00'
 
-            # Enviar la solicitud de transferencia
-            self._send_packet(dest_mac_bytes, MSG_TYPE_FILE_START, payload)
-
-            # 4. Registrar el estado de la transferencia como pendiente
-            with self.app_state['file_transfer_lock']:
-                self.app_state['file_transfer_state'][dest_mac_bytes] = {"status": "pending_ack"}
-
-            # Iniciar el hilo que gestionará el envío real del archivo
-            # Este hilo esperará el ACK antes de proceder
-            sender_thread = threading.Thread(
-                target=file_sender_thread,
-                args=(self.app_state['socket'], self.app_state['my_mac'], dest_mac_bytes, file_path, self.app_state)
-            )
-            sender_thread.daemon = True
-            sender_thread.start()
+            # Registrar la transferencia, enviar el FILE_START y lanzar el hilo emisor,
+            # que esperará el ACK antes de proceder
+            start_file_transfer(self.app_state['socket'], self.app_state['my_mac'], self.app_state,
+                                dest_mac_bytes, file_path)
 
             # Notificar al usuario en la GUI
             self.display_message(f"[Sistema] Solicitud para enviar '{file_name}' a {selected_mac_str} enviada.")
@@ -369,7 +476,7 @@ class ChatApplication(tk.Tk):
             messagebox.showerror("Error al Enviar Archivo", f"No se pudo iniciar la transferencia del archivo:\n{e}")
 
     # 3. Añadir la nueva función para gestionar la solicitud
-    def handle_file_request(self, sender_mac, file_name, file_size, is_folder):
+    def handle_file_request(self, sender_mac, transfer_id, file_name, file_size, is_folder, chunk_size, digest, codec):
         """Muestra un pop-up para aceptar o rechazar un archivo."""
         sender_mac_str = mac_bits_cadena(sender_mac)
         
@@ -384,7 +491,7 @@ class ChatApplication(tk.Tk):
         # Preguntar al usuario
         answer = messagebox.askyesno(
             "Solicitud de Archivo Entrante",
-            f"El usuario {sender_mac_str} quiere enviarte el archivo:\n\n"
+            f"El usuario {sender_mac_str} quiere enviarte {'la carpeta' if is_folder else 'el archivo'}:\n\n"
             f"Nombre: {file_name}\n"
             f"Tamaño: {size_str}\n\n"
             "¿Aceptas la transferencia?"
@@ -394,18 +501,22 @@ class ChatApplication(tk.Tk):
             # El usuario aceptó
             self.display_message(f"[Sistema] Aceptando '{file_name}' de {sender_mac_str}. Descargando...")
             
-            # Guardar la información del archivo que vamos a recibir
-            with self.app_state['pending_file_requests_lock']:
-                self.app_state['pending_file_requests'][sender_mac] = {
-                    "file_name": file_name,
-                    "file_size": file_size,
-                    "downloaded_size": 0,
-                    "path": file_name,
-                    "is_folder": is_folder
-                }
+            # Guardar la información del archivo que vamos a recibir (y reservar su espacio en disco).
+            # Si ya teníamos parte de este mismo archivo, la descarga continúa desde ahí.
+            try:
+                kind = FILE_KIND_FOLDER if is_folder else FILE_KIND_FILE
+                request = accept_incoming_request(self.app_state, sender_mac, transfer_id, file_name, file_size,
+                                                  kind, chunk_size, digest, codec)
+            except OSError as e:
+                messagebox.showerror("Error al Recibir Archivo", f"No se pudo crear '{file_name}':\n{e}")
+                return
+            if request['downloaded_size']:
+                self.display_message(f"[Sistema] Reanudando '{file_name}' desde {request['downloaded_size']} bytes.")
             
-            # Enviar el paquete de confirmación (ACK)
-            self._send_packet(sender_mac, MSG_TYPE_FILE_ACK)
+            # Enviar el paquete de confirmación (ACK) con el tamaño de trozo aceptado y desde dónde continuar
+            self._send_packet(sender_mac, MSG_TYPE_FILE_ACK,
+                              build_file_ack_payload(transfer_id, request['chunk_size'], request['window'].cumulative,
+                                                     request['codec']))
         else:
             # El usuario rechazó
             self.display_message(f"[Sistema] Rechazaste la transferencia de '{file_name}' de {sender_mac_str}.")
@@ -414,7 +525,7 @@ class ChatApplication(tk.Tk):
     # 2. Añadir la nueva función para seleccionar y enviar carpetas
     def select_folder_to_send(self):
         """
-        Abre un diálogo para seleccionar una carpeta, la comprime en un zip y la envía.
+        Abre un diálogo para seleccionar una carpeta y la envía archivo por archivo.
         """
         selection_indices = self.users_listbox.curselection()
         if not selection_indices:
@@ -425,43 +536,16 @@ class ChatApplication(tk.Tk):
         if not folder_path:
             return
 
-        # Creamos un nombre para el archivo zip temporal
-        zip_filename_base = f"temp_{os.path.basename(folder_path)}"
-        zip_path = None
-        
         try:
-            # Comprimir la carpeta en un archivo zip
-            self.display_message(f"[Sistema] Comprimiendo '{os.path.basename(folder_path)}'...")
-            zip_path = shutil.make_archive(zip_filename_base, 'zip', folder_path)
-            self.display_message(f"[Sistema] Compresión completada: {os.path.basename(zip_path)}")
-
-            # Ahora, enviamos el archivo zip como si fuera un archivo normal
+            # La carpeta no se comprime: un hilo la recorre y envía cada archivo según lo lee
             selected_mac_str = self.users_listbox.get(selection_indices[0])
             dest_mac_bytes = mac_cadena_bits(selected_mac_str)
-            file_name = os.path.basename(zip_path)
-            file_size = os.path.getsize(zip_path)
-
-            # Crear el payload del paquete FILE_START: tipo (1 byte, 1=folder) + tamaño (8 bytes) + nombre (utf-8) + DELIMITADOR NULO
-            is_folder_flag = b'\x01'
-            payload = is_folder_flag + struct.pack('!Q', file_size) + file_name.encode('utf-8') + b'\x00'
-            
-            self._send_packet(dest_mac_bytes, MSG_TYPE_FILE_START, payload)
+            folder_name = os.path.basename(os.path.normpath(folder_path))
 
-            with self.app_state['file_transfer_lock']:
-                self.app_state['file_transfer_state'][dest_mac_bytes] = {"status": "pending_ack"}
+            start_folder_transfer(self.app_state['socket'], self.app_state['my_mac'], self.app_state,
+                                  dest_mac_bytes, folder_path)
 
-            # Iniciamos el hilo de envío, indicando que es un zip temporal
-            sender_thread = threading.Thread(
-                target=file_sender_thread,
-                args=(self.app_state['socket'], self.app_state['my_mac'], dest_mac_bytes, zip_path, self.app_state, True) # is_temp_zip = True
-            )
-            sender_thread.daemon = True
-            sender_thread.start()
-
-            self.display_message(f"[Sistema] Solicitud para enviar '{file_name}' a {selected_mac_str} enviada.")
+            self.display_message(f"[Sistema] Solicitud para enviar la carpeta '{folder_name}' a {selected_mac_str} enviada.")
 
         except Exception as e:
             messagebox.showerror("Error al Enviar Carpeta", f"No se pudo iniciar la transferencia:\n{e}")
-            # Si hubo un error pero el zip se creó, lo borramos
-            if zip_path and os.path.exists(zip_path):
-                os.remove(zip_path)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import os
+import queue
+import time
+from collections import Counter
+from config import *
+
+
+class WakeupQueue(queue.Queue):
+    """
+    Cola de eventos para la GUI que además avisa por una tubería cuando llega algo.
+    La GUI vigila el extremo de lectura (fileno) y solo se despierta cuando hay trabajo;
+    tras un aviso no se escribe otro hasta que la GUI llame a clear_wakeup(), así una
+    ráfaga de eventos cuesta un solo byte en la tubería.
+    """
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        # Hay un aviso en la tubería que la GUI todavía no ha recogido
+        self._signalled = False
+        # Eventos encolados por tipo ('error', 'chat_message'...), para las métricas
+        self._counts = Counter()
+
+    def fileno(self):
+        """El descriptor que se vuelve legible cuando hay eventos."""
+        return self._read_fd
+
+    def _put(self, item):
+        # queue.Queue llama a _put con su candado (self.mutex) tomado
+        super()._put(item)
+        self._counts[item[0]] += 1
+        if not self._signalled:
+            self._signalled = True
+            try:
+                os.write(self._write_fd, b'\x00')
+            except BlockingIOError:
+                pass
+
+    def event_counts(self):
+        """Devuelve cuántos eventos de cada tipo se han encolado desde el principio."""
+        with self.mutex:
+            return dict(self._counts)
+
+    def clear_wakeup(self):
+        """Recoge el aviso. Hay que llamarla antes de vaciar la cola, no después."""
+        with self.mutex:
+            self._signalled = False
+            try:
+                os.read(self._read_fd, 64)
+            except BlockingIOError:
+                pass
+
+
+class TransferProgress:
+    """
+    Progreso de las descargas para la GUI, sin candados. El hilo receptor ya lleva los
+    contadores de cada solicitud ('downloaded_size'); aquí solo se apunta qué solicitudes
+    se están descargando y, como mucho cada 'interval' segundos, se deja en la cola de la
+    GUI un evento ('progress',) para que vuelva a pintar la barra de estado leyendo
+    esos contadores. La GUI nunca toma el candado de 'pending_file_requests'.
+    """
+    def __init__(self, gui_queue, interval=GUI_PROGRESS_INTERVAL):
+        self.gui_queue = gui_queue
+        self.interval = interval
+        # {id(solicitud): solicitud}. Asignar o quitar una clave es atómico.
+        self._active = {}
+        self._next_publish = 0.0
+
+    def advance(self, request):
+        """Anota que la descarga avanzó (request es su solicitud, o la de su carpeta)."""
+        self._active[id(request)] = request
+        now = time.monotonic()
+        if now >= self._next_publish:
+            self._next_publish = now + self.interval
+            self.gui_queue.put(('progress',))
+
+    def finish(self, request):
+        """Retira una descarga terminada, descartada o abandonada y avisa enseguida."""
+        if self._active.pop(id(request), None) is not None:
+            self.gui_queue.put(('progress',))
+
+    def snapshot(self):
+        """
+        Returns:
+            list: (nombre, bytes descargados, bytes totales) de cada descarga en curso.
+        """
+        return [(request['file_name'], request['downloaded_size'], request['file_size'])
+                for request in list(self._active.values())]
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import deque
+from config import *
+
+
+def _escape(text):
+    # Cada entrada ocupa una sola línea del archivo
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _unescape(text):
+    result = []
+    chars = iter(text)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            result.append('\n' if char == 'n' else char)
+        else:
+            result.append(char)
+    return ''.join(result)
+
+
+class ChatHistory:
+    """
+    Historial del chat con memoria acotada. En memoria solo quedan las últimas 'max_lines'
+    entradas; todas se añaden además a un archivo en disco, que es donde busca search().
+    El archivo rota al pasar de 'max_file_bytes' (se conserva el anterior con sufijo '.1'),
+    así que el disco también está acotado.
+    """
+    def __init__(self, path=HISTORY_FILE, max_lines=HISTORY_MAX_LINES, max_file_bytes=HISTORY_FILE_MAX_BYTES):
+        self.path = path
+        self.max_file_bytes = max_file_bytes
+        self.lines = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            try:
+                self._file = open(path, 'a', encoding='utf-8', buffering=1)
+            except OSError:
+                # Sin disco el historial sigue funcionando, solo que sin búsqueda completa
+                self._file = None
+
+    def add(self, text):
+        """Añade una entrada al historial (con la hora actual)."""
+        stamp = time.time()
+        with self._lock:
+            self.lines.append((stamp, text))
+            if self._file is None:
+                return
+            try:
+                self._file.write(f"{stamp:.3f}\t{_escape(text)}\n")
+                if self._file.tell() > self.max_file_bytes:
+                    self._rotate()
+            except OSError:
+                pass
+
+    def _rotate(self):
+        self._file.close()
+        os.replace(self.path, self.path + '.1')
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+
+    def recent(self, count=None):
+        """Devuelve las últimas entradas en memoria, como (hora, texto)."""
+        with self._lock:
+            lines = list(self.lines)
+        return lines if count is None else lines[-count:]
+
+    def search(self, text, limit=HISTORY_SEARCH_LIMIT):
+        """
+        Busca en todo el historial (también en lo que ya no está en memoria), sin
+        distinguir mayúsculas.
+        Returns:
+            list: Las últimas 'limit' entradas (hora, texto) que contienen el texto, de la más antigua a la más nueva.
+        """
+        needle = text.lower()
+        matches = deque(maxlen=limit)
+        if self._file is None:
+            for stamp, line in self.recent():
+                if needle in line.lower():
+                    matches.append((stamp, line))
+            return list(matches)
+
+        for path in (self.path + '.1', self.path):
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    for raw in f:
+                        stamp, _, escaped = raw.rstrip('\n').partition('\t')
+                        line = _unescape(escaped)
+                        if needle in line.lower():
+                            try:
+                                matches.append((float(stamp), line))
+                            except ValueError:
+                                # Una línea a medias (por ejemplo, tras un corte de luz)
+                                continue
+            except OSError:
+                continue
+        return list(matches)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -1,25 +1,33 @@
-import socket
 import sys
 import threading
 import os
-import queue
 import netifaces
-from config import LINK_CHAT_ETHERTYPE
-from utils import obtener_direccion_mac
-from network_threads import receive_thread, discovery_thread
+from config import (PEER_TIMEOUT, DISCOVERY_INTERVAL, DISCOVERY_MAX_INTERVAL,
+                    DISCOVERY_REDUNDANCY, FILE_RATE_LIMIT, FILE_PEER_RATE_LIMITS, FILE_RATE_BURST, NETWORK_ENGINE,
+                    METRICS_SOCKET, METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL, HEADLESS_INTERFACE)
+from utils import mac_cadena_bits
+from transport import open_raw
+from network_threads import receive_thread, send_thread, discovery_thread, chat_thread, coalescer_thread
+from send_scheduler import SendScheduler
+from gui_events import WakeupQueue, TransferProgress
+from history import ChatHistory
+from finalizer import Finalizer
+from engine import AsyncEngine
+from metrics import MetricsRegistry, watch_state, start_exporters
+from rate_limit import RateLimiter
+from peers import PeerTable
+from discovery import Discovery
+from reliable_chat import ReliableChat
 from gui import ChatApplication
 from cli import start_cli_mode # Importamos la nueva función
+from daemon import start_daemon_mode
 
 def setup_network(interface):
-    """Abre el socket y obtiene la MAC."""
+    """Abre el socket y obtiene la MAC y la MTU de la interfaz."""
     try:
-        # Crear el socket RAW
-        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(LINK_CHAT_ETHERTYPE))
-        sock.bind((interface, 0))
-        
-        # Obtener la dirección MAC
-        my_mac = obtener_direccion_mac(interface)
-        return sock, my_mac
+        # Socket RAW, con la MAC y la MTU (para ajustar el tamaño de los trozos de archivo)
+        endpoint = open_raw(interface)
+        return endpoint.sock, endpoint.mac, endpoint.mtu
     except PermissionError:
         print("[ERROR] Permiso denegado. Ejecuta el script con 'sudo'.")
         sys.exit(1)
@@ -27,44 +35,106 @@ def setup_network(interface):
         print(f"[ERROR] No se pudo inicializar la red en '{interface}': {e}")
         sys.exit(1)
 
+def start_network(app_state, interface):
+    """Abre la interfaz y arranca los hilos de red (o el motor asyncio) de los modos sin ventana."""
+    sock, my_mac, mtu = setup_network(interface)
+    app_state["socket"] = sock
+    app_state["my_mac"] = my_mac
+    app_state["mtu"] = mtu
+
+    if app_state["network_engine"] == 'asyncio':
+        # Un bucle de eventos para recepción, temporizadores y transferencias
+        AsyncEngine(sock, my_mac, app_state).start()
+        return
+
+    # Iniciar hilos de red
+    recv_thread = threading.Thread(target=receive_thread, args=(sock, my_mac, app_state), daemon=True)
+    recv_thread.start()
+
+    sender = threading.Thread(target=send_thread, args=(sock, app_state), daemon=True)
+    sender.start()
+
+    disc_thread = threading.Thread(target=discovery_thread, args=(sock, my_mac, app_state), daemon=True)
+    disc_thread.start()
+
+    chat_sender = threading.Thread(target=chat_thread, args=(sock, my_mac, app_state), daemon=True)
+    chat_sender.start()
+
+    coalescer = threading.Thread(target=coalescer_thread, args=(sock, my_mac, app_state), daemon=True)
+    coalescer.start()
+
 def main():
     """
     Función principal que inicializa y ejecuta la aplicación.
     Decide si lanzar la GUI o el modo CLI.
     """
+    # La GUI se despierta cuando llegan eventos, en lugar de revisar la cola cada poco
+    gui_queue = WakeupQueue()
+    # Contadores, esperas de los candados principales y estadísticas de cada transferencia
+    metrics = MetricsRegistry()
     app_state = {
-        "known_hosts": {},
-        "known_hosts_lock": threading.Lock(),
+        # Vecinos descubiertos: última señal, RTT, capacidades e id estable
+        "peers": PeerTable(PEER_TIMEOUT, metrics.timed_lock('peers')),
+        # Cuándo anunciarse y qué sondas de descubrimiento siguen en curso
+        "discovery": Discovery(DISCOVERY_INTERVAL, DISCOVERY_MAX_INTERVAL, DISCOVERY_REDUNDANCY),
+        # Mensajes privados pendientes de confirmación y duplicados ya vistos
+        "chat": ReliableChat(),
         "file_transfer_state": {},
-        "file_transfer_lock": threading.Lock(),
+        "file_transfer_lock": metrics.timed_lock('file_transfer'),
         "pending_file_requests": {},
-        "pending_file_requests_lock": threading.Lock(),
-        "gui_queue": queue.Queue(),
+        "pending_file_requests_lock": metrics.timed_lock('pending_file_requests'),
+        # Termina las descargas completas sin detener la recepción
+        "finalizer": Finalizer(),
+        # Único escritor del socket: colas por prioridad y reparto justo entre transferencias
+        "send_scheduler": SendScheduler(),
+        # Límites de velocidad de los envíos de archivos (global y por vecino)
+        "rate_limiter": RateLimiter(
+            FILE_RATE_LIMIT,
+            {mac_cadena_bits(mac): rate for mac, rate in FILE_PEER_RATE_LIMITS.items()},
+            FILE_RATE_BURST,
+        ),
+        "gui_queue": gui_queue,
+        # Progreso de las descargas, que la GUI lee sin candados
+        "transfer_progress": TransferProgress(gui_queue),
+        # Últimas líneas del chat en memoria y todo el historial en disco
+        "history": ChatHistory(),
+        # 'threads' o 'asyncio' (ver NETWORK_ENGINE en config.py)
+        "network_engine": os.environ.get('NETWORK_ENGINE', NETWORK_ENGINE).lower(),
+        # El motor asyncio, si está en marcha
+        "engine": None,
+        "metrics": metrics,
         "my_mac": None,
+        "mtu": None,
         "socket": None,
     }
 
+    # Las métricas se exportan por un socket Unix o a un archivo, si están configurados
+    watch_state(metrics, app_state)
+    metrics_server = start_exporters(
+        metrics,
+        os.environ.get('METRICS_SOCKET', METRICS_SOCKET),
+        os.environ.get('METRICS_SNAPSHOT_FILE', METRICS_SNAPSHOT_FILE),
+        METRICS_SNAPSHOT_INTERVAL,
+    )
+
     # Decidir el modo de ejecución
     run_mode = os.environ.get('RUN_MODE', 'GUI').upper()
 
+    # En Docker, la interfaz suele ser 'eth0'
+    interface = os.environ.get('INTERFACE', HEADLESS_INTERFACE)
+
     if run_mode == 'CLI':
         # --- MODO LÍNEA DE COMANDOS (PARA DOCKER) ---
         print("Iniciando en modo Línea de Comandos (CLI)...")
-        # En Docker, la interfaz suele ser 'eth0'
-        interface = 'eth0' 
-        sock, my_mac = setup_network(interface)
-        app_state["socket"] = sock
-        app_state["my_mac"] = my_mac
-        
-        # Iniciar hilos de red
-        recv_thread = threading.Thread(target=receive_thread, args=(sock, my_mac, app_state), daemon=True)
-        recv_thread.start()
-        
-        disc_thread = threading.Thread(target=discovery_thread, args=(sock, my_mac), daemon=True)
-        disc_thread.start()
-
+        start_network(app_state, interface)
         start_cli_mode(app_state)
 
+    elif run_mode == 'DAEMON':
+        # --- MODO DEMONIO: SIN TERMINAL, CONTROLADO POR UN SOCKET UNIX ---
+        print(f"Iniciando en modo demonio en '{interface}'...")
+        start_network(app_state, interface)
+        start_daemon_mode(app_state)
+
     else:
         # --- MODO GRÁFICO (POR DEFECTO) ---
         try:
@@ -74,6 +144,14 @@ def main():
             print(f"Ocurrió un error fatal en la aplicación: {e}")
 
     # Asegura que el socket se cierre correctamente al salir.
+    if app_state.get("engine"):
+        app_state["engine"].close()
+    app_state["history"].close()
+    if metrics_server is not None:
+        # La ruta hay que leerla antes de cerrar: getsockname() falla con el socket cerrado
+        metrics_path = metrics_server.getsockname()
+        metrics_server.close()
+        os.unlink(metrics_path)
     if app_state.get("socket"):
         app_state["socket"].close()
         print("\nSocket cerrado. Adiós.")
@@ -85,7 +163,7 @@ if __name__ == "__main__":
     try:
         import netifaces
     except ImportError:
-        if os.environ.get('RUN_MODE', 'GUI').upper() != 'CLI':
+        if os.environ.get('RUN_MODE', 'GUI').upper() not in ('CLI', 'DAEMON'):
             print("Error: El paquete 'netifaces' es necesario para el modo GUI. Instálalo con 'pip install netifaces'")
             sys.exit(1)
     main()
@@ -0,0 +1,349 @@
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from config import *
+from utils import mac_bits_cadena
+
+
+class TimedLock:
+    """
+    Un threading.Lock que mide cuánto esperan quienes lo encuentran ocupado.
+    Si el candado está libre se toma sin medir nada; los contadores solo se tocan
+    con el candado tomado, así que no necesitan otro.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.acquisitions += 1
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        if not self._lock.acquire(True, timeout):
+            return False
+        waited = time.perf_counter() - start
+        self.acquisitions += 1
+        self.contended += 1
+        self.wait_seconds += waited
+        if waited > self.max_wait:
+            self.max_wait = waited
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+    def stats(self):
+        """
+        Returns:
+            dict: acquisitions, contended, wait_ms (total) y max_wait_ms.
+        """
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_ms": self.wait_seconds * 1000,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class TransferMetrics:
+    """
+    Estadísticas de una transferencia. Solo la actualiza el hilo (o la tarea) que la lleva:
+    'bytes' con cada trozo nuevo y 'retransmits' con cada reenvío.
+    """
+    __slots__ = ('_registry', 'direction', 'peer', 'name', 'size', 'bytes', 'retransmits',
+                 'started', 'finished', 'ok')
+
+    def __init__(self, registry, direction, peer, name, size):
+        self._registry = registry
+        self.direction = direction
+        self.peer = peer
+        self.name = name
+        self.size = size
+        self.bytes = 0
+        self.retransmits = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.ok = None
+
+    def finish(self, ok):
+        """Da la transferencia por terminada (ok=False si falló o se abandonó)."""
+        if self.finished is None:
+            self.finished = time.monotonic()
+            self.ok = ok
+            self._registry._transfer_finished(self)
+
+    def stats(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        seconds = max(end - self.started, 1e-6)
+        return {
+            "direction": self.direction,
+            "peer": mac_bits_cadena(self.peer),
+            "name": self.name,
+            "size": self.size,
+            "bytes": self.bytes,
+            "retransmits": self.retransmits,
+            "seconds": seconds,
+            "mb_per_sec": self.bytes / seconds / 1e6,
+            "ok": self.ok,
+        }
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas del proceso.
+
+    Los contadores propios (inc) no toman candados: cada hilo suma en su propio diccionario
+    y la instantánea los junta. Lo que otras piezas ya cuentan (el despachador, el
+    planificador de envíos, el receptor...) no se duplica: se registra una función que lo
+    lee al pedir la instantánea (add_collector). Además lleva los candados medidos
+    (timed_lock), las estadísticas de cada transferencia y una traza de sucesos recientes.
+    """
+    def __init__(self, trace_events=METRICS_TRACE_EVENTS, recent_transfers=METRICS_RECENT_TRANSFERS):
+        self.started = time.time()
+        self._local = threading.local()
+        # (hilo, contadores) de cada hilo que ha contado algo
+        self._shards = []
+        # Contadores de los hilos que ya terminaron
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._collectors = {}
+        self._locks = {}
+        self._transfers = set()
+        self._recent = deque(maxlen=recent_transfers)
+        self._trace = deque(maxlen=trace_events)
+
+    # --- Camino rápido ---
+
+    def inc(self, name, value=1):
+        """Suma 'value' al contador 'name'. Es seguro llamarla desde cualquier hilo sin candados."""
+        try:
+            shard = self._local.counters
+        except AttributeError:
+            shard = self._local.counters = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        shard[name] = shard.get(name, 0) + value
+
+    def trace(self, event, **fields):
+        """Añade un suceso a la traza (deque.append ya es seguro entre hilos)."""
+        fields['event'] = event
+        fields['time'] = time.time()
+        self._trace.append(fields)
+
+    # --- Registro ---
+
+    def timed_lock(self, name):
+        """Crea un TimedLock cuyas esperas aparecen en la instantánea como locks[name]."""
+        lock = TimedLock()
+        self._locks[name] = lock
+        return lock
+
+    def add_collector(self, name, collector):
+        """
+        Registra collector(), que devuelve algo serializable en JSON (o None para omitirlo)
+        y aparece en la instantánea como 'name'.
+        """
+        self._collectors[name] = collector
+
+    def begin_transfer(self, direction, peer, name, size):
+        """
+        Empieza a seguir una transferencia.
+        Args:
+            direction (str): 'in' o 'out'.
+            peer (bytes): La MAC del otro extremo.
+        Returns:
+            TransferMetrics: Sus estadísticas, que hay que terminar con finish().
+        """
+        transfer = TransferMetrics(self, direction, peer, name, size)
+        with self._lock:
+            self._transfers.add(transfer)
+        self.inc(f'transfers_{direction}')
+        self.trace('transfer_start', direction=direction, peer=mac_bits_cadena(peer), name=name, size=size)
+        return transfer
+
+    def _transfer_finished(self, transfer):
+        with self._lock:
+            self._transfers.discard(transfer)
+            self._recent.append(transfer)
+        self.inc(f'transfer_bytes_{transfer.direction}', transfer.bytes)
+        self.inc('file_retransmits', transfer.retransmits)
+        if not transfer.ok:
+            self.inc(f'transfers_{transfer.direction}_failed')
+        self.trace('transfer_end', **transfer.stats())
+
+    # --- Lectura ---
+
+    def counters(self):
+        """Devuelve la suma de los contadores de todos los hilos."""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # Un hilo terminado ya no escribe: sus cuentas pasan al total fijo
+                    for name, value in shard.items():
+                        self._retired[name] = self._retired.get(name, 0) + value
+            self._shards = alive
+            result = dict(self._retired)
+        for _, shard in alive:
+            # Copiar un diccionario es atómico; su dueño puede seguir sumando mientras tanto
+            for name, value in dict(shard).items():
+                result[name] = result.get(name, 0) + value
+        return result
+
+    def snapshot(self):
+        """
+        Devuelve todas las métricas en un diccionario serializable en JSON.
+        Returns:
+            dict: time, uptime, counters, locks, transfers (activas y recientes), trace y
+            una entrada por cada función registrada con add_collector.
+        """
+        with self._lock:
+            active = list(self._transfers)
+            recent = list(self._recent)
+        result = {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "counters": self.counters(),
+            "locks": {name: lock.stats() for name, lock in self._locks.items()},
+            "transfers": {
+                "active": [transfer.stats() for transfer in active],
+                "recent": [transfer.stats() for transfer in recent],
+            },
+        }
+        for name, collector in list(self._collectors.items()):
+            try:
+                value = collector()
+            except Exception as e:
+                value = {"error": str(e)}
+            if value is not None:
+                result[name] = value
+        result["trace"] = list(self._trace)
+        return result
+
+
+def watch_state(registry, state):
+    """
+    Registra en 'registry' lo que el estado de la aplicación ya cuenta: tramas recibidas
+    por tipo (el despachador), enviadas por tipo y colas del planificador, descartes del
+    kernel, profundidad y eventos de la cola de la GUI, finalizador y vecinos.
+    Las piezas que aún no existen (la recepción no ha arrancado) simplemente no aparecen.
+    """
+    def frames_in():
+        dispatcher = state.get('dispatcher')
+        return dispatcher.stats() if dispatcher is not None else None
+
+    def frames_out():
+        dispatcher = state.get('dispatcher')
+        names = dispatcher.names if dispatcher is not None else {}
+        return {names.get(msg_type, f"0x{msg_type:02x}"): count
+                for msg_type, count in state['send_scheduler'].frame_counts().items()}
+
+    def receiver():
+        receiver = state.get('receiver')
+        return receiver.stats() if receiver is not None else None
+
+    def gui_queue():
+        gui_queue = state['gui_queue']
+        result = {"depth": gui_queue.qsize()}
+        if hasattr(gui_queue, 'event_counts'):
+            result["events"] = gui_queue.event_counts()
+        return result
+
+    def transfers():
+        return {
+            "outgoing": len(state['file_transfer_state']),
+            "incoming": len(state['pending_file_requests']),
+        }
+
+    registry.add_collector("frames_in", frames_in)
+    registry.add_collector("frames_out", frames_out)
+    registry.add_collector("receiver", receiver)
+    registry.add_collector("send_scheduler", state['send_scheduler'].stats)
+    registry.add_collector("gui_queue", gui_queue)
+    registry.add_collector("finalizer", state['finalizer'].stats)
+    registry.add_collector("pending", transfers)
+    registry.add_collector("peers", lambda: len(state['peers'].snapshot()))
+
+
+def write_snapshot(registry, path):
+    """Escribe una instantánea en 'path' sin que un lector pueda ver el archivo a medias."""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(temporary, path)
+
+
+def snapshot_thread(registry, path, interval=METRICS_SNAPSHOT_INTERVAL):
+    """Hilo que escribe una instantánea en 'path' cada 'interval' segundos."""
+    while True:
+        try:
+            write_snapshot(registry, path)
+        except Exception as e:
+            print(f"Error al escribir las métricas en {path}: {e}")
+        time.sleep(interval)
+
+
+def open_unix_listener(path, mode=0o660):
+    """
+    Abre un socket Unix de escucha en 'path', borrando el que dejara un proceso anterior.
+    Returns:
+        socket.socket
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, mode)
+    server.listen(8)
+    return server
+
+
+def metrics_socket_thread(registry, server):
+    """Hilo que atiende el socket de métricas: a cada conexión le envía una instantánea y la cierra."""
+    while True:
+        try:
+            conn, _ = server.accept()
+        except OSError:
+            # El socket se cerró
+            break
+        try:
+            with conn:
+                conn.sendall(json.dumps(registry.snapshot()).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+
+
+def start_exporters(registry, socket_path=METRICS_SOCKET, snapshot_file=METRICS_SNAPSHOT_FILE,
+                    interval=METRICS_SNAPSHOT_INTERVAL):
+    """
+    Arranca la exportación de métricas que esté configurada (socket Unix, archivo o ambos).
+    Returns:
+        socket.socket | None: El socket de escucha, para cerrarlo (y borrarlo) al salir.
+    """
+    server = None
+    if socket_path:
+        server = open_unix_listener(socket_path)
+        threading.Thread(target=metrics_socket_thread, args=(registry, server), daemon=True).start()
+    if snapshot_file:
+        threading.Thread(target=snapshot_thread, args=(registry, snapshot_file, interval), daemon=True).start()
+    return server
@@ -2,13 +2,794 @@ import socket
 import struct
 import time
 import os
+import queue
 import shutil
+import threading
+import itertools
+import random
 from config import *  # <-- Esta línea ya importa todo, incluyendo la nueva constante
-from utils import mac_bits_cadena
+from utils import mac_bits_cadena, resumen_archivo
+from transfer_window import SendWindow, ReceiveWindow, unpack_sack
+from packet_receiver import open_receiver
+from dispatcher import Dispatcher
+from checkpoint import save_checkpoint, checkpoint_data, write_checkpoint, load_checkpoint, remove_checkpoint
+from fragments import Reassembler, split_payload
+from bundle import Coalescer
+from send_scheduler import PRIORITY_CONTROL, PRIORITY_CHAT
+from compression import CODEC_NONE, CODEC_ZLIB, CODEC_LZMA, CODECS, choose_codec, compressor_for, decompressor_for
+from protocol import (parse_frame, parse_file_data, parse_discovery, parse_probe_reply, iter_bundle, DISCOVERY_INFO, PROBE_ID, PROBE_ECHO,
+                      CHAT_HEADER, CHAT_ACK_HEADER, FILE_START_HEADER, CHUNK_SIZE_FIELD, TRANSFER_ID, FILE_DATA_HEADER,
+                      FILE_DIGEST, RESUME_FROM, DONE_STATUS, CODEC_FIELD, SEQ_ACK_REQUEST, SEQ_MASK)
+
+# Identificadores de transferencia: empiezan en un valor aleatorio para no repetir
+# los de una ejecución anterior. next() sobre itertools.count es seguro entre hilos.
+_transfer_ids = itertools.count(random.getrandbits(31))
+
+# Identificadores de los mensajes fragmentados, con el mismo criterio
+_fragment_ids = itertools.count(random.getrandbits(31))
+
+def new_transfer_id():
+    """Devuelve un identificador nuevo para una transferencia saliente."""
+    return next(_transfer_ids) & 0xFFFFFFFF
+
+def send_payload(sock, my_mac, state, dest_mac, payload, priority=PRIORITY_CHAT):
+    """
+    Envía un mensaje (payload con su byte de tipo) en una sola trama o, si no cabe
+    en la MTU, en varios fragmentos que el receptor vuelve a unir. Si el destino
+    los admite, los mensajes pequeños pasan por el agrupador (state['coalescer']).
+    Las tramas salen por el planificador de envíos con la prioridad indicada.
+    """
+    scheduler = state['send_scheduler']
+    eth_header = struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE)
+    mtu = state.get('mtu') or DEFAULT_MTU
+    if len(payload) <= mtu:
+        frames = [payload]
+    else:
+        frames = split_payload(next(_fragment_ids) & 0xFFFFFFFF, payload, mtu)
+
+    coalescer = state.get('coalescer')
+    if coalescer is not None and _can_bundle(state, dest_mac):
+        # Los mensajes grandes también pasan por él, para no adelantar a los pequeños que esperan
+        for frame in frames:
+            for _, ready_payload in coalescer.add(dest_mac, frame):
+                scheduler.send(eth_header + ready_payload, priority)
+        return
+    for frame in frames:
+        scheduler.send(eth_header + frame, priority)
+
+def _can_bundle(state, dest_mac):
+    """Indica si los mensajes para dest_mac se pueden agrupar en tramas BUNDLE."""
+    if not COALESCE_ENABLED or dest_mac == BROADCAST_MAC:
+        return False
+    peer = state['peers'].get(dest_mac)
+    return bool(peer and peer['caps'] and peer['caps']['flags'] & CAP_BUNDLE)
+
+def chunk_size_for_mtu(mtu):
+    """
+    Calcula el mayor trozo de archivo que cabe en una trama con la MTU dada.
+    """
+    return max(1, min(MAX_FILE_CHUNK_SIZE, mtu - FILE_DATA_HEADER_SIZE))
+
+def window_size_for_chunk(chunk_size):
+    """
+    Calcula cuántos trozos caben en la ventana deslizante para un tamaño de trozo.
+    """
+    return max(8, FILE_WINDOW_BYTES // chunk_size)
+
+def build_file_start_payload(transfer_id, file_name, file_size, kind, chunk_size, digest, codec=CODEC_NONE):
+    """
+    Construye el payload de un FILE_START (sin el byte de tipo): id de transferencia (4) +
+    tipo de elemento (1, FILE_KIND_*) + tamaño (8) + nombre (utf-8) + delimitador nulo +
+    trozo propuesto (4) + resumen del contenido (32) + compresión propuesta (1).
+    """
+    return (TRANSFER_ID.pack(transfer_id) + FILE_START_HEADER.pack(kind, file_size) + file_name.encode('utf-8') + b'\x00'
+            + CHUNK_SIZE_FIELD.pack(chunk_size) + FILE_DIGEST.pack(digest) + CODEC_FIELD.pack(codec))
+
+def build_file_ack_payload(transfer_id, chunk_size, resume_from=0, codec=CODEC_NONE):
+    """
+    Construye el payload de un FILE_ACK (sin el byte de tipo): id de transferencia (4) +
+    trozo aceptado (4) + primer trozo que nos falta (4), distinto de 0 si se reanuda una descarga +
+    compresión aceptada (1).
+    """
+    return (TRANSFER_ID.pack(transfer_id) + CHUNK_SIZE_FIELD.pack(chunk_size) + RESUME_FROM.pack(resume_from)
+            + CODEC_FIELD.pack(codec))
+
+def transfer_summary(stats):
+    """
+    Resume en una línea las estadísticas de un envío: tamaño, tiempo, velocidad útil
+    (bytes del archivo por segundo) y, si hubo compresión, cuánto se redujeron los trozos.
+    """
+    seconds = max(stats['seconds'], 1e-6)
+    summary = (f"{stats['bytes'] / 1e6:.1f} MB en {seconds:.2f} s "
+               f"({stats['bytes'] / seconds / 1e6:.1f} MB/s útiles)")
+    if stats['wire_bytes'] and stats['payload_bytes'] > stats['wire_bytes']:
+        summary += f", compresión {stats['payload_bytes'] / stats['wire_bytes']:.2f}x"
+    return summary
+
+def new_incoming_request(file_name, file_size, is_folder, chunk_size, digest, folder=None, codec=CODEC_NONE):
+    """
+    Crea la entrada de 'pending_file_requests' para un archivo que vamos a recibir.
+    El archivo de destino se crea ya con su tamaño final y queda abierto hasta el FILE_END.
+    Si hay un checkpoint del mismo contenido, se reanuda con los trozos que ya teníamos.
+    Una carpeta no tiene archivo propio: solo se crea su directorio.
+    """
+    path = file_name
+    if is_folder:
+        os.makedirs(path, exist_ok=True)
+        return {
+            "file_name": file_name,
+            "file_size": file_size,
+            "downloaded_size": 0,
+            "path": path,
+            "is_folder": True,
+            "chunk_size": chunk_size,
+            "digest": digest,
+            "fd": None,
+            "io_lock": threading.Lock(),
+            # Última vez que llegó algo (de cualquiera de sus archivos)
+            "active_at": time.monotonic(),
+            "window": ReceiveWindow(0),
+            "folder": None,
+            # La carpeta no lleva trozos propios: no hay nada que comprimir
+            "codec": CODEC_NONE,
+        }
+    if folder is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    resume = load_checkpoint(path, file_size, digest)
+    # Solo se reanuda con el tamaño de trozo del checkpoint, y solo si cabe en lo negociado
+    if resume is not None and resume[0] > chunk_size:
+        resume = None
+    if resume is not None:
+        chunk_size = resume[0]
+    else:
+        remove_checkpoint(path)
+
+    total_chunks = (file_size + chunk_size - 1) // chunk_size
+    window_size = window_size_for_chunk(chunk_size)
+    # Mapa de trozos recibidos (para escribir cada uno una sola vez y para los SACK)
+    window = ReceiveWindow(total_chunks)
+    if resume is not None:
+        window.restore(resume[1], resume[2])
+    return {
+        "file_name": file_name,
+        "file_size": file_size,
+        "downloaded_size": min(file_size, window.count * chunk_size),
+        "path": path,
+        "is_folder": is_folder,
+        "chunk_size": chunk_size,
+        "window_size": window_size,
+        # Confirmamos al menos cuatro veces por ventana para que el emisor no se detenga
+        "ack_every": max(1, min(FILE_ACK_EVERY, window_size // 4)),
+        "digest": digest,
+        "fd": _open_destination(path, file_size, truncate=resume is None),
+        # Protege el descriptor: quien lo cierra y el hilo de checkpoints no se pisan
+        "io_lock": threading.Lock(),
+        "window": window,
+        # Si el archivo es una entrada de una carpeta, la solicitud de la carpeta
+        "folder": folder,
+        # Compresión negociada para los trozos FILE_DATA_COMPRESSED
+        "codec": codec,
+        "decompress": decompressor_for(codec),
+        "unacked": 0,
+        "checkpoint_at": time.monotonic() + FILE_CHECKPOINT_INTERVAL,
+        # Última vez que llegó un trozo, para retirarla si el emisor la abandona
+        "active_at": time.monotonic(),
+        # Hay un checkpoint encargado que aún no se ha guardado
+        "checkpointing": False,
+    }
+
+def accept_incoming_request(state, src_mac, transfer_id, file_name, file_size, kind, chunk_size, digest, codec=CODEC_NONE):
+    """
+    Acepta un archivo, carpeta o entrada de carpeta entrante y registra su solicitud en
+    'pending_file_requests'. Las descargas abandonadas del mismo archivo se retiran antes,
+    guardando su checkpoint, para que la nueva pueda continuar donde se quedaron.
+    Un FILE_START repetido devuelve la solicitud que ya existía.
+    Returns:
+        dict: La solicitud (para construir el FILE_ACK).
+    """
+    with state['pending_file_requests_lock']:
+        pending = state['pending_file_requests']
+        if (src_mac, transfer_id) in pending:
+            return pending[(src_mac, transfer_id)]
+        folder = None
+        if kind == FILE_KIND_FOLDER_ENTRY:
+            folder = _folder_for_entry(pending, src_mac, file_name)
+            folder['active_at'] = time.monotonic()
+        for key, other in list(pending.items()):
+            if other['path'] == file_name:
+                close_incoming_request(other, checkpoint=True)
+                state['transfer_progress'].finish(other)
+                if other.get('metrics') is not None:
+                    other['metrics'].finish(False)
+                del pending[key]
+        request = new_incoming_request(file_name, file_size, kind == FILE_KIND_FOLDER, chunk_size, digest, folder, codec)
+        if kind != FILE_KIND_FOLDER:
+            # Una carpeta no tiene datos propios: se siguen sus archivos uno a uno
+            request['metrics'] = state['metrics'].begin_transfer('in', src_mac, file_name, file_size)
+        pending[(src_mac, transfer_id)] = request
+    return request
+
+def expire_incoming_requests(state, timeout=FILE_IDLE_TIMEOUT):
+    """
+    Retira las descargas que llevan 'timeout' segundos sin recibir nada: guarda su checkpoint,
+    para reanudarlas si el emisor vuelve a ofrecerlas, y cierra su archivo. También olvida las
+    que se descartaron por llegar dañadas, que solo esperaban un FILE_END repetido.
+    """
+    idle_since = time.monotonic() - timeout
+    expired = []
+    with state['pending_file_requests_lock']:
+        pending = state['pending_file_requests']
+        for key, request in list(pending.items()):
+            if request.get('status') != 'finalizing' and request['active_at'] < idle_since:
+                del pending[key]
+                expired.append(request)
+    # El checkpoint (con su fdatasync) se guarda ya fuera del candado
+    for request in expired:
+        state['transfer_progress'].finish(request)
+        if request.get('status') == 'corrupt':
+            continue
+        close_incoming_request(request, checkpoint=True)
+        if request.get('metrics') is not None:
+            request['metrics'].finish(False)
+        state['metrics'].inc('downloads_expired')
+        state['gui_queue'].put(('error', f"La descarga de '{request['file_name']}' se abandonó: el emisor "
+                                         f"lleva {timeout:.0f} s sin enviar nada."))
+
+def _folder_for_entry(pending, src_mac, entry_name):
+    """
+    Busca la carpeta aceptada a la que pertenece una entrada ('carpeta/ruta/relativa').
+    Rechaza las rutas vacías o con '.' y '..', que podrían escribir fuera de la carpeta.
+    """
+    parts = entry_name.split('/')
+    if len(parts) < 2 or any(part in ('', '.', '..') for part in parts):
+        raise ValueError(f"Ruta de entrada de carpeta no válida: '{entry_name}'")
+    for (mac, _), request in pending.items():
+        if mac == src_mac and request['is_folder'] and request['path'] == parts[0]:
+            return request
+    raise ValueError(f"'{entry_name}' no pertenece a ninguna carpeta aceptada")
+
+def _checkpoint_request(state, request):
+    """
+    Encarga el checkpoint de una descarga en curso y programa el siguiente. En este hilo solo
+    se copia la ventana; el volcado a disco lo hace el hilo de checkpoints de state['finalizer'].
+    """
+    request['checkpoint_at'] = time.monotonic() + FILE_CHECKPOINT_INTERVAL
+    # Si el anterior aún no se ha guardado, este se salta: el siguiente lo incluirá
+    if request['checkpointing']:
+        return
+    request['checkpointing'] = True
+    data = checkpoint_data(request['file_size'], request['chunk_size'], request['digest'], request['window'])
+    state['finalizer'].checkpoint(_save_checkpoint, state, request, data)
+
+def _save_checkpoint(state, request, data):
+    # En el hilo de checkpoints. El fdatasync se hace sobre una copia del descriptor, sin
+    # io_lock, para no frenar a quien escribe; el checkpoint solo se escribe si la solicitud
+    # sigue abierta (si no, otra descarga del mismo archivo puede haber empezado).
+    try:
+        with request['io_lock']:
+            if request['fd'] is None:
+                return
+            fd = os.dup(request['fd'])
+        try:
+            os.fdatasync(fd)
+        finally:
+            os.close(fd)
+        with request['io_lock']:
+            if request['fd'] is not None:
+                write_checkpoint(request['path'], data)
+    except OSError as e:
+        state['gui_queue'].put(('error', f"No se pudo guardar el checkpoint de '{request['file_name']}': {e}"))
+    finally:
+        request['checkpointing'] = False
+
+def _open_destination(file_path, file_size, truncate=True):
+    """
+    Abre el archivo de destino y reserva su tamaño completo en disco.
+    Con truncate=False conserva lo que ya hubiera (para reanudar una descarga).
+    Returns:
+        int: El descriptor de archivo.
+    """
+    flags = os.O_RDWR | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+    fd = os.open(file_path, flags, 0o644)
+    try:
+        if file_size > 0:
+            try:
+                os.posix_fallocate(fd, 0, file_size)
+            except (AttributeError, OSError):
+                # El sistema de archivos no soporta fallocate: basta con fijar el tamaño
+                os.ftruncate(fd, file_size)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+def close_incoming_request(request, checkpoint=False):
+    """
+    Cierra el descriptor del archivo de una solicitud, si sigue abierto.
+    Con checkpoint=True guarda antes su checkpoint, para poder reanudarla más tarde.
+    """
+    with request['io_lock']:
+        fd = request['fd']
+        if fd is None:
+            return
+        try:
+            if checkpoint:
+                save_checkpoint(fd, request['path'], request['file_size'], request['chunk_size'],
+                                request['digest'], request['window'])
+        finally:
+            request['fd'] = None
+            os.close(fd)
+
+def _send_sack(state, my_mac, dest_mac, transfer_id, request):
+    """Envía al emisor el estado actual de la ventana de recepción."""
+    eth_header = struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE)
+    state['send_scheduler'].send(eth_header + MSG_TYPE_FILE_SACK + TRANSFER_ID.pack(transfer_id)
+                                 + request['window'].build_sack(request['window_size']))
+
+def _send_file_done(state, my_mac, dest_mac, transfer_id, status=FILE_DONE_OK):
+    """Responde al FILE_END del emisor con el resultado de verificar el archivo."""
+    eth_header = struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE)
+    state['send_scheduler'].send(eth_header + MSG_TYPE_FILE_DONE + TRANSFER_ID.pack(transfer_id) + DONE_STATUS.pack(status))
+
+def _observe_peer(state, src_mac, payload):
+    """Añade o refresca al vecino en la tabla y avisa si es nuevo. Devuelve True si lo es."""
+    if state['peers'].observe(src_mac, parse_discovery(payload)) is None:
+        return False
+    state['metrics'].trace('peer_join', peer=mac_bits_cadena(src_mac))
+    # Notificamos a la GUI que hay un nuevo usuario
+    state['gui_queue'].put(('new_user', src_mac))
+    return True
+
+def _handle_discovery(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Registra al emisor de un anuncio periódico y lo cuenta para suprimir el nuestro."""
+    # Añadir host si es nuevo (o refrescar sus capacidades si ya se conocía)
+    is_new = _observe_peer(state, src_mac, payload)
+    state['discovery'].heard_announcement(is_new)
+
+def _handle_discovery_probe(sock, my_mac, state, dest_mac, src_mac, payload):
+    """
+    Responde a una sonda de descubrimiento. Si la sonda llegó en broadcast la respuesta
+    se retrasa un tiempo al azar, para repartir las de todos los vecinos.
+    """
+    _observe_peer(state, src_mac, payload)
+    offset = 1 + DISCOVERY_INFO.size
+    if len(payload) < offset + PROBE_ID.size:
+        return
+    nonce = PROBE_ID.unpack_from(payload, offset)[0]
+    delay = random.uniform(0, DISCOVERY_REPLY_JITTER) if dest_mac == BROADCAST_MAC else 0.0
+
+    eth_header = struct.pack('!6s6sH', src_mac, my_mac, LINK_CHAT_ETHERTYPE)
+    reply = (eth_header + build_discovery_payload(MSG_TYPE_DISCOVERY_REPLY, state.get('mtu') or DEFAULT_MTU)
+             + PROBE_ECHO.pack(nonce, int(delay * 1e6)))
+    engine = state.get('engine')
+    if delay and engine is not None:
+        # Con el motor asyncio la espera es un temporizador del bucle, no un hilo
+        engine.call_later(delay, state['send_scheduler'].send, reply)
+    elif delay:
+        timer = threading.Timer(delay, state['send_scheduler'].send, args=(reply,))
+        timer.daemon = True
+        timer.start()
+    else:
+        state['send_scheduler'].send(reply)
+
+def _handle_discovery_reply(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Registra al vecino que responde a una de nuestras sondas y mide el RTT."""
+    _observe_peer(state, src_mac, payload)
+    echo = parse_probe_reply(payload)
+    if echo is not None:
+        rtt = state['discovery'].probe_rtt(*echo)
+        if rtt is not None:
+            state['peers'].record_rtt(src_mac, rtt)
+
+def _handle_chat(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Muestra un mensaje de chat recibido (privado o broadcast)."""
+    _show_chat(my_mac, state, dest_mac, src_mac, payload[1:])
+
+def _handle_chat_reliable(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Registra un mensaje de chat fiable y lo muestra si no es un duplicado."""
+    session, msg_id = CHAT_HEADER.unpack_from(payload, 1)
+    if state['chat'].on_message(src_mac, session, msg_id):
+        _show_chat(my_mac, state, dest_mac, src_mac, payload[1 + CHAT_HEADER.size:])
+    else:
+        state['metrics'].inc('chat_duplicates')
+
+def _handle_chat_ack(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Aplica una confirmación de mensajes de chat y envía los que esperaban en cola."""
+    session, epoch = CHAT_ACK_HEADER.unpack_from(payload, 1)
+    ready = state['chat'].on_ack(src_mac, session, epoch, *unpack_sack(payload[1 + CHAT_ACK_HEADER.size:]))
+    for chat_payload in ready:
+        send_payload(sock, my_mac, state, src_mac, chat_payload)
+
+def _handle_bundle(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Despacha uno a uno, sin copiarlos, los mensajes agrupados en una trama."""
+    dispatch = state['dispatcher'].dispatch
+    for message in iter_bundle(payload):
+        # Un BUNDLE no puede contener otro
+        if message[0] != MSG_TYPE_BUNDLE[0]:
+            dispatch(message[0], sock, my_mac, state, dest_mac, src_mac, message)
+
+def _handle_fragment(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Guarda un fragmento y, cuando el mensaje está completo, lo despacha como si hubiera llegado entero."""
+    message = state['reassembler'].add(src_mac, payload)
+    # Un fragmento no puede contener otro
+    if message and message[:1] != MSG_TYPE_FRAGMENT:
+        state['dispatcher'].dispatch(message[0], sock, my_mac, state, dest_mac, src_mac, memoryview(message))
+
+def _show_chat(my_mac, state, dest_mac, src_mac, data):
+    gui_queue = state['gui_queue']
+
+    try:
+        # Decodificamos el mensaje y lo limpiamos con .strip()
+        message_text = str(data, 'utf-8').strip()
+
+        sender_mac_str = mac_bits_cadena(src_mac)
+
+        # Determinar si es un mensaje privado o broadcast
+        if dest_mac == my_mac:
+            # Es un mensaje privado para nosotros
+            display_text = f"[Privado de {sender_mac_str}]: {message_text}"
+        else:
+            # Es un mensaje broadcast
+            display_text = f"[{sender_mac_str}]: {message_text}"
+
+        # Ponemos el mensaje formateado en la cola
+        gui_queue.put(('chat_message', display_text))
+
+    except UnicodeDecodeError:
+        sender_mac_str = mac_bits_cadena(src_mac)
+        gui_queue.put(('chat_message', f"[{sender_mac_str}]: [mensaje con formato inválido]"))
+
+def _handle_file_start(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Procesa una solicitud de transferencia de archivo."""
+    gui_queue = state['gui_queue']
+    max_chunk_size = chunk_size_for_mtu(state.get('mtu') or DEFAULT_MTU)
+
+    try:
+        # Desempaquetar el id de transferencia (4 bytes), el tipo de elemento (1 byte) y el tamaño (8 bytes)
+        transfer_id = TRANSFER_ID.unpack_from(payload, 1)[0]
+        kind, file_size = FILE_START_HEADER.unpack_from(payload, 1 + TRANSFER_ID.size)
+
+        # El resto del payload contiene el nombre del archivo y el delimitador
+        file_name_payload = bytes(payload[1 + TRANSFER_ID.size + FILE_START_HEADER.size:])
+
+        # Encontrar la posición del delimitador nulo
+        null_terminator_pos = file_name_payload.find(b'\x00')
+
+        if null_terminator_pos == -1:
+            raise ValueError("Paquete FILE_START malformado, sin delimitador de nombre.")
+
+        # Decodificar solo la parte del nombre del archivo
+        file_name = file_name_payload[:null_terminator_pos].decode('utf-8')
+
+        # Tras el nombre viene el tamaño de trozo propuesto por el emisor.
+        # Aceptamos el menor entre ese y el que permite nuestra MTU.
+        proposal_pos = null_terminator_pos + 1
+        chunk_size = min(CHUNK_SIZE_FIELD.unpack_from(file_name_payload, proposal_pos)[0], max_chunk_size)
+        # Y por último el resumen del contenido, que identifica el archivo para reanudarlo
+        digest = FILE_DIGEST.unpack_from(file_name_payload, proposal_pos + CHUNK_SIZE_FIELD.size)[0]
+        # Y la compresión propuesta: si no la conocemos, los trozos viajarán sin comprimir
+        codec = CODEC_FIELD.unpack_from(file_name_payload, proposal_pos + CHUNK_SIZE_FIELD.size + FILE_DIGEST.size)[0]
+        if codec not in CODECS:
+            codec = CODEC_NONE
+
+        # --- LÓGICA DE ACEPTACIÓN AUTOMÁTICA PARA CLI (Y EL DEMONIO, SI ASÍ SE CONFIGURA) ---
+        # Las entradas de una carpeta que ya se aceptó tampoco se preguntan.
+        run_mode = os.environ.get('RUN_MODE', 'GUI').upper()
+        auto_accept = run_mode == 'CLI' or (run_mode == 'DAEMON' and DAEMON_AUTO_ACCEPT)
+        eth_header = struct.pack('!6s6sH', src_mac, my_mac, LINK_CHAT_ETHERTYPE)
+        if kind == FILE_KIND_FOLDER_DIR:
+            # Subcarpeta vacía: basta con crearla
+            with state['pending_file_requests_lock']:
+                _folder_for_entry(state['pending_file_requests'], src_mac, file_name)
+            os.makedirs(file_name, exist_ok=True)
+            state['send_scheduler'].send(eth_header + MSG_TYPE_FILE_ACK + build_file_ack_payload(transfer_id, chunk_size))
+        elif auto_accept or kind == FILE_KIND_FOLDER_ENTRY:
+            # --- MODO CLI: ACEPTAR Y ENVIAR ACK CON EL TAMAÑO DE TROZO ---
+            request = accept_incoming_request(state, src_mac, transfer_id, file_name, file_size, kind, chunk_size, digest, codec)
+            state['send_scheduler'].send(eth_header + MSG_TYPE_FILE_ACK + build_file_ack_payload(
+                transfer_id, request['chunk_size'], request['window'].cumulative, request['codec']))
+            if kind != FILE_KIND_FOLDER_ENTRY:
+                gui_queue.put(('file_download_started', file_name))
+        else:
+            # --- MODO GUI O DEMONIO: PREGUNTAR Y ENVIAR ACK (si se acepta) ---
+            gui_queue.put(('file_request', src_mac, transfer_id, file_name, file_size, kind == FILE_KIND_FOLDER, chunk_size, digest, codec))
+
+    except Exception as e:
+        gui_queue.put(('error', f"Error al procesar solicitud de archivo: {e}"))
+
+def _handle_file_ack(sock, my_mac, state, dest_mac, src_mac, payload):
+    """El receptor aceptó nuestro archivo: anota el tamaño de trozo y despierta al emisor."""
+    transfer_id = TRANSFER_ID.unpack_from(payload, 1)[0]
+    with state['file_transfer_lock']:
+        transfer = state['file_transfer_state'].get((src_mac, transfer_id))
+        if transfer:
+            # El ACK trae el tamaño de trozo aceptado y desde qué trozo continuar
+            transfer['chunk_size'] = CHUNK_SIZE_FIELD.unpack_from(payload, 1 + TRANSFER_ID.size)[0]
+            transfer['resume_from'] = RESUME_FROM.unpack_from(payload, 1 + TRANSFER_ID.size + CHUNK_SIZE_FIELD.size)[0]
+            transfer['codec'] = CODEC_FIELD.unpack_from(payload, 1 + TRANSFER_ID.size + CHUNK_SIZE_FIELD.size + RESUME_FROM.size)[0]
+            transfer['status'] = 'sending'
+            transfer['accepted'].set()
+
+def _handle_file_sack(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Entrega una confirmación selectiva al hilo emisor correspondiente."""
+    transfer_id = TRANSFER_ID.unpack_from(payload, 1)[0]
+    with state['file_transfer_lock']:
+        transfer = state['file_transfer_state'].get((src_mac, transfer_id))
+    if transfer:
+        transfer['acks'].put(unpack_sack(payload[1 + TRANSFER_ID.size:]))
+
+def _handle_file_done(sock, my_mac, state, dest_mac, src_mac, payload):
+    """El receptor verificó el archivo: su estado (un entero) marca el fin en la cola de SACK."""
+    transfer_id = TRANSFER_ID.unpack_from(payload, 1)[0]
+    with state['file_transfer_lock']:
+        transfer = state['file_transfer_state'].get((src_mac, transfer_id))
+    if transfer:
+        transfer['acks'].put(DONE_STATUS.unpack_from(payload, 1 + TRANSFER_ID.size)[0])
+
+def _handle_file_data(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Escribe un trozo de archivo en su posición y lo confirma cuando corresponde."""
+    try:
+        # El payload es el id de transferencia (4 bytes) + número de secuencia (4 bytes) + datos
+        transfer_id, seq_num, chunk_data = parse_file_data(payload)
+        _receive_chunk(sock, my_mac, state, src_mac, transfer_id, seq_num, chunk_data, False)
+    except Exception as e:
+        state['gui_queue'].put(('error', f"Error al recibir trozo de archivo: {e}"))
+
+def _handle_file_data_compressed(sock, my_mac, state, dest_mac, src_mac, payload):
+    """Como FILE_DATA, pero el trozo viene comprimido con la compresión negociada."""
+    try:
+        transfer_id, seq_num, chunk_data = parse_file_data(payload)
+        _receive_chunk(sock, my_mac, state, src_mac, transfer_id, seq_num, chunk_data, True)
+    except Exception as e:
+        state['gui_queue'].put(('error', f"Error al recibir trozo de archivo: {e}"))
+
+def _chunk_contents(request, seq_num, chunk_data, compressed):
+    """
+    Descomprime un trozo si hace falta y comprueba que mide lo que le corresponde por su
+    posición (todos chunk_size salvo el último). Nunca descomprime más de esa longitud.
+    Un trozo sin comprimir puede traer detrás el relleno de una trama corta, que se quita.
+    Returns:
+        El contenido del trozo, o None si no es válido.
+    """
+    chunk_size = request['chunk_size']
+    expected = min(chunk_size, request['file_size'] - seq_num * chunk_size)
+    if compressed:
+        if request['decompress'] is None:
+            # No se negoció compresión
+            return None
+        try:
+            chunk_data = request['decompress'](chunk_data, expected)
+        except ValueError:
+            return None
+    if len(chunk_data) < expected:
+        return None
+    return chunk_data[:expected]
+
+def _receive_chunk(sock, my_mac, state, src_mac, transfer_id, seq_num, chunk_data, compressed):
+    ack_requested = seq_num & SEQ_ACK_REQUEST
+    seq_num &= SEQ_MASK
+
+    # Solo necesitamos el candado para localizar la solicitud: la escritura se hace fuera
+    # porque este hilo es el único que escribe en el archivo (solo toma el io_lock de la solicitud).
+    with state['pending_file_requests_lock']:
+        request = state['pending_file_requests'].get((src_mac, transfer_id))
+
+    if request is not None and request['fd'] is not None:
+        window = request['window']
+        now = time.monotonic()
+        request['active_at'] = now
+        if request['folder'] is not None:
+            request['folder']['active_at'] = now
+
+        expected_seq = window.cumulative
+        is_new = window.is_missing(seq_num)
+
+        if is_new:
+            # Los duplicados ni se descomprimen
+            chunk_data = _chunk_contents(request, seq_num, chunk_data, compressed)
+            if chunk_data is None:
+                # Se descarta como si se hubiera perdido: el emisor lo reenviará
+                state['metrics'].inc('file_data_invalid')
+                return
+            # Cada trozo va a su posición, así el orden de llegada no importa
+            # y los duplicados no se escriben dos veces. El trozo sin comprimir
+            # pasa de la trama al disco sin copias intermedias.
+            with request['io_lock']:
+                # Otro hilo pudo cerrarla después de buscarla (la sustituyó otra descarga del
+                # mismo archivo o se abandonó): su número de descriptor ya puede ser de otro archivo
+                if request['fd'] is None:
+                    state['metrics'].inc('file_data_unmatched')
+                    return
+                os.pwrite(request['fd'], chunk_data, seq_num * request['chunk_size'])
+            window.mark(seq_num)
+            # Actualizar el tamaño descargado
+            request['downloaded_size'] += len(chunk_data)
+            request['metrics'].bytes += len(chunk_data)
+            if request['folder'] is not None:
+                request['folder']['downloaded_size'] += len(chunk_data)
+            # Los archivos de una carpeta cuentan en el progreso de la carpeta
+            state['transfer_progress'].advance(request['folder'] if request['folder'] is not None else request)
+            request['unacked'] += 1
+            if now >= request['checkpoint_at']:
+                _checkpoint_request(state, request)
+        else:
+            state['metrics'].inc('file_data_duplicates')
+
+        # Confirmamos de inmediato si hay huecos, duplicados, si ya está completo o si el
+        # emisor se quedó sin ventana y lo pide; en otro caso, solo cada request['ack_every'] trozos.
+        if (ack_requested or not is_new or seq_num != expected_seq or window.has_gaps()
+                or window.complete() or request['unacked'] >= request['ack_every']):
+            request['unacked'] = 0
+            _send_sack(state, my_mac, src_mac, transfer_id, request)
+    else:
+        # Trozo de una transferencia que no conocemos o que ya se está cerrando
+        state['metrics'].inc('file_data_unmatched')
+
+def _handle_file_end(sock, my_mac, state, dest_mac, src_mac, payload):
+    """
+    Finaliza una transferencia entrante, o pide los trozos que faltan.
+    La verificación, el cambio de propietario y la confirmación los hace state['finalizer']
+    en otro hilo: aquí solo se cierra el archivo y se encarga el trabajo.
+    """
+    try:
+        # El payload es el id de transferencia (4 bytes) + resumen del archivo completo (32 bytes)
+        transfer_id = TRANSFER_ID.unpack_from(payload, 1)[0]
+        digest = FILE_DIGEST.unpack_from(payload, 1 + TRANSFER_ID.size)[0]
+        key = (src_mac, transfer_id)
+        with state['pending_file_requests_lock']:
+            request = state['pending_file_requests'].get(key)
+            if request is None:
+                # Ya lo finalizamos antes y se perdió nuestro FILE_DONE: lo repetimos
+                _send_file_done(state, my_mac, src_mac, transfer_id)
+                return
+
+            # Ya la descartamos por llegar dañada y se perdió nuestro FILE_DONE: lo repetimos
+            if request.get('status') == 'corrupt':
+                _send_file_done(state, my_mac, src_mac, transfer_id, FILE_DONE_CORRUPT)
+                return
+
+            # Se está verificando: el FILE_DONE saldrá cuando termine
+            if request.get('status') == 'finalizing':
+                return
+
+            # Si faltan trozos, respondemos con un SACK para que el emisor los reenvíe
+            if not request['window'].complete():
+                _send_sack(state, my_mac, src_mac, transfer_id, request)
+                return
+
+            close_incoming_request(request)
+            request['status'] = 'finalizing'
+        state['finalizer'].submit(_finalize_request, sock, my_mac, state, key, request, digest)
+    except Exception as e:
+        state['gui_queue'].put(('error', f"Error al finalizar archivo: {e}"))
+
+def _finalize_request(sock, my_mac, state, key, request, digest):
+    """
+    Termina una descarga completa (en un hilo de state['finalizer']): verifica el contenido,
+    avisa a la GUI, cambia el propietario de lo recibido y confirma al emisor.
+    """
+    src_mac, transfer_id = key
+    try:
+        file_name = request['file_name']
+        file_path = request['path']
+        is_folder = request.get('is_folder', False)
+
+        # Verificamos el contenido antes de darlo por recibido. Si no coincide no hay
+        # nada que reanudar: se borra y el emisor tendrá que enviarlo de nuevo.
+        # (Una carpeta no tiene contenido propio: sus archivos ya se verificaron uno a uno.)
+        if not is_folder:
+            remove_checkpoint(file_path)
+            if digest != request['digest'] or resumen_archivo(file_path, FILE_DIGEST_ALGORITHM) != digest:
+                os.remove(file_path)
+                # La solicitud se queda para responder igual a los FILE_END repetidos
+                request['status'] = 'corrupt'
+                state['transfer_progress'].finish(request)
+                request['metrics'].finish(False)
+                state['gui_queue'].put(('error', f"El archivo '{file_name}' llegó dañado y se descartó."))
+                _send_file_done(state, my_mac, src_mac, transfer_id, FILE_DONE_CORRUPT)
+                return
+
+        if not is_folder:
+            request['metrics'].finish(True)
+
+        if request['folder'] is not None:
+            # Un archivo de una carpeta: el aviso se da cuando termina la carpeta entera
+            _send_file_done(state, my_mac, src_mac, transfer_id)
+            return
+
+        state['transfer_progress'].finish(request)
+
+        # Los archivos de una carpeta ya están en su sitio: no hay nada que descomprimir
+        final_path = file_path
+        if is_folder:
+            state['gui_queue'].put(('folder_received', file_name))
+        else:
+            # Notificar a la GUI que la descarga del archivo terminó
+            state['gui_queue'].put(('file_received', file_name))
+
+        # CAMBIAR EL PROPIETARIO DEL ARCHIVO O CARPETA RECIBIDA
+        sudo_user = os.environ.get('SUDO_USER')
+        if sudo_user and os.path.exists(final_path):
+            try:
+                # 4. Cambiamos el propietario de la carpeta/archivo final
+                if os.path.isdir(final_path):
+                    # Si es un directorio, cambiamos propietario recursivamente
+                    for dirpath, dirnames, filenames in os.walk(final_path):
+                        shutil.chown(dirpath, user=sudo_user, group=sudo_user)
+                        for filename in filenames:
+                            shutil.chown(os.path.join(dirpath, filename), user=sudo_user, group=sudo_user)
+                else:
+                    # Si es un archivo, solo a él
+                    shutil.chown(final_path, user=sudo_user, group=sudo_user)
+            except Exception as chown_e:
+                state['gui_queue'].put(('error', f"No se pudo cambiar el dueño de {final_path}: {chown_e}"))
+
+        # ENVIAR CONFIRMACIÓN DE VUELTA AL EMISOR
+        confirmation_message = f"[Sistema] El elemento '{file_name}' fue recibido correctamente.".encode('utf-8')
+        send_chat(sock, my_mac, state, src_mac, confirmation_message)
+
+        # Le indicamos al emisor que puede dejar de reenviar FILE_END
+        _send_file_done(state, my_mac, src_mac, transfer_id)
+    except Exception as e:
+        # El siguiente FILE_END del emisor lo volverá a intentar
+        request['status'] = None
+        state['gui_queue'].put(('error', f"Error al finalizar archivo: {e}"))
+    finally:
+        # Limpiar la solicitud pendiente (salvo si se descartó o hay que reintentarlo)
+        if request.get('status') == 'finalizing':
+            with state['pending_file_requests_lock']:
+                if state['pending_file_requests'].get(key) is request:
+                    del state['pending_file_requests'][key]
+
+def build_dispatcher():
+    """
+    Crea el despachador con los manejadores de todos los tipos de mensaje del protocolo.
+    Para añadir un tipo nuevo basta con registrar su manejador aquí (o en state['dispatcher']).
+    """
+    dispatcher = Dispatcher()
+    dispatcher.register(MSG_TYPE_DISCOVERY, _handle_discovery, "discovery")
+    dispatcher.register(MSG_TYPE_DISCOVERY_PROBE, _handle_discovery_probe, "discovery_probe")
+    dispatcher.register(MSG_TYPE_DISCOVERY_REPLY, _handle_discovery_reply, "discovery_reply")
+    dispatcher.register(MSG_TYPE_CHAT, _handle_chat, "chat")
+    dispatcher.register(MSG_TYPE_CHAT_RELIABLE, _handle_chat_reliable, "chat_reliable")
+    dispatcher.register(MSG_TYPE_CHAT_ACK, _handle_chat_ack, "chat_ack")
+    dispatcher.register(MSG_TYPE_FRAGMENT, _handle_fragment, "fragment")
+    dispatcher.register(MSG_TYPE_BUNDLE, _handle_bundle, "bundle")
+    dispatcher.register(MSG_TYPE_FILE_START, _handle_file_start, "file_start")
+    dispatcher.register(MSG_TYPE_FILE_DATA, _handle_file_data, "file_data")
+    dispatcher.register(MSG_TYPE_FILE_DATA_COMPRESSED, _handle_file_data_compressed, "file_data_compressed")
+    dispatcher.register(MSG_TYPE_FILE_END, _handle_file_end, "file_end")
+    dispatcher.register(MSG_TYPE_FILE_ACK, _handle_file_ack, "file_ack")
+    dispatcher.register(MSG_TYPE_FILE_SACK, _handle_file_sack, "file_sack")
+    dispatcher.register(MSG_TYPE_FILE_DONE, _handle_file_done, "file_done")
+    return dispatcher
+
+def setup_receive(sock, state):
+    """
+    Prepara la recepción: abre el receptor y deja en el estado el receptor (para consultar
+    sus contadores de tramas descartadas), el despachador y el recompositor de fragmentos.
+    Returns:
+        RingReceiver | SocketReceiver: El receptor abierto sobre el socket.
+    """
+    # El búfer debe admitir tramas de la MTU de la interfaz (jumbo frames incluidos)
+    mtu = state.get('mtu') or DEFAULT_MTU
+    frame_buffer_size = max(1518, ETH_HEADER_SIZE + mtu)
+
+    # Recibimos por lotes (anillo del kernel o recv_into)
+    receiver = open_receiver(sock, frame_buffer_size)
+    state['receiver'] = receiver
+
+    # Se puede dejar un despachador propio en el estado antes de arrancar la recepción
+    state['dispatcher'] = state.get('dispatcher') or build_dispatcher()
+    # Los mensajes fragmentados se recomponen al recibirlos (solo los usa quien recibe)
+    state['reassembler'] = Reassembler()
+    return receiver
 
 def receive_thread(sock, my_mac, state):
     """
     Hilo que escucha continuamente paquetes entrantes y los procesa.
+    Cada trama se entrega al manejador de su tipo a través del despachador.
     Args:
         sock (socket): El socket RAW en el que escuchar.
         my_mac (bytes): La dirección MAC de este host para ignorar sus propios paquetes.
@@ -16,266 +797,576 @@ def receive_thread(sock, my_mac, state):
     """
     gui_queue = state['gui_queue'] # Obtenemos la cola de la GUI
 
+    frames = setup_receive(sock, state).frames()
+    dispatch = state['dispatcher'].dispatch
+    # Cualquier trama de un vecino conocido demuestra que sigue ahí
+    peer_seen = state['peers'].seen
+
     while True:
         try:
-            raw_data, addr = sock.recvfrom(1518)
-            
-            dest_mac, src_mac, eth_type = struct.unpack('!6s6sH', raw_data[:14])
+            # La trama es un memoryview sobre memoria que se reutiliza: el payload se
+            # procesa sin copiarlo y solo se copia lo que haya que conservar.
+            dest_mac, src_mac, msg_type, payload = parse_frame(next(frames))
             
             if src_mac == my_mac:
                 continue
 
-            payload = raw_data[14:]
-            msg_type = payload[:1]
-
-            # --- Lógica de procesamiento de mensajes ---
-            if msg_type == MSG_TYPE_DISCOVERY:
-                # Añadir host si es nuevo
-                is_new_host = False
-                with state['known_hosts_lock']:
-                    if src_mac not in state['known_hosts']:
-                        state['known_hosts'][src_mac] = "Nuevo Usuario"
-                        is_new_host = True
-                
-                if is_new_host:
-                    # Notificamos a la GUI que hay un nuevo usuario
-                    gui_queue.put(('new_user', src_mac))
-
-           
-            
-
-            elif msg_type == MSG_TYPE_CHAT:
-                try:
-                    # Decodificamos el mensaje y lo limpiamos con .strip()
-                    message_text = payload[1:].decode('utf-8').strip()
-                    
-                    sender_mac_str = mac_bits_cadena(src_mac)
-                    
-                    # Determinar si es un mensaje privado o broadcast
-                    if dest_mac == my_mac:
-                        # Es un mensaje privado para nosotros
-                        display_text = f"[Privado de {sender_mac_str}]: {message_text}"
-                    else:
-                        # Es un mensaje broadcast
-                        display_text = f"[{sender_mac_str}]: {message_text}"
-                    
-                    # Ponemos el mensaje formateado en la cola
-                    gui_queue.put(('chat_message', display_text))
-
-                except UnicodeDecodeError:
-                    sender_mac_str = mac_bits_cadena(src_mac)
-                    gui_queue.put(('chat_message', f"[{sender_mac_str}]: [mensaje con formato inválido]"))
-            
-            # 5. Añadir lógica para manejar solicitudes de archivo
-            elif msg_type == MSG_TYPE_FILE_START:
-                try:
-                    # Desempaquetar la bandera (1 byte) y el tamaño (8 bytes)
-                    is_folder_flag = payload[1:2]
-                    file_size = struct.unpack('!Q', payload[2:10])[0]
-                    
-                    # El resto del payload contiene el nombre del archivo y el delimitador
-                    file_name_payload = payload[10:]
-                    
-                    # Encontrar la posición del delimitador nulo
-                    null_terminator_pos = file_name_payload.find(b'\x00')
-                    
-                    if null_terminator_pos == -1:
-                        raise ValueError("Paquete FILE_START malformado, sin delimitador de nombre.")
-
-                    # Decodificar solo la parte del nombre del archivo
-                    file_name = file_name_payload[:null_terminator_pos].decode('utf-8')
-                    
-                    # --- LÓGICA DE ACEPTACIÓN AUTOMÁTICA PARA CLI ---
-                    run_mode = os.environ.get('RUN_MODE', 'GUI').upper()
-                    if run_mode == 'CLI':
-                        # --- MODO CLI: PREPARARSE SIN ENVIAR ACK ---
-                        with state['pending_file_requests_lock']:
-                            state['pending_file_requests'][src_mac] = {
-                                "file_name": file_name,
-                                "file_size": file_size,
-                                "downloaded_size": 0,
-                                "path": file_name,
-                                "is_folder": is_folder_flag == b'\x01'
-                            }
-                        # NO enviamos ACK. Solo notificamos que la descarga ha comenzado.
-                        gui_queue.put(('file_download_started', file_name))
-                    else:
-                        # --- MODO GUI: PREGUNTAR Y ENVIAR ACK (si se acepta) ---
-                        # Este bloque se mantiene intacto para la GUI
-                        gui_queue.put(('file_request', src_mac, file_name, file_size, is_folder_flag == b'\x01'))
-
-                except Exception as e:
-                    gui_queue.put(('error', f"Error al procesar solicitud de archivo: {e}"))
-            
-            # 5. Añadir lógica para manejar el ACK de archivo
-            elif msg_type == MSG_TYPE_FILE_ACK:
-                # --- ESTE BLOQUE SOLO AFECTA A LA GUI ---
-                with state['file_transfer_lock']:
-                    if src_mac in state['file_transfer_state']:
-                        state['file_transfer_state'][src_mac]['status'] = 'sending'
-            
-            # 1. Añadir lógica para recibir trozos de archivo
-            elif msg_type == MSG_TYPE_FILE_DATA:
-                try:
-                    with state['pending_file_requests_lock']:
-                        if src_mac in state['pending_file_requests']:
-                            request = state['pending_file_requests'][src_mac]
-                            file_path = request['path']
-                            
-                            # El payload es el número de secuencia (4 bytes) + datos
-                            chunk_data = payload[5:] # Ignoramos el seq_num por ahora
-                            
-                            # Abrir el archivo en modo 'append binary' y escribir el trozo
-                            with open(file_path, 'ab') as f:
-                                f.write(chunk_data)
-                            
-                            # Actualizar el tamaño descargado
-                            request['downloaded_size'] += len(chunk_data)
-                except Exception as e:
-                    state['gui_queue'].put(('error', f"Error al recibir trozo de archivo: {e}"))
-
-            # 2. Añadir lógica para finalizar la transferencia
-            elif msg_type == MSG_TYPE_FILE_END:
-                try:
-                    with state['pending_file_requests_lock']:
-                        if src_mac in state['pending_file_requests']:
-                            request = state['pending_file_requests'][src_mac]
-                            file_name = request['file_name']
-                            file_path = request['path']
-                            is_folder = request.get('is_folder', False)
-
-                            # Definimos la ruta de destino final
-                            final_path = file_path
-                            original_folder_name = ""
-
-                            # Lógica de descompresión
-                            if is_folder and os.path.exists(file_path):
-                                try:
-                                    # 1. Obtenemos el nombre de la carpeta original
-                                    original_folder_name = file_name.replace('.zip', '')
-                                    final_path = original_folder_name # La ruta final será la nueva carpeta
-
-                                    # 2. Descomprimimos el archivo en un nuevo directorio con el nombre original
-                                    shutil.unpack_archive(file_path, final_path)
-                                    
-                                    # 3. Borramos el archivo zip temporal
-                                    os.remove(file_path)
-                                    
-                                    # Notificamos a la GUI con el nombre original de la carpeta
-                                    state['gui_queue'].put(('folder_received', original_folder_name))
-                                except Exception as unpack_e:
-                                    state['gui_queue'].put(('error', f"No se pudo descomprimir {file_name}: {unpack_e}"))
-                            else:
-                                # Notificar a la GUI que la descarga del archivo terminó
-                                state['gui_queue'].put(('file_received', file_name))
-
-                            # CAMBIAR EL PROPIETARIO DEL ARCHIVO O CARPETA RECIBIDA
-                            sudo_user = os.environ.get('SUDO_USER')
-                            if sudo_user and os.path.exists(final_path):
-                                try:
-                                    # 4. Cambiamos el propietario de la carpeta/archivo final
-                                    if os.path.isdir(final_path):
-                                        # Si es un directorio, cambiamos propietario recursivamente
-                                        for dirpath, dirnames, filenames in os.walk(final_path):
-                                            shutil.chown(dirpath, user=sudo_user, group=sudo_user)
-                                            for filename in filenames:
-                                                shutil.chown(os.path.join(dirpath, filename), user=sudo_user, group=sudo_user)
-                                    else:
-                                        # Si es un archivo, solo a él
-                                        shutil.chown(final_path, user=sudo_user, group=sudo_user)
-                                except Exception as chown_e:
-                                    state['gui_queue'].put(('error', f"No se pudo cambiar el dueño de {final_path}: {chown_e}"))
-
-                            # ENVIAR CONFIRMACIÓN DE VUELTA AL EMISOR
-                            display_name = original_folder_name if is_folder else file_name
-                            confirmation_message = f"[Sistema] El elemento '{display_name}' fue recibido correctamente.".encode('utf-8')
-                            eth_header = struct.pack('!6s6sH', src_mac, my_mac, LINK_CHAT_ETHERTYPE)
-                            packet = eth_header + MSG_TYPE_CHAT + confirmation_message
-                            sock.send(packet)
-
-                            # Limpiar la solicitud pendiente
-                            del state['pending_file_requests'][src_mac]
-                except Exception as e:
-                    state['gui_queue'].put(('error', f"Error al finalizar archivo: {e}"))
+            peer_seen(src_mac)
+            dispatch(msg_type, sock, my_mac, state, dest_mac, src_mac, payload)
 
+        except StopIteration:
+            # El socket se cerró: no hay nada más que recibir
+            break
         except Exception as e:
+            state['metrics'].inc('receive_errors')
+            state['metrics'].trace('receive_error', error=str(e))
             gui_queue.put(('error', f"Error en el hilo receptor: {e}"))
 
-def file_sender_thread(sock, my_mac, dest_mac_bytes, file_path, state, is_temp_zip=False):
+def send_chat(sock, my_mac, state, dest_mac, data):
     """
-    Hilo dedicado para enviar un archivo, gestionando la espera del ACK y el envío por trozos.
+    Envía un mensaje de chat. Los mensajes privados a vecinos que admiten el chat fiable
+    se confirman y se reenvían si se pierden; el resto sale una sola vez.
+    Args:
+        dest_mac (bytes): El destinatario, o BROADCAST_MAC para toda la red.
+        data (bytes): El texto del mensaje, ya codificado.
     """
-    try:
-        run_mode = os.environ.get('RUN_MODE', 'GUI').upper()
+    peer = state['peers'].get(dest_mac) if CHAT_RELIABLE and dest_mac != BROADCAST_MAC else None
+    if peer is None or not (peer['caps'] and peer['caps']['flags'] & CAP_RELIABLE_CHAT):
+        send_payload(sock, my_mac, state, dest_mac, MSG_TYPE_CHAT + data)
+        return
 
-        if run_mode == 'CLI':
-            # --- MODO CLI: ENVÍO DIRECTO ---
-            # Pequeña pausa para que el receptor procese el FILE_START
-            time.sleep(0.2)
-        else:
-            # --- MODO GUI: ESPERAR ACK ---
-            wait_time = FILE_TRANSFER_TIMEOUT
-            while wait_time > 0:
-                with state['file_transfer_lock']:
-                    transfer = state['file_transfer_state'].get(dest_mac_bytes)
-                    if transfer and transfer.get("status") == "sending":
-                        break
-                time.sleep(1)
-                wait_time -= 1
-            
-            if wait_time == 0:
-                error_message = f"El receptor {mac_bits_cadena(dest_mac_bytes)} no aceptó el archivo a tiempo."
-                state['gui_queue'].put(('error', error_message))
-                return
+    rto = CHAT_RETRY_TIMEOUT
+    if peer['rtt'] is not None:
+        rto = min(CHAT_RETRY_TIMEOUT, max(CHAT_MIN_RETRY_TIMEOUT, 4 * peer['rtt']))
+    payload = state['chat'].queue_message(dest_mac, data, rto)
+    # Si la ventana del vecino está llena, el mensaje saldrá cuando lleguen confirmaciones
+    if payload is not None:
+        send_payload(sock, my_mac, state, dest_mac, payload)
 
-        # --- LÓGICA DE ENVÍO COMÚN ---
-        # (Esta parte ahora se ejecuta después de la lógica específica de cada modo)
-        header = struct.pack('!6s6sH', dest_mac_bytes, my_mac, LINK_CHAT_ETHERTYPE)
-        with open(file_path, 'rb') as f:
-            seq_num = 0
-            while True:
-                chunk = f.read(FILE_CHUNK_SIZE)
-                if not chunk:
-                    break
-                data_payload = MSG_TYPE_FILE_DATA + struct.pack('!I', seq_num) + chunk
-                sock.send(header + data_payload)
-                seq_num += 1
-                time.sleep(0.002)
-        
-        # --- 3. Enviar Paquete de Fin ---
-        sock.send(header + MSG_TYPE_FILE_END)
-        
+def coalescer_thread(sock, my_mac, state):
+    """
+    Hilo del agrupador de mensajes: crea state['coalescer'] y envía cada grupo
+    cuando vence su plazo (COALESCE_DELAY) aunque no se haya llenado la trama.
+    """
+    coalescer = Coalescer(state.get('mtu') or DEFAULT_MTU)
+    state['coalescer'] = coalescer
+    while True:
+        try:
+            coalescer.wait(flush_coalescer(my_mac, state))
+        except Exception as e:
+            print(f"Error en el hilo agrupador: {e}")
+            break
+
+def flush_coalescer(my_mac, state):
+    """
+    Envía los grupos de state['coalescer'] cuyo plazo ha vencido.
+    Returns:
+        float | None: Segundos hasta el siguiente plazo (None si no queda nada esperando).
+    """
+    ready, wait = state['coalescer'].due()
+    for dest_mac, payload in ready:
+        state['send_scheduler'].send(struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE) + payload,
+                                     PRIORITY_CHAT)
+    return wait
+
+def chat_thread(sock, my_mac, state):
+    """
+    Hilo del chat fiable: reenvía los mensajes sin confirmar, envía las confirmaciones
+    retrasadas y avisa de los mensajes que no se pudieron entregar.
+    """
+    chat = state['chat']
+    while True:
+        try:
+            chat.wait(run_chat_timers(sock, my_mac, state))
+        except Exception as e:
+            print(f"Error en el hilo de chat: {e}")
+            break
+
+def run_chat_timers(sock, my_mac, state):
+    """
+    Envía los reenvíos y confirmaciones del chat fiable que tocan ya y avisa de los
+    mensajes que agotaron los reintentos.
+    Returns:
+        float | None: Segundos hasta la siguiente tarea (None si no hay ninguna).
+    """
+    to_send, failed, wait = state['chat'].due()
+    for dest_mac, payload in to_send:
+        # Las confirmaciones van por delante de los mensajes
+        priority = PRIORITY_CONTROL if payload[:1] == MSG_TYPE_CHAT_ACK else PRIORITY_CHAT
+        send_payload(sock, my_mac, state, dest_mac, payload, priority)
+    for dest_mac, data in failed:
+        text = data.decode('utf-8', errors='replace')
+        state['gui_queue'].put(('error', f"No se pudo entregar a {mac_bits_cadena(dest_mac)} el mensaje: {text}"))
+    return wait
+
+def send_thread(sock, state):
+    """
+    Hilo de envío: el único que escribe en el socket. Los demás hilos dejan sus tramas
+    en state['send_scheduler'], que las pone en la red por orden de prioridad.
+    """
+    state['send_scheduler'].run(sock)
+
+def register_outgoing_transfer(state, dest_mac_bytes, acks=None, accepted=None):
+    """
+    Registra una transferencia saliente en 'file_transfer_state' con un id nuevo.
+    Debe llamarse antes de enviar el FILE_START para no perder un ACK rápido.
+    Args:
+        acks: Objeto con put() por el que llegan los SACK (por defecto, una queue.Queue).
+        accepted: Objeto con set() que se activa con el FILE_ACK (por defecto, un threading.Event).
+    Returns:
+        dict: La entrada creada, con el id, la cola de SACK y el evento de aceptación.
+    """
+    transfer_id = new_transfer_id()
+    transfer = {
+        "id": transfer_id,
+        "dest_mac": dest_mac_bytes,
+        "status": "pending_ack",
+        # Cola por la que el hilo receptor entrega los SACK de esta transferencia
+        "acks": acks if acks is not None else queue.Queue(),
+        # Se activa cuando llega el FILE_ACK
+        "accepted": accepted if accepted is not None else threading.Event(),
+    }
+    with state['file_transfer_lock']:
+        state['file_transfer_state'][(dest_mac_bytes, transfer_id)] = transfer
+    return transfer
+
+def start_file_transfer(sock, my_mac, state, dest_mac_bytes, file_path, file_name=None):
+    """
+    Registra la transferencia y lanza el hilo emisor, que envía el FILE_START.
+    Se pueden lanzar tantas transferencias simultáneas como se quiera, al mismo o a distintos destinos.
+    Con el motor asyncio (state['engine']) la transferencia es una tarea del bucle, no un hilo.
+    Returns:
+        int: El id de la transferencia.
+    """
+    engine = state.get('engine')
+    if engine is not None:
+        return engine.start_file_transfer(dest_mac_bytes, file_path, file_name or os.path.basename(file_path))
+    transfer = register_outgoing_transfer(state, dest_mac_bytes)
+    sender_thread = threading.Thread(
+        target=file_sender_thread,
+        args=(sock, my_mac, dest_mac_bytes, transfer['id'], file_path, state, file_name or os.path.basename(file_path))
+    )
+    sender_thread.daemon = True
+    sender_thread.start()
+    return transfer['id']
+
+def start_folder_transfer(sock, my_mac, state, dest_mac_bytes, folder_path):
+    """
+    Registra la transferencia de una carpeta y lanza el hilo que la recorre y la envía.
+    Returns:
+        int: El id de la transferencia de la carpeta.
+    """
+    engine = state.get('engine')
+    if engine is not None:
+        return engine.start_folder_transfer(dest_mac_bytes, folder_path)
+    transfer = register_outgoing_transfer(state, dest_mac_bytes)
+    sender_thread = threading.Thread(
+        target=folder_sender_thread,
+        args=(sock, my_mac, dest_mac_bytes, transfer['id'], folder_path, state)
+    )
+    sender_thread.daemon = True
+    sender_thread.start()
+    return transfer['id']
+
+def walk_folder(folder_path):
+    """
+    Recorre una carpeta y lista lo que hay que enviar, sin leer el contenido de los archivos.
+    Returns:
+        tuple: (nombre de la carpeta, [(tipo, ruta local, nombre en la red)], bytes totales).
+        Los nombres en la red son 'carpeta/ruta/relativa' con '/' como separador.
+    """
+    folder_name = os.path.basename(os.path.normpath(folder_path))
+    entries = []
+    total_size = 0
+    for dirpath, dirnames, filenames in os.walk(folder_path):
+        dirnames.sort()
+        relative_dir = os.path.relpath(dirpath, folder_path)
+        prefix = folder_name if relative_dir == '.' else folder_name + '/' + relative_dir.replace(os.sep, '/')
+        # Las subcarpetas vacías se anuncian aparte; las demás se crean con sus archivos
+        if relative_dir != '.' and not dirnames and not filenames:
+            entries.append((FILE_KIND_FOLDER_DIR, dirpath, prefix))
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path):
+                entries.append((FILE_KIND_FOLDER_ENTRY, path, prefix + '/' + filename))
+                total_size += os.path.getsize(path)
+    return folder_name, entries, total_size
+
+# --- Envío de archivos ---
+# Los pasos de un envío (solicitud, ventana deslizante con SACK, fin y métricas) se escriben una
+# sola vez, como generadores que ceden una petición cada vez que hay que esperar algo. Quien los
+# ejecuta hace la espera y devuelve el resultado con send():
+#   ('accepted', transfer, timeout)  -> True si llegó el FILE_ACK a tiempo
+#   ('ack', transfer, timeout)       -> el siguiente SACK (o estado de FILE_DONE), o None si no
+#                                       llegó; con timeout 0 solo se mira lo que ya está en la cola
+#   ('send_bulk', flow, frames)      -> entrega los trozos al planificador cuando tenga sitio
+#   ('pause', seconds)               -> espera (límite de velocidad)
+#   ('call', fn, *args)              -> fn(*args), que puede tardar (leer el archivo entero)
+#   ('register', dest_mac)           -> una transferencia nueva, registrada (entradas de carpeta)
+# run_blocking() los ejecuta en un hilo; el motor asyncio (engine.py), con sus futuros.
+
+def _perform_blocking(state, request, *args):
+    if request == 'ack':
+        transfer, timeout = args
+        try:
+            if timeout:
+                return transfer['acks'].get(timeout=timeout)
+            return transfer['acks'].get_nowait()
+        except queue.Empty:
+            return None
+    if request == 'accepted':
+        transfer, timeout = args
+        return transfer['accepted'].wait(timeout)
+    if request == 'send_bulk':
+        state['send_scheduler'].send_bulk(*args)
+    elif request == 'pause':
+        time.sleep(args[0])
+    elif request == 'call':
+        return args[0](*args[1:])
+    elif request == 'register':
+        return register_outgoing_transfer(state, args[0])
+    return None
+
+def run_blocking(steps, state):
+    """
+    Ejecuta en el hilo actual los pasos de un envío, bloqueándose en cada espera.
+    Returns:
+        El valor que devuelve el generador.
+    """
+    result = error = None
+    while True:
+        try:
+            request = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result = error = None
+        try:
+            result = _perform_blocking(state, *request)
+        except BaseException as e:
+            # El error se lanza dentro del generador para que limpie lo suyo
+            error = e
+
+def forget_outgoing_transfer(state, transfer):
+    """Quita una transferencia saliente de 'file_transfer_state'."""
+    with state['file_transfer_lock']:
+        state['file_transfer_state'].pop((transfer['dest_mac'], transfer['id']), None)
+
+def _offer_transfer(header, transfer, file_name, file_size, kind, digest, state, retransmit=False, codec=CODEC_NONE):
+    """
+    Pasos: envía el FILE_START y espera el FILE_ACK del receptor.
+    Con retransmit=True se repite el FILE_START hasta recibir el ACK; solo se usa con las
+    entradas de una carpeta, que el receptor acepta sin preguntar.
+    Returns:
+        tuple: (chunk_size, resume_from, codec) aceptados por el receptor.
+    """
+    proposed_chunk_size = chunk_size_for_mtu(state.get('mtu') or DEFAULT_MTU)
+    packet = header + MSG_TYPE_FILE_START + build_file_start_payload(
+        transfer['id'], file_name, file_size, kind, proposed_chunk_size, digest, codec)
+
+    # --- ESPERAR ACK (en CLI, y para las entradas de carpeta, el receptor lo envía automáticamente) ---
+    deadline = time.monotonic() + FILE_TRANSFER_TIMEOUT
+    scheduler = state['send_scheduler']
+    scheduler.send(packet)
+    while not (yield ('accepted', transfer, FILE_RETRANSMIT_TIMEOUT if retransmit else FILE_TRANSFER_TIMEOUT)):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"el receptor no aceptó '{file_name}' a tiempo")
+        scheduler.send(packet)
+
+    with state['file_transfer_lock']:
+        return transfer['chunk_size'], transfer['resume_from'], transfer['codec']
+
+def _rate_limit(limiter, dest_mac, nbytes):
+    # Pasos: espera lo que pida el límite de velocidad antes de enviar nbytes
+    delay = limiter.reserve(dest_mac, nbytes)
+    if delay > 0:
+        yield ('pause', delay)
+
+def _send_file_data(header, transfer, file_path, file_size, chunk_size, resume_from, codec, state):
+    """
+    Pasos: envía los trozos de un archivo con la ventana deslizante, desde el primero que le falta al receptor.
+    Returns:
+        tuple: (payload_bytes, wire_bytes), los bytes de los trozos enviados antes y después de comprimirlos.
+    """
+    transfer_id = transfer['id']
+    # Los trozos de cada transferencia forman un flujo propio en el planificador
+    flow = (transfer['dest_mac'], transfer_id)
+    total_chunks = (file_size + chunk_size - 1) // chunk_size
+    window = SendWindow(total_chunks, window_size_for_chunk(chunk_size), FILE_MIN_RETRANSMIT_TIMEOUT, FILE_RETRANSMIT_TIMEOUT,
+                        start=resume_from, initial_cwnd=FILE_INITIAL_CWND, min_cwnd=FILE_MIN_CWND)
+    limiter = state['rate_limiter']
+    dest_mac = transfer['dest_mac']
+    # Bytes confirmados y reenvíos, para las métricas de la transferencia
+    record = transfer['metrics']
+    resumed_bytes = resume_from * chunk_size
+
+    compress = compressor_for(codec, chunk_size)
+    # Bytes de los trozos leídos del archivo y bytes que realmente salieron (tras comprimir)
+    counters = [0, 0]
+
+    with open(file_path, 'rb') as f:
+        fd = f.fileno()
+
+        def build_chunk(seq_num, ack_request=False):
+            chunk = os.pread(fd, chunk_size, seq_num * chunk_size)
+            msg_type = MSG_TYPE_FILE_DATA
+            counters[0] += len(chunk)
+            if compress is not None:
+                packed = compress(chunk)
+                # Si el trozo no se reduce, viaja tal cual
+                if len(packed) < len(chunk):
+                    chunk = packed
+                    msg_type = MSG_TYPE_FILE_DATA_COMPRESSED
+            counters[1] += len(chunk)
+            if ack_request:
+                seq_num |= SEQ_ACK_REQUEST
+            return header + msg_type + FILE_DATA_HEADER.pack(transfer_id, seq_num) + chunk
+
+        # --- Ventana deslizante: N trozos en vuelo, se reenvían solo los perdidos ---
+        retries = 0
+        while not window.done():
+            sack = None
+            if window.can_send_new():
+                # Los trozos nuevos se entregan al planificador en ráfagas de como mucho
+                # FILE_SEND_QUANTUM; él los reparte con las demás transferencias.
+                # Si hay límite de velocidad se espera antes de entregarlos.
+                burst = min(FILE_SEND_QUANTUM, window.new_budget())
+                yield from _rate_limit(limiter, dest_mac, burst * chunk_size)
+                frames = []
+                for i in range(burst):
+                    seq_num = window.take_new()
+                    # Si la ventana se llena, pedimos el SACK sin esperar a que se acumulen más trozos
+                    frames.append(build_chunk(seq_num, i == burst - 1 and not window.can_send_new()))
+                yield ('send_bulk', flow, frames)
+
+                # Si aún queda ventana, solo recogemos los SACK ya llegados y preparamos otra ráfaga
+                if window.can_send_new():
+                    sack = yield ('ack', transfer, 0)
+                    if sack is None:
+                        continue
+
+            sack = sack or (yield ('ack', transfer, window.rto))
+            if sack is None:
+                retries += 1
+                window.backoff()
+                if retries > FILE_MAX_RETRIES:
+                    raise TimeoutError("el receptor dejó de confirmar los trozos")
+                # Sin noticias del receptor: reenviamos los trozos en vuelo más antiguos, tantos
+                # como permite la ventana de congestión; sus SACK destaparán el resto de pérdidas
+                outstanding = window.outstanding()[:int(window.cwnd)]
+                yield from _rate_limit(limiter, dest_mac, len(outstanding) * chunk_size)
+                for seq_num in outstanding:
+                    window.mark_sent(seq_num)
+                yield ('send_bulk', flow, [build_chunk(seq_num, True) for seq_num in outstanding])
+                window.retransmissions += len(outstanding)
+                record.retransmits = window.retransmissions
+                continue
+
+            retries = 0
+            lost = window.on_sack(*sack)
+            record.bytes = min(file_size, window.base * chunk_size) - resumed_bytes
+            record.retransmits = window.retransmissions
+            if lost:
+                yield from _rate_limit(limiter, dest_mac, len(lost) * chunk_size)
+                for seq_num in lost:
+                    window.mark_sent(seq_num)
+                yield ('send_bulk', flow, [build_chunk(seq_num, seq_num == lost[-1]) for seq_num in lost])
+
+    # El RTT medido durante el envío sirve de estimación para el vecino
+    if window.srtt is not None:
+        state['peers'].record_rtt(dest_mac, window.srtt)
+    return counters[0], counters[1]
+
+def _finish_transfer(header, transfer, digest, state):
+    """
+    Pasos: envía el FILE_END hasta que el receptor confirme con un FILE_DONE.
+    Lanza una excepción si no responde o si el archivo le llegó dañado.
+    """
+    packet = header + MSG_TYPE_FILE_END + TRANSFER_ID.pack(transfer['id']) + FILE_DIGEST.pack(digest)
+    status = None
+    for _ in range(FILE_MAX_RETRIES):
+        state['send_scheduler'].send(packet)
+        # Descartamos los SACK atrasados (tuplas) hasta ver el estado del FILE_DONE
+        status = yield ('ack', transfer, FILE_RETRANSMIT_TIMEOUT)
+        while isinstance(status, tuple):
+            status = yield ('ack', transfer, FILE_RETRANSMIT_TIMEOUT)
+        if status is not None:
+            break
+    if status is None:
+        raise TimeoutError("el receptor no confirmó el final de la transferencia")
+    if status != FILE_DONE_OK:
+        raise ValueError("el archivo llegó dañado al receptor (el resumen no coincide)")
+
+def _send_file(header, transfer, file_path, file_name, kind, state):
+    """
+    Pasos: envía un archivo completo: solicitud, trozos y fin.
+    Returns:
+        dict: Estadísticas del envío: bytes, payload_bytes, wire_bytes y seconds.
+    """
+    file_size = os.path.getsize(file_path)
+    # El resumen identifica el contenido (para que el receptor pueda reanudar una
+    # descarga a medias) y le permite verificar el archivo al final. Lee el archivo entero,
+    # así que el motor asyncio lo calcula fuera del bucle.
+    digest = yield ('call', resumen_archivo, file_path, FILE_DIGEST_ALGORITHM)
+    # Solo se propone comprimir si una muestra del archivo se comprime bien
+    codec = yield ('call', choose_codec, file_path, file_size, chunk_size_for_mtu(state.get('mtu') or DEFAULT_MTU))
+    chunk_size, resume_from, codec = yield from _offer_transfer(header, transfer, file_name, file_size, kind, digest,
+                                                                state, retransmit=kind == FILE_KIND_FOLDER_ENTRY,
+                                                                codec=codec)
+    started = time.monotonic()
+    transfer['metrics'] = state['metrics'].begin_transfer('out', transfer['dest_mac'], file_name, file_size)
+    try:
+        payload_bytes, wire_bytes = yield from _send_file_data(header, transfer, file_path, file_size, chunk_size,
+                                                               resume_from, codec, state)
+        yield from _finish_transfer(header, transfer, digest, state)
+    except BaseException:
+        # También si se cancela la tarea del motor asyncio
+        transfer['metrics'].finish(False)
+        raise
+    transfer['metrics'].finish(True)
+    return {
+        "bytes": max(0, file_size - resume_from * chunk_size),
+        "payload_bytes": payload_bytes,
+        "wire_bytes": wire_bytes,
+        "seconds": time.monotonic() - started,
+    }
+
+def send_file_steps(my_mac, transfer, file_path, file_name, state):
+    """
+    Pasos del envío de un archivo registrado con register_outgoing_transfer: envía la solicitud,
+    espera el ACK, envía los trozos y avisa a la GUI del resultado. Al terminar quita la
+    transferencia del estado de la aplicación.
+    """
+    try:
+        header = struct.pack('!6s6sH', transfer['dest_mac'], my_mac, LINK_CHAT_ETHERTYPE)
+        stats = yield from _send_file(header, transfer, file_path, file_name, FILE_KIND_FILE, state)
+        state['gui_queue'].put(('file_sent', file_name, stats))
     except Exception as e:
-        state['gui_queue'].put(('error', f"Error durante el envío de '{os.path.basename(file_path)}': {e}"))
+        state['gui_queue'].put(('file_send_failed', file_name, f"Error durante el envío de '{file_name}': {e}"))
     finally:
-        # --- 4. LIMPIEZA ---
-        # Si el archivo enviado era un zip temporal, lo borramos.
-        if is_temp_zip and os.path.exists(file_path):
+        forget_outgoing_transfer(state, transfer)
+
+def send_folder_steps(my_mac, transfer, folder_path, state):
+    """
+    Pasos del envío de una carpeta sin empaquetarla: anuncia la carpeta y su tamaño total y, una
+    vez aceptada, envía cada archivo según lo va leyendo, como una transferencia propia con su ruta
+    relativa. Al terminar cierra la carpeta con un FILE_END de la transferencia principal.
+    """
+    folder_name = os.path.basename(os.path.normpath(folder_path))
+    try:
+        header = struct.pack('!6s6sH', transfer['dest_mac'], my_mac, LINK_CHAT_ETHERTYPE)
+        folder_name, entries, total_size = yield ('call', walk_folder, folder_path)
+        empty_digest = bytes(FILE_DIGEST_SIZE)
+
+        yield from _offer_transfer(header, transfer, folder_name, total_size, FILE_KIND_FOLDER, empty_digest, state)
+        started = time.monotonic()
+        stats = {"bytes": 0, "payload_bytes": 0, "wire_bytes": 0}
+
+        for kind, path, entry_name in entries:
+            entry = yield ('register', transfer['dest_mac'])
             try:
-                os.remove(file_path)
-                state['gui_queue'].put(('chat_message', f"[Sistema] Archivo temporal '{os.path.basename(file_path)}' eliminado."))
-            except Exception as e:
-                state['gui_queue'].put(('error', f"No se pudo eliminar el archivo temporal: {e}"))
-        
-        # Elimina la entrada de transferencia del estado de la aplicación.
-        with state['file_transfer_lock']:
-            if dest_mac_bytes in state['file_transfer_state']:
-                del state['file_transfer_state'][dest_mac_bytes]
+                if kind == FILE_KIND_FOLDER_DIR:
+                    # Basta con que el receptor la cree
+                    yield from _offer_transfer(header, entry, entry_name, 0, kind, empty_digest, state, retransmit=True)
+                else:
+                    entry_stats = yield from _send_file(header, entry, path, entry_name, kind, state)
+                    for field in stats:
+                        stats[field] += entry_stats[field]
+            finally:
+                forget_outgoing_transfer(state, entry)
+
+        yield from _finish_transfer(header, transfer, empty_digest, state)
+        stats['seconds'] = time.monotonic() - started
+        state['gui_queue'].put(('file_sent', folder_name, stats))
+    except Exception as e:
+        state['gui_queue'].put(('file_send_failed', folder_name,
+                                f"Error durante el envío de la carpeta '{folder_name}': {e}"))
+    finally:
+        forget_outgoing_transfer(state, transfer)
+
+def file_sender_thread(sock, my_mac, dest_mac_bytes, transfer_id, file_path, state, file_name):
+    """
+    Hilo dedicado para enviar un archivo: envía la solicitud, espera el ACK y envía los trozos.
+    La transferencia debe estar registrada con register_outgoing_transfer.
+    """
+    with state['file_transfer_lock']:
+        transfer = state['file_transfer_state'][(dest_mac_bytes, transfer_id)]
+    run_blocking(send_file_steps(my_mac, transfer, file_path, file_name, state), state)
+
+def folder_sender_thread(sock, my_mac, dest_mac_bytes, transfer_id, folder_path, state):
+    """Hilo que envía una carpeta (ver send_folder_steps)."""
+    with state['file_transfer_lock']:
+        transfer = state['file_transfer_state'][(dest_mac_bytes, transfer_id)]
+    run_blocking(send_folder_steps(my_mac, transfer, folder_path, state), state)
+
+def local_capabilities():
+    """Devuelve los bits de capacidades que anuncia este host."""
+    flags = CAP_RESUME | CAP_FOLDERS
+    if CODEC_ZLIB in CODECS:
+        flags |= CAP_COMPRESSION_ZLIB
+    if CODEC_LZMA in CODECS:
+        flags |= CAP_COMPRESSION_LZMA
+    if CHAT_RELIABLE:
+        flags |= CAP_RELIABLE_CHAT
+    # Recibir tramas BUNDLE siempre es posible, aunque no las enviemos
+    flags |= CAP_BUNDLE
+    return flags
+
+def build_discovery_payload(msg_type, mtu):
+    """
+    Construye el payload de un anuncio, sonda o respuesta de descubrimiento (con el byte de tipo).
+    Las sondas y respuestas añaden detrás su propia parte (PROBE_ID o PROBE_ECHO).
+    """
+    return msg_type + DISCOVERY_INFO.pack(PROTOCOL_VERSION, local_capabilities(), mtu)
 
-def discovery_thread(sock, my_mac):
+def send_probe(sock, my_mac, state, dest_mac):
+    """Envía una sonda de descubrimiento (en broadcast o a un vecino concreto)."""
+    header = struct.pack('!6s6sH', dest_mac, my_mac, LINK_CHAT_ETHERTYPE)
+    payload = build_discovery_payload(MSG_TYPE_DISCOVERY_PROBE, state.get('mtu') or DEFAULT_MTU)
+    state['send_scheduler'].send(header + payload + PROBE_ID.pack(state['discovery'].new_probe()))
+
+def discovery_thread(sock, my_mac, state):
     """
-    Hilo que envía un paquete de descubrimiento en broadcast cada 10 segundos.
+    Hilo de descubrimiento. Al arrancar pregunta en broadcast quién hay en la red, y los
+    vecinos responden en menos de DISCOVERY_REPLY_JITTER segundos. Después se anuncia
+    cuando lo decide state['discovery'] (con supresión), sondea por unicast a los vecinos
+    que llevan tiempo callados y quita de la tabla a los que ya no responden.
     """
-    # Prepara la cabecera y el payload del paquete de descubrimiento.
-    header = struct.pack('!6s6sH', BROADCAST_MAC, my_mac, LINK_CHAT_ETHERTYPE)
-    packet = header + MSG_TYPE_DISCOVERY
+    try:
+        # Varias sondas por si alguna se pierde
+        for i in range(DISCOVERY_PROBES):
+            if i:
+                time.sleep(DISCOVERY_PROBE_SPACING)
+            send_probe(sock, my_mac, state, BROADCAST_MAC)
+    except Exception as e:
+        print(f"Error en el hilo de descubrimiento: {e}")
+        return
 
     while True:
         try:
-            # Envía el paquete de descubrimiento a toda la red local.
-            sock.send(packet)
-            # Duerme durante 10 segundos antes de enviar el siguiente.
-            time.sleep(10)
+            time.sleep(run_discovery_timers(sock, my_mac, state))
         except Exception as e:
             print(f"Error en el hilo de descubrimiento: {e}")
-            break
\ No newline at end of file
+            break
+
+def run_discovery_timers(sock, my_mac, state):
+    """
+    Hace lo que toque del descubrimiento: anunciarse si lo decide state['discovery'],
+    sondear a los vecinos callados y quitar de la tabla a los que ya no responden.
+    De paso retira las descargas abandonadas (expire_incoming_requests).
+    Returns:
+        float: Segundos hasta la próxima decisión, como mucho uno para revisar los vecinos.
+    """
+    peers = state['peers']
+    announce, wait = state['discovery'].poll()
+    if announce:
+        # Envía el anuncio a toda la red local.
+        header = struct.pack('!6s6sH', BROADCAST_MAC, my_mac, LINK_CHAT_ETHERTYPE)
+        state['send_scheduler'].send(header + build_discovery_payload(MSG_TYPE_DISCOVERY, state.get('mtu') or DEFAULT_MTU))
+    for mac in peers.unresponsive(PEER_PROBE_AFTER, PEER_PROBE_INTERVAL):
+        send_probe(sock, my_mac, state, mac)
+    for peer in peers.expire():
+        state['metrics'].trace('peer_left', peer=mac_bits_cadena(peer['mac']))
+        state['chat'].forget(peer['mac'])
+        state['gui_queue'].put(('user_left', peer['mac']))
+    expire_incoming_requests(state)
+    return min(wait, 1.0)
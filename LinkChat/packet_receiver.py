@@ -0,0 +1,200 @@
+import mmap
+import select
+import socket
+import struct
+from config import *
+
+# --- Constantes de linux/if_packet.h ---
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+SO_RCVBUFFORCE = 33
+
+# struct tpacket_req3: tamaño y número de bloques/tramas, timeout de retiro de bloque,
+# tamaño del área privada y opciones.
+TPACKET_REQ3 = struct.Struct('7I')
+# Campos de struct tpacket_block_desc que usamos: block_status, num_pkts, offset_to_first_pkt.
+BLOCK_HEADER = struct.Struct('III')
+BLOCK_HEADER_OFFSET = 8
+BLOCK_STATUS = struct.Struct('I')
+# Campos de struct tpacket3_hdr: tp_next_offset, (tp_sec, tp_nsec), tp_snaplen, (tp_len, tp_status), tp_mac.
+PACKET_HEADER = struct.Struct('I8xI8xH')
+# struct tpacket_stats_v3 (tp_packets, tp_drops, tp_freeze_q_cnt). Con un socket
+# sin anillo TPACKET_V3 el kernel solo devuelve los dos primeros campos.
+PACKET_STATS = struct.Struct('III')
+
+
+class _BaseReceiver:
+    """
+    Parte común de los receptores: contadores y lectura de PACKET_STATISTICS.
+    """
+    backend = None
+
+    def __init__(self, sock):
+        self.sock = sock
+        # Tramas entregadas a la aplicación
+        self.packets = 0
+        # Acumulados del kernel (cada lectura de PACKET_STATISTICS pone a cero sus contadores)
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+        self.freeze_count = 0
+
+    def stats(self):
+        """
+        Devuelve los contadores de recepción, incluidas las tramas descartadas por el kernel.
+        Returns:
+            dict: backend, packets, kernel_packets, drops y freeze_count.
+        """
+        try:
+            raw = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, PACKET_STATS.size)
+            raw = raw.ljust(PACKET_STATS.size, b'\x00')
+            kernel_packets, drops, freeze_count = PACKET_STATS.unpack(raw)
+            self.kernel_packets += kernel_packets
+            self.kernel_drops += drops
+            self.freeze_count += freeze_count
+        except (OSError, AttributeError):
+            # No es un socket AF_PACKET: solo tenemos nuestros propios contadores
+            pass
+        return {
+            "backend": self.backend,
+            "packets": self.packets,
+            "kernel_packets": self.kernel_packets,
+            "drops": self.kernel_drops,
+            "freeze_count": self.freeze_count,
+        }
+
+
+class RingReceiver(_BaseReceiver):
+    """
+    Recepción mediante un anillo PACKET_RX_RING (TPACKET_V3) compartido con el kernel.
+    El kernel llena bloques enteros de tramas y nosotros los recorremos sin llamadas al sistema;
+    solo se hace un poll() cuando no queda ningún bloque listo.
+    """
+    backend = "rx_ring"
+
+    def __init__(self, sock, frame_size, block_size=RX_RING_BLOCK_SIZE, block_count=RX_RING_BLOCK_COUNT,
+                 block_timeout_ms=RX_RING_BLOCK_TIMEOUT_MS):
+        super().__init__(sock)
+        # El tamaño de trama debe estar alineado a 16 bytes e incluir la cabecera tpacket3_hdr
+        frame_size = (frame_size + 128 + 15) & ~15
+        self.block_size = block_size
+        self.block_count = block_count
+        frames_per_block = block_size // frame_size
+
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        request = TPACKET_REQ3.pack(block_size, block_count, frame_size, frames_per_block * block_count,
+                                    block_timeout_ms, 0, 0)
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+        self.ring = mmap.mmap(sock.fileno(), block_size * block_count, mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.view = memoryview(self.ring)
+        self.current_block = 0
+
+    def frames(self):
+        """
+        Generador infinito de tramas. Cada trama es un memoryview sobre el anillo que
+        solo es válido hasta pedir la siguiente: quien necesite conservarla debe copiarla.
+        """
+        poller = select.poll()
+        poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        while True:
+            yield from self.ready_frames()
+            # Ningún bloque listo: esperamos a que el kernel retire uno
+            for _, revents in poller.poll(1000):
+                if revents & select.POLLNVAL:
+                    return
+
+    def ready_frames(self):
+        """
+        Como frames(), pero sin bloquear: recorre los bloques que ya están listos y termina.
+        Sirve para leer desde un bucle de eventos cuando el socket avisa de que hay datos.
+        """
+        while True:
+            block_offset = self.current_block * self.block_size
+            status, num_pkts, first_offset = BLOCK_HEADER.unpack_from(self.ring, block_offset + BLOCK_HEADER_OFFSET)
+            if not status & TP_STATUS_USER:
+                return
+
+            packet_offset = block_offset + first_offset
+            for _ in range(num_pkts):
+                next_offset, snaplen, mac_offset = PACKET_HEADER.unpack_from(self.ring, packet_offset)
+                start = packet_offset + mac_offset
+                yield self.view[start:start + snaplen]
+                packet_offset += next_offset
+            self.packets += num_pkts
+
+            # Devolvemos el bloque al kernel y pasamos al siguiente
+            BLOCK_STATUS.pack_into(self.ring, block_offset + BLOCK_HEADER_OFFSET, TP_STATUS_KERNEL)
+            self.current_block = (self.current_block + 1) % self.block_count
+
+
+class SocketReceiver(_BaseReceiver):
+    """
+    Recepción con recv_into sobre búferes preasignados. Tras cada trama que despierta
+    al hilo, vacía sin bloquear hasta RX_BATCH_SIZE tramas más del búfer del kernel.
+    """
+    backend = "recv_into"
+
+    def __init__(self, sock, frame_size, batch_size=RX_BATCH_SIZE):
+        super().__init__(sock)
+        self.buffers = [bytearray(frame_size) for _ in range(batch_size)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+
+    def frames(self):
+        """
+        Generador infinito de tramas. Cada trama es un memoryview sobre un búfer que
+        se reutiliza en el siguiente lote: quien necesite conservarla debe copiarla.
+        """
+        batch_size = len(self.buffers)
+        while True:
+            lengths = [self.sock.recv_into(self.buffers[0])]
+            while len(lengths) < batch_size:
+                try:
+                    lengths.append(self.sock.recv_into(self.buffers[len(lengths)], 0, socket.MSG_DONTWAIT))
+                except (BlockingIOError, InterruptedError):
+                    break
+            self.packets += len(lengths)
+            for view, length in zip(self.views, lengths):
+                yield view[:length]
+
+    def ready_frames(self):
+        """
+        Como frames(), pero sin bloquear: vacía lo que haya en el búfer del kernel y termina.
+        Sirve para leer desde un bucle de eventos cuando el socket avisa de que hay datos.
+        """
+        buffer, view = self.buffers[0], self.views[0]
+        while True:
+            try:
+                length = self.sock.recv_into(buffer, 0, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.packets += 1
+            yield view[:length]
+
+
+def open_receiver(sock, frame_size):
+    """
+    Elige el mejor mecanismo de recepción disponible para el socket.
+    Intenta usar el anillo TPACKET_V3 y, si el kernel o el socket no lo permiten,
+    recurre a recv_into con un búfer de socket ampliado.
+    Returns:
+        RingReceiver | SocketReceiver
+    """
+    if RX_RING_ENABLED:
+        try:
+            return RingReceiver(sock, frame_size)
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    # Un búfer de kernel más grande absorbe las ráfagas de las transferencias
+    for option in (SO_RCVBUFFORCE, socket.SO_RCVBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, RX_SOCKET_BUFFER_SIZE)
+            break
+        except (OSError, AttributeError):
+            continue
+    return SocketReceiver(sock, frame_size)
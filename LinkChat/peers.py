@@ -0,0 +1,118 @@
+import threading
+import time
+
+
+class PeerTable:
+    """
+    Tabla de vecinos descubiertos. De cada uno guarda cuándo se le vio por última vez,
+    su RTT estimado y las capacidades que anuncia, y olvida a los que dejan de dar señales.
+    Cada vecino recibe al unirse un id que no cambia aunque otros se vayan,
+    así '/msg <id>' sigue apuntando al mismo host.
+    """
+    def __init__(self, timeout, lock=None):
+        # Segundos sin ninguna trama del vecino antes de darlo por desaparecido
+        self.timeout = timeout
+        # Se puede pasar un candado propio (por ejemplo, uno que mida las esperas)
+        self._lock = lock if lock is not None else threading.Lock()
+        self._by_mac = {}
+        self._by_id = {}
+        self._next_id = 0
+
+    def observe(self, mac, caps=None):
+        """
+        Registra una señal de vida que anuncia al vecino (un paquete de descubrimiento).
+        Args:
+            mac (bytes): La MAC del vecino.
+            caps (dict | None): Las capacidades que anuncia, si las envía.
+        Returns:
+            dict | None: La entrada creada si el vecino es nuevo, None si ya se conocía.
+        """
+        now = time.monotonic()
+        with self._lock:
+            peer = self._by_mac.get(mac)
+            if peer is not None:
+                peer['last_seen'] = now
+                if caps is not None:
+                    peer['caps'] = caps
+                return None
+            peer = {
+                "id": self._next_id,
+                "mac": mac,
+                "first_seen": now,
+                "last_seen": now,
+                # RTT suavizado en segundos (None hasta tener una medida)
+                "rtt": None,
+                "caps": caps,
+                # Última vez que se le envió una sonda para ver si sigue ahí
+                "probed_at": 0.0,
+            }
+            self._next_id += 1
+            self._by_mac[mac] = peer
+            self._by_id[peer['id']] = peer
+            return dict(peer)
+
+    def seen(self, mac):
+        """
+        Anota que ha llegado una trama de un vecino ya conocido. Se llama con cada trama,
+        así que no toma el candado: una lectura del diccionario y una asignación bastan.
+        """
+        peer = self._by_mac.get(mac)
+        if peer is not None:
+            peer['last_seen'] = time.monotonic()
+
+    def record_rtt(self, mac, rtt):
+        """Incorpora una medida de RTT (en segundos) a la estimación suavizada del vecino."""
+        with self._lock:
+            peer = self._by_mac.get(mac)
+            if peer is not None:
+                peer['rtt'] = rtt if peer['rtt'] is None else 0.875 * peer['rtt'] + 0.125 * rtt
+
+    def unresponsive(self, silent_for, probe_every):
+        """
+        Devuelve las MAC de los vecinos que llevan silent_for segundos sin dar señales y a los
+        que no se les ha enviado una sonda en los últimos probe_every segundos, y anota la sonda.
+        """
+        now = time.monotonic()
+        with self._lock:
+            macs = [peer['mac'] for peer in self._by_mac.values()
+                    if now - peer['last_seen'] > silent_for and now - peer['probed_at'] > probe_every]
+            for mac in macs:
+                self._by_mac[mac]['probed_at'] = now
+        return macs
+
+    def expire(self):
+        """
+        Olvida a los vecinos que llevan más de 'timeout' segundos sin dar señales.
+        Returns:
+            list: Las entradas eliminadas.
+        """
+        deadline = time.monotonic() - self.timeout
+        with self._lock:
+            gone = [peer for peer in self._by_mac.values() if peer['last_seen'] < deadline]
+            for peer in gone:
+                del self._by_mac[peer['mac']]
+                del self._by_id[peer['id']]
+        return gone
+
+    def get(self, mac):
+        """Devuelve una copia de la entrada del vecino, o None si no se conoce."""
+        with self._lock:
+            peer = self._by_mac.get(mac)
+            return dict(peer) if peer is not None else None
+
+    def mac_for_id(self, peer_id):
+        """Devuelve la MAC del vecino con ese id, o None si no existe (o ya se fue)."""
+        with self._lock:
+            peer = self._by_id.get(peer_id)
+            return peer['mac'] if peer is not None else None
+
+    def snapshot(self):
+        """Devuelve una copia de todas las entradas, ordenadas por id."""
+        with self._lock:
+            return [dict(peer) for _, peer in sorted(self._by_id.items())]
+
+    def __contains__(self, mac):
+        return mac in self._by_mac
+
+    def __len__(self):
+        return len(self._by_mac)
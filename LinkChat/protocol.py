@@ -0,0 +1,110 @@
+import struct
+
+# --- Estructuras precompiladas del protocolo ---
+# Compilar el formato una sola vez evita volver a interpretarlo en cada trama.
+
+# Cabecera Ethernet: MAC destino, MAC origen y EtherType.
+ETH_HEADER = struct.Struct('!6s6sH')
+# Número de secuencia de un trozo de archivo (FILE_DATA).
+SEQ_NUM = struct.Struct('!I')
+# Identificador de transferencia: va justo detrás del byte de tipo en todos los
+# mensajes de archivo, para poder tener varias transferencias con el mismo vecino.
+TRANSFER_ID = struct.Struct('!I')
+# Cabecera de un FILE_DATA tras el byte de tipo: id de transferencia y número de secuencia.
+FILE_DATA_HEADER = struct.Struct('!II')
+# Bit alto del número de secuencia: el emisor pide un SACK inmediato porque se quedó
+# sin ventana (último trozo de una ráfaga o reenvío). El resto de bits es el número de secuencia.
+SEQ_ACK_REQUEST = 0x80000000
+SEQ_MASK = 0x7FFFFFFF
+# Resumen SHA-256 del archivo completo (FILE_START y FILE_END).
+FILE_DIGEST = struct.Struct('!32s')
+# Primer trozo que le falta al receptor (FILE_ACK). Es 0 salvo que se reanude una descarga.
+RESUME_FROM = struct.Struct('!I')
+# Resultado de la verificación del archivo recibido (FILE_DONE).
+DONE_STATUS = struct.Struct('!B')
+# Compresión propuesta (FILE_START) o aceptada (FILE_ACK).
+CODEC_FIELD = struct.Struct('!B')
+# Información de un paquete de descubrimiento: versión del protocolo, capacidades y MTU.
+DISCOVERY_INFO = struct.Struct('!BBH')
+# Identificador de una sonda (DISCOVERY_PROBE), detrás de la información de descubrimiento.
+PROBE_ID = struct.Struct('!I')
+# En un DISCOVERY_REPLY: identificador de la sonda respondida y microsegundos que se retuvo la respuesta.
+PROBE_ECHO = struct.Struct('!II')
+# Cabecera de un CHAT_RELIABLE tras el byte de tipo: sesión e id del mensaje. La sesión cambia
+# cada vez que el emisor empieza los ids desde 0, así el receptor sabe cuándo se reinician.
+CHAT_HEADER = struct.Struct('!II')
+# Cabecera de un CHAT_ACK tras el byte de tipo: sesión confirmada y época del receptor. La época
+# cambia cuando el receptor empieza de cero (se reinició o dio al vecino por ido).
+CHAT_ACK_HEADER = struct.Struct('!II')
+# Cabecera de un FRAGMENT tras el byte de tipo: id del mensaje, índice del fragmento y número de fragmentos.
+FRAGMENT_HEADER = struct.Struct('!IHH')
+# Longitud de cada mensaje dentro de un BUNDLE.
+BUNDLE_ENTRY = struct.Struct('!H')
+# Bandera de carpeta y tamaño del archivo al inicio de un FILE_START.
+FILE_START_HEADER = struct.Struct('!cQ')
+# Tamaño de trozo propuesto (FILE_START) o aceptado (FILE_ACK).
+CHUNK_SIZE_FIELD = struct.Struct('!I')
+
+_TYPE_OFFSET = ETH_HEADER.size
+
+
+def parse_frame(frame):
+    """
+    Separa una trama en sus campos sin copiar el payload.
+    Args:
+        frame (memoryview): La trama completa, incluida la cabecera Ethernet.
+    Returns:
+        tuple: (dest_mac, src_mac, msg_type, payload). Las MAC son bytes, msg_type es el
+        valor entero del byte de tipo y payload es un memoryview sobre la trama que empieza en ese byte.
+        Solo es válido mientras lo sea la trama.
+    """
+    dest_mac, src_mac, _ = ETH_HEADER.unpack_from(frame, 0)
+    return dest_mac, src_mac, frame[_TYPE_OFFSET], frame[_TYPE_OFFSET:]
+
+def parse_discovery(payload):
+    """
+    Interpreta el payload de un paquete de descubrimiento.
+    Returns:
+        dict | None: {"version", "flags", "mtu"}, o None si el vecino no envía esa información.
+    """
+    if len(payload) < 1 + DISCOVERY_INFO.size:
+        return None
+    version, flags, mtu = DISCOVERY_INFO.unpack_from(payload, 1)
+    return {"version": version, "flags": flags, "mtu": mtu}
+
+def parse_probe_reply(payload):
+    """
+    Interpreta la parte propia de un DISCOVERY_REPLY.
+    Returns:
+        tuple | None: (nonce, held), con held en segundos, o None si la respuesta está incompleta.
+    """
+    offset = 1 + DISCOVERY_INFO.size
+    if len(payload) < offset + PROBE_ECHO.size:
+        return None
+    nonce, held_us = PROBE_ECHO.unpack_from(payload, offset)
+    return nonce, held_us / 1e6
+
+def iter_bundle(payload):
+    """
+    Recorre los mensajes de un BUNDLE sin copiarlos.
+    Yields:
+        memoryview: Cada mensaje, empezando por su byte de tipo. Un mensaje truncado termina el recorrido.
+    """
+    offset = 1
+    end = len(payload)
+    while offset + BUNDLE_ENTRY.size <= end:
+        length = BUNDLE_ENTRY.unpack_from(payload, offset)[0]
+        offset += BUNDLE_ENTRY.size
+        if length == 0 or offset + length > end:
+            return
+        yield payload[offset:offset + length]
+        offset += length
+
+def parse_file_data(payload):
+    """
+    Interpreta el payload de un FILE_DATA: tipo (1) + id de transferencia (4) + número de secuencia (4) + datos.
+    Returns:
+        tuple: (transfer_id, seq_num, chunk), donde chunk es un memoryview sobre los datos.
+    """
+    transfer_id, seq_num = FILE_DATA_HEADER.unpack_from(payload, 1)
+    return transfer_id, seq_num, payload[1 + FILE_DATA_HEADER.size:]
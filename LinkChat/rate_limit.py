@@ -0,0 +1,87 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Cubo de fichas para limitar el ritmo de envío a 'rate' bytes por segundo,
+    permitiendo ráfagas de hasta 'burst' bytes.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        """
+        Reserva nbytes del cubo, aunque queden fichas negativas.
+        Returns:
+            float: Los segundos que hay que esperar antes de enviar.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Límites de velocidad para los envíos de archivos: uno global y uno por vecino.
+    Solo pasan por aquí los trozos de archivo, así el chat y el descubrimiento
+    nunca esperan detrás de una transferencia grande.
+    """
+    def __init__(self, global_rate=None, peer_rates=None, burst=64 * 1024):
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.global_bucket = None
+        self.peer_buckets = {}
+        self.set_limit(None, global_rate)
+        for mac, rate in (peer_rates or {}).items():
+            self.set_limit(mac, rate)
+
+    def set_limit(self, mac, rate):
+        """
+        Cambia un límite en caliente.
+        Args:
+            mac (bytes | None): El vecino, o None para el límite global.
+            rate (int | None): Bytes por segundo, o None para quitar el límite.
+        """
+        bucket = TokenBucket(rate, max(self.burst, rate // 100)) if rate else None
+        with self.lock:
+            if mac is None:
+                self.global_bucket = bucket
+            elif bucket is None:
+                self.peer_buckets.pop(mac, None)
+            else:
+                self.peer_buckets[mac] = bucket
+
+    def limits(self):
+        """Devuelve el límite global y los de cada vecino (bytes por segundo)."""
+        with self.lock:
+            global_rate = self.global_bucket.rate if self.global_bucket else None
+            return global_rate, {mac: bucket.rate for mac, bucket in self.peer_buckets.items()}
+
+    def reserve(self, mac, nbytes):
+        """
+        Reserva nbytes para el vecino mac sin esperar.
+        Returns:
+            float: Los segundos que hay que esperar antes de enviarlos.
+        """
+        global_bucket = self.global_bucket
+        peer_bucket = self.peer_buckets.get(mac)
+        delay = 0.0
+        if global_bucket is not None:
+            delay = global_bucket.reserve(nbytes)
+        if peer_bucket is not None:
+            delay = max(delay, peer_bucket.reserve(nbytes))
+        return delay
+
+    def wait(self, mac, nbytes):
+        """Bloquea el hilo hasta que se puedan enviar nbytes al vecino mac."""
+        delay = self.reserve(mac, nbytes)
+        if delay > 0:
+            time.sleep(delay)
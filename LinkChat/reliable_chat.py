@@ -0,0 +1,248 @@
+import random
+import threading
+import time
+from collections import deque
+from config import *
+from protocol import CHAT_HEADER, CHAT_ACK_HEADER
+from transfer_window import pack_sack, iter_bitmap
+
+# Distancia máxima por delante de base que se acepta: un emisor correcto nunca pasa de su ventana.
+_MAX_AHEAD = 1024
+
+
+class _ChatReceiveWindow:
+    """
+    Mensajes recibidos de un vecino: todos los anteriores a base y, por encima,
+    un mapa de bits que se desliza a medida que se llenan los huecos.
+    """
+    def __init__(self, session, epoch):
+        self.session = session
+        self.epoch = epoch
+        # Primer id que todavía no ha llegado
+        self.base = 0
+        # El bit i indica si llegó el mensaje base + i (el bit 0 siempre está a 0)
+        self.bits = 0
+
+    def mark(self, msg_id):
+        """Marca el mensaje como recibido. Devuelve False si ya había llegado."""
+        offset = msg_id - self.base
+        if offset < 0 or offset >= _MAX_AHEAD or self.bits >> offset & 1:
+            return False
+        self.bits |= 1 << offset
+        while self.bits & 1:
+            self.bits >>= 1
+            self.base += 1
+        return True
+
+    def build_ack(self):
+        """Construye la confirmación en formato SACK: base y los recibidos por encima de base."""
+        bitmap = bytearray((self.bits.bit_length() + 6) // 8)
+        bits = self.bits >> 1
+        offset = 0
+        while bits:
+            if bits & 1:
+                bitmap[offset // 8] |= 0x80 >> (offset % 8)
+            bits >>= 1
+            offset += 1
+        return pack_sack(self.base, bytes(bitmap))
+
+
+class ReliableChat:
+    """
+    Entrega fiable de mensajes de chat privados: cada mensaje lleva un id por vecino,
+    se reenvía hasta que el receptor lo confirma y el receptor descarta los duplicados.
+    Como mucho window mensajes por vecino esperan confirmación; el resto hace cola.
+
+    No envía nada por sí misma: devuelve los payloads que hay que enviar y el hilo de chat
+    (o quien escribe el mensaje) los pone en la red. Las confirmaciones se retrasan
+    CHAT_ACK_DELAY segundos para que una sola trama confirme varios mensajes.
+    """
+    def __init__(self, window=CHAT_WINDOW, ack_delay=CHAT_ACK_DELAY):
+        self.window = window
+        self.ack_delay = ack_delay
+        self._condition = threading.Condition()
+        # Lado emisor, por vecino: {"session", "next_id", "epoch" (la última vista en sus
+        # confirmaciones), "in_flight": {id: entrada}, "queue": deque}
+        self._outgoing = {}
+        # Lado receptor, por vecino: _ChatReceiveWindow
+        self._incoming = {}
+        # Confirmaciones pendientes: {mac: hora a la que hay que enviarlas}
+        self._acks_due = {}
+        # Hay trabajo nuevo desde la última vez que el hilo de chat miró
+        self._pending = False
+        # Función opcional que se llama al haber trabajo nuevo, para quien no espera con wait()
+        self.on_wake = None
+
+    def _wake(self):
+        self._pending = True
+        self._condition.notify()
+        if self.on_wake is not None:
+            self.on_wake()
+
+    def _peer_out(self, mac):
+        out = self._outgoing.get(mac)
+        if out is None:
+            out = self._outgoing[mac] = {"session": random.getrandbits(32), "next_id": 0, "epoch": None,
+                                         "in_flight": {}, "queue": deque()}
+        return out
+
+    def _restart(self, out):
+        # El receptor empezó de cero y espera ids desde 0, o abandonamos un mensaje y su id
+        # dejaría para siempre un hueco en la ventana del receptor: los mensajes sin confirmar
+        # se renumeran en una sesión nueva y se reenvían ya (alguno que llegara a mostrarse
+        # antes puede verse dos veces).
+        pending = [out['in_flight'][msg_id] for msg_id in sorted(out['in_flight'])]
+        out['session'] = random.getrandbits(32)
+        out['next_id'] = 0
+        out['in_flight'] = {}
+        return [self._launch(out, entry['data'], entry['rto']) for entry in pending]
+
+    def _launch(self, out, data, rto):
+        msg_id = out['next_id']
+        out['next_id'] += 1
+        payload = MSG_TYPE_CHAT_RELIABLE + CHAT_HEADER.pack(out['session'], msg_id) + data
+        out['in_flight'][msg_id] = {
+            "payload": payload,
+            "data": data,
+            "rto": rto,
+            "deadline": time.monotonic() + rto,
+            "retries": 0,
+        }
+        return payload
+
+    def queue_message(self, mac, data, rto=CHAT_RETRY_TIMEOUT):
+        """
+        Registra un mensaje para un vecino.
+        Args:
+            mac (bytes): La MAC del destinatario.
+            data (bytes): El texto del mensaje, ya codificado.
+            rto (float): Segundos antes del primer reenvío.
+        Returns:
+            bytes | None: El payload que hay que enviar ahora, o None si la ventana está llena y el mensaje queda en cola.
+        """
+        with self._condition:
+            out = self._peer_out(mac)
+            if len(out['in_flight']) >= self.window:
+                out['queue'].append((data, rto))
+                return None
+            payload = self._launch(out, data, rto)
+            self._wake()
+            return payload
+
+    def on_ack(self, mac, session, epoch, cumulative, bitmap):
+        """
+        Aplica una confirmación del vecino.
+        Returns:
+            list: Los payloads que hay que enviar ahora: los mensajes en cola que ahora caben en
+            la ventana y, si el receptor empezó de cero, los que seguían sin confirmar.
+        """
+        with self._condition:
+            out = self._outgoing.get(mac)
+            if out is None or session != out['session']:
+                return []
+            in_flight = out['in_flight']
+            for msg_id in [i for i in in_flight if i < cumulative]:
+                del in_flight[msg_id]
+            for msg_id in iter_bitmap(cumulative, bitmap):
+                in_flight.pop(msg_id, None)
+            ready = []
+            if out['epoch'] is None:
+                out['epoch'] = epoch
+            elif epoch != out['epoch']:
+                out['epoch'] = epoch
+                ready = self._restart(out)
+            while out['queue'] and len(out['in_flight']) < self.window:
+                ready.append(self._launch(out, *out['queue'].popleft()))
+            if ready:
+                self._wake()
+            return ready
+
+    def on_message(self, mac, session, msg_id):
+        """
+        Registra un mensaje recibido y programa su confirmación.
+        Returns:
+            bool: True si es nuevo, False si es un duplicado que no hay que mostrar.
+        """
+        with self._condition:
+            window = self._incoming.get(mac)
+            if window is None:
+                # Vecino nuevo, o que olvidamos: una época nueva avisa al emisor de que aquí
+                # se empieza desde el id 0
+                window = self._incoming[mac] = _ChatReceiveWindow(session, random.getrandbits(32))
+            elif window.session != session:
+                # El emisor empezó una sesión nueva: sus ids empiezan de nuevo, la época sigue
+                window = self._incoming[mac] = _ChatReceiveWindow(session, window.epoch)
+            is_new = window.mark(msg_id)
+            # También se confirman los duplicados: la confirmación anterior se perdió
+            if mac not in self._acks_due:
+                self._acks_due[mac] = time.monotonic() + self.ack_delay
+                self._wake()
+            return is_new
+
+    def forget(self, mac):
+        """Olvida el estado de un vecino que se ha ido de la red."""
+        with self._condition:
+            self._incoming.pop(mac, None)
+            self._acks_due.pop(mac, None)
+
+    def due(self):
+        """
+        Recoge el trabajo pendiente.
+        Returns:
+            tuple: (to_send, failed, wait). to_send es una lista de (mac, payload) con los reenvíos
+            y confirmaciones que tocan ya; failed, una lista de (mac, data) con los mensajes que
+            agotaron los reintentos; wait, los segundos hasta la siguiente tarea (None si no hay).
+        """
+        now = time.monotonic()
+        to_send = []
+        failed = []
+        next_deadline = None
+        with self._condition:
+            for mac, at in list(self._acks_due.items()):
+                if at <= now:
+                    del self._acks_due[mac]
+                    window = self._incoming.get(mac)
+                    if window is not None:
+                        to_send.append((mac, MSG_TYPE_CHAT_ACK
+                                        + CHAT_ACK_HEADER.pack(window.session, window.epoch)
+                                        + window.build_ack()))
+                elif next_deadline is None or at < next_deadline:
+                    next_deadline = at
+
+            for mac, out in self._outgoing.items():
+                in_flight = out['in_flight']
+                resend = []
+                abandoned = False
+                for msg_id, entry in list(in_flight.items()):
+                    if entry['deadline'] <= now:
+                        if entry['retries'] >= CHAT_MAX_RETRIES:
+                            del in_flight[msg_id]
+                            failed.append((mac, entry['data']))
+                            abandoned = True
+                            continue
+                        entry['retries'] += 1
+                        entry['rto'] = min(entry['rto'] * 2, CHAT_MAX_RETRY_TIMEOUT)
+                        entry['deadline'] = now + entry['rto']
+                        resend.append(entry['payload'])
+                    if next_deadline is None or entry['deadline'] < next_deadline:
+                        next_deadline = entry['deadline']
+                # Con un mensaje abandonado todo se renumera y se envía ya con la sesión nueva
+                ready = self._restart(out) if abandoned else resend
+                # Lo que se liberó al abandonar mensajes lo ocupan los de la cola
+                while out['queue'] and len(out['in_flight']) < self.window:
+                    ready.append(self._launch(out, *out['queue'].popleft()))
+                if ready:
+                    to_send.extend((mac, payload) for payload in ready)
+                    deadline = min(entry['deadline'] for entry in out['in_flight'].values())
+                    if next_deadline is None or deadline < next_deadline:
+                        next_deadline = deadline
+
+        wait = None if next_deadline is None else max(0.0, next_deadline - now)
+        return to_send, failed, wait
+
+    def wait(self, timeout):
+        """Espera hasta timeout segundos (o sin límite si es None) a que haya trabajo nuevo."""
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            self._pending = False
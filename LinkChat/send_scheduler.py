@@ -0,0 +1,211 @@
+import errno
+import threading
+import time
+from collections import deque
+from config import *
+
+# Clases de prioridad, de más a menos urgente. Una clase solo sale cuando las anteriores están vacías.
+PRIORITY_CONTROL = 0
+PRIORITY_CHAT = 1
+PRIORITY_BULK = 2
+
+PRIORITY_NAMES = {PRIORITY_CONTROL: 'control', PRIORITY_CHAT: 'chat', PRIORITY_BULK: 'bulk'}
+
+
+class SendScheduler:
+    """
+    Único escritor del socket. Los demás hilos dejan sus tramas en colas por prioridad
+    y el hilo de envío (run) las pone en la red: primero control y confirmaciones,
+    después chat y, por último, los trozos de archivo.
+
+    Los trozos de archivo se reparten entre transferencias con Deficit Round Robin:
+    en cada vuelta cada flujo puede enviar hasta 'quantum' bytes, así una transferencia
+    con trozos grandes o sin comprimir no acapara el enlace. Cada flujo tiene además una
+    cola acotada a 'flow_limit' bytes: el emisor que la llena espera (send_bulk bloquea)
+    o, si no puede bloquear, pide que se le avise cuando haya sitio (offer_bulk).
+    """
+    def __init__(self, quantum=SEND_DRR_QUANTUM, flow_limit=SEND_FLOW_QUEUE_BYTES, batch=SEND_BATCH_FRAMES):
+        self.quantum = quantum
+        self.flow_limit = flow_limit
+        # Tramas de control o de chat que el escritor saca de una vez
+        self.batch = batch
+        self._condition = threading.Condition()
+        # Colas de control y chat: (trama, hora de llegada)
+        self._queues = {PRIORITY_CONTROL: deque(), PRIORITY_CHAT: deque()}
+        # Flujos de trozos de archivo: {flow: {"frames": deque, "bytes", "deficit"}}
+        self._flows = {}
+        # Flujos con tramas, en orden de turno
+        self._active = deque()
+        self._bulk_frames = 0
+        # Avisos de offer_bulk que el hilo de envío debe llamar al soltar el candado
+        self._callbacks = []
+        self._closed = False
+        # Estadísticas por clase
+        self._sent = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._latency = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self._max_latency = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        # Tramas enviadas por tipo de mensaje (solo las cuenta el hilo de envío)
+        self._type_counts = [0] * 256
+        self.errors = 0
+        self.last_error = None
+
+    def send(self, frame, priority=PRIORITY_CONTROL):
+        """Encola una trama de control o de chat. No bloquea."""
+        with self._condition:
+            self._queues[priority].append((frame, time.monotonic()))
+            self._condition.notify_all()
+
+    def send_bulk(self, flow, frames):
+        """
+        Encola trozos de archivo de un flujo (una transferencia), en orden.
+        Bloquea mientras la cola del flujo esté llena; una ráfaga siempre se admite
+        si la cola está vacía, aunque sea mayor que el límite.
+        """
+        size = sum(len(frame) for frame in frames)
+        with self._condition:
+            while self._full(flow, size):
+                if self._closed:
+                    raise OSError(errno.EBADF, "el socket está cerrado")
+                self._condition.wait()
+            self._enqueue(flow, frames, size)
+
+    def offer_bulk(self, flow, frames, on_space):
+        """
+        Como send_bulk, pero sin bloquear nunca.
+        Returns:
+            bool: True si los trozos quedaron en cola. Si la cola del flujo está llena devuelve
+            False y el hilo de envío llamará a on_space() cuando haya sitio para reintentarlo.
+        """
+        size = sum(len(frame) for frame in frames)
+        with self._condition:
+            if self._closed:
+                raise OSError(errno.EBADF, "el socket está cerrado")
+            if self._full(flow, size):
+                self._flows[flow]['waiters'].append(on_space)
+                return False
+            self._enqueue(flow, frames, size)
+            return True
+
+    def _full(self, flow, size):
+        state = self._flows.get(flow)
+        return state is not None and state['bytes'] and state['bytes'] + size > self.flow_limit
+
+    def _enqueue(self, flow, frames, size):
+        state = self._flows.get(flow)
+        if state is None:
+            state = self._flows[flow] = {"frames": deque(), "bytes": 0, "deficit": 0, "waiters": []}
+            self._active.append(flow)
+        now = time.monotonic()
+        state['frames'].extend((frame, now) for frame in frames)
+        state['bytes'] += size
+        self._bulk_frames += len(frames)
+        self._condition.notify_all()
+
+    def _take(self):
+        # Devuelve (prioridad, [(trama, hora)]) con lo siguiente que hay que enviar
+        for priority in (PRIORITY_CONTROL, PRIORITY_CHAT):
+            queue = self._queues[priority]
+            if queue:
+                return priority, [queue.popleft() for _ in range(min(len(queue), self.batch))]
+
+        # Deficit Round Robin entre los flujos de archivo
+        while self._active:
+            flow = self._active[0]
+            state = self._flows[flow]
+            state['deficit'] += self.quantum
+            taken = []
+            frames = state['frames']
+            while frames and len(frames[0][0]) <= state['deficit']:
+                item = frames.popleft()
+                state['deficit'] -= len(item[0])
+                state['bytes'] -= len(item[0])
+                taken.append(item)
+            self._bulk_frames -= len(taken)
+            if taken and state['waiters']:
+                self._callbacks.extend(state['waiters'])
+                state['waiters'] = []
+            if not frames:
+                # Un flujo sin tramas sale de la rueda y pierde el crédito que le quedaba
+                self._active.popleft()
+                del self._flows[flow]
+            else:
+                self._active.rotate(-1)
+            if taken:
+                return PRIORITY_BULK, taken
+        return None, []
+
+    def run(self, sock):
+        """Bucle del hilo de envío: termina cuando el socket se cierra."""
+        while True:
+            with self._condition:
+                priority, items = self._take()
+                while not items:
+                    self._condition.wait()
+                    priority, items = self._take()
+                # Los emisores de archivos pueden tener sitio en su cola
+                if priority == PRIORITY_BULK:
+                    self._condition.notify_all()
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback()
+
+            for frame, queued_at in items:
+                try:
+                    sock.send(frame)
+                except OSError as e:
+                    self.errors += 1
+                    self.last_error = e
+                    if e.errno in (errno.EBADF, errno.ENOTSOCK):
+                        self.close()
+                        return
+                    continue
+                if len(frame) > ETH_HEADER_SIZE:
+                    self._type_counts[frame[ETH_HEADER_SIZE]] += 1
+                latency = time.monotonic() - queued_at
+                self._latency[priority] += latency
+                if latency > self._max_latency[priority]:
+                    self._max_latency[priority] = latency
+            self._sent[priority] += len(items)
+
+    def close(self):
+        """Despierta a los emisores que esperan sitio, que fallarán con EBADF."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            callbacks = [callback for state in self._flows.values() for callback in state['waiters']]
+            callbacks += self._callbacks
+            for state in self._flows.values():
+                state['waiters'] = []
+            self._callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def frame_counts(self):
+        """
+        Returns:
+            dict: {tipo de mensaje (int): tramas enviadas} de los tipos que se han enviado.
+        """
+        return {msg_type: count for msg_type, count in enumerate(self._type_counts) if count}
+
+    def stats(self):
+        """
+        Devuelve, por clase, las tramas en cola, las enviadas y su espera media y máxima.
+        Returns:
+            dict: {nombre: {"queued", "sent", "avg_ms", "max_ms"}}, más "flows" y "errors".
+        """
+        with self._condition:
+            queued = {
+                PRIORITY_CONTROL: len(self._queues[PRIORITY_CONTROL]),
+                PRIORITY_CHAT: len(self._queues[PRIORITY_CHAT]),
+                PRIORITY_BULK: self._bulk_frames,
+            }
+            result = {"flows": len(self._flows), "errors": self.errors}
+        for priority, name in PRIORITY_NAMES.items():
+            sent = self._sent[priority]
+            result[name] = {
+                "queued": queued[priority],
+                "sent": sent,
+                "avg_ms": self._latency[priority] / sent * 1000 if sent else 0.0,
+                "max_ms": self._max_latency[priority] * 1000,
+            }
+        return result
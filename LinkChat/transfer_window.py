@@ -0,0 +1,262 @@
+import struct
+import time
+
+# Cabecera de un paquete SACK: número de secuencia acumulado (4 bytes).
+# Le sigue un mapa de bits con los trozos recibidos fuera de orden.
+SACK_HEADER = struct.Struct('!I')
+
+def pack_sack(cumulative, bitmap):
+    """
+    Construye el payload de un SACK (sin el byte de tipo).
+    Args:
+        cumulative (int): Número de trozos contiguos recibidos desde el 0.
+        bitmap (bytes): El bit i indica si llegó el trozo cumulative + 1 + i.
+    Returns:
+        bytes: El payload listo para enviar.
+    """
+    return SACK_HEADER.pack(cumulative) + bitmap
+
+def unpack_sack(payload):
+    """
+    Interpreta el payload de un SACK (sin el byte de tipo).
+    Returns:
+        tuple: (cumulative, bitmap)
+    """
+    cumulative = SACK_HEADER.unpack_from(payload, 0)[0]
+    return cumulative, bytes(payload[SACK_HEADER.size:])
+
+def iter_bitmap(cumulative, bitmap):
+    """
+    Recorre el mapa de bits de un SACK y devuelve los números de secuencia marcados.
+    El bit más significativo de cada byte corresponde al trozo más bajo.
+    """
+    for byte_index, byte in enumerate(bitmap):
+        if not byte:
+            continue
+        for bit in range(8):
+            if byte & (0x80 >> bit):
+                yield cumulative + 1 + byte_index * 8 + bit
+
+
+class SendWindow:
+    """
+    Estado de la ventana deslizante del lado del emisor.
+    No envía nada por sí misma: solo decide qué trozos mandar o reenviar.
+    """
+    def __init__(self, total_chunks, window_size, min_rto, max_rto, start=0, initial_cwnd=16, min_cwnd=4):
+        self.total_chunks = total_chunks
+        # Máximo de trozos entre el primero sin confirmar y el siguiente nuevo (lo que cabe en el SACK del receptor).
+        self.window_size = window_size
+        # Primer trozo todavía sin confirmar. Al reanudar, los anteriores a start ya los tiene el receptor.
+        start = min(start, total_chunks)
+        self.base = start
+        # Siguiente trozo nuevo (nunca enviado).
+        self.next_seq = start
+        self.acked = bytearray(total_chunks)
+        self.acked[:start] = b'\x01' * start
+        # Sello de envío de cada trozo en vuelo. Sirve para saber si un trozo
+        # se envió antes que otro que ya fue confirmado (y por tanto se perdió).
+        self.sent_stamp = {}
+        self._stamp = 0
+        self.retransmissions = 0
+        # Hora del primer envío de cada trozo en vuelo (para medir el RTT).
+        # Los trozos reenviados no se usan para medir (algoritmo de Karn).
+        self.sent_time = {}
+        self.retransmitted = set()
+        # Estimación del tiempo de ida y vuelta y del tiempo de reenvío (RFC 6298).
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = max_rto
+        # Ventana de congestión (AIMD): cuántos trozos pueden estar en vuelo a la vez.
+        # Crece mientras el receptor confirma sin huecos y se reduce a la mitad con cada
+        # pérdida, así el envío se adapta tanto a una LAN vacía como a una Wi-Fi congestionada.
+        self.min_cwnd = min(min_cwnd, window_size)
+        self.cwnd = float(max(self.min_cwnd, min(initial_cwnd, window_size)))
+        self.ssthresh = float(window_size)
+        # Mientras base no pase de aquí, las pérdidas son del mismo episodio y no vuelven a reducir cwnd
+        self.recovery_point = -1
+        self.congestion_events = 0
+
+    def done(self):
+        """Indica si todos los trozos han sido confirmados."""
+        return self.base >= self.total_chunks
+
+    def can_send_new(self):
+        """Indica si hay trozos nuevos y espacio libre en la ventana y en la ventana de congestión."""
+        return self.new_budget() > 0
+
+    def new_budget(self):
+        """Cuántos trozos nuevos se pueden enviar ahora mismo."""
+        return max(0, min(self.total_chunks - self.next_seq,
+                          self.window_size - (self.next_seq - self.base),
+                          int(self.cwnd) - len(self.sent_stamp)))
+
+    def take_new(self):
+        """Reserva el siguiente trozo nuevo y lo marca como enviado."""
+        seq = self.next_seq
+        self.next_seq += 1
+        self.mark_sent(seq)
+        return seq
+
+    def mark_sent(self, seq):
+        """Registra que el trozo seq acaba de salir por la red."""
+        self._stamp += 1
+        if seq in self.sent_time:
+            self.retransmitted.add(seq)
+        else:
+            self.sent_time[seq] = time.monotonic()
+        self.sent_stamp[seq] = self._stamp
+
+    def outstanding(self):
+        """Devuelve, en orden, los trozos enviados que siguen sin confirmar."""
+        return sorted(self.sent_stamp)
+
+    def _ack(self, seq):
+        if seq >= self.next_seq or self.acked[seq]:
+            return 0
+        self.acked[seq] = 1
+        sent_time = self.sent_time.pop(seq, None)
+        if seq in self.retransmitted:
+            self.retransmitted.discard(seq)
+        elif sent_time is not None:
+            self._rtt_sample(time.monotonic() - sent_time)
+        return self.sent_stamp.pop(seq, 0)
+
+    def _rtt_sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        """
+        Tras un timeout: duplica el tiempo de reenvío (sin pasar del máximo) y vuelve
+        a la ventana de congestión mínima, porque el receptor o la red no dan abasto.
+        """
+        self.rto = min(self.max_rto, self.rto * 2)
+        self.ssthresh = max(self.min_cwnd, self.cwnd / 2)
+        self.cwnd = float(self.min_cwnd)
+        self.recovery_point = self.next_seq
+        self.congestion_events += 1
+
+    def _on_acked(self, count):
+        # Arranque lento hasta ssthresh y, después, un trozo más por cada ventana confirmada
+        if self.cwnd < self.ssthresh:
+            self.cwnd += count
+        else:
+            self.cwnd += count / self.cwnd
+        self.cwnd = min(self.cwnd, float(self.window_size))
+
+    def _on_loss(self):
+        # Una sola reducción por episodio de pérdidas
+        if self.base > self.recovery_point:
+            self.ssthresh = max(self.min_cwnd, self.cwnd / 2)
+            self.cwnd = self.ssthresh
+            self.recovery_point = self.next_seq
+            self.congestion_events += 1
+
+    def on_sack(self, cumulative, bitmap):
+        """
+        Aplica un SACK recibido y devuelve la lista de trozos perdidos.
+        Un trozo se considera perdido si se envió antes que otro que ya llegó.
+        Los trozos devueltos deben reenviarse (y marcarse con mark_sent).
+        """
+        newest_stamp = 0
+        in_flight = len(self.sent_stamp)
+        for seq in range(self.base, min(cumulative, self.next_seq)):
+            newest_stamp = max(newest_stamp, self._ack(seq))
+        for seq in iter_bitmap(cumulative, bitmap):
+            if seq >= self.next_seq:
+                break
+            newest_stamp = max(newest_stamp, self._ack(seq))
+        acked = in_flight - len(self.sent_stamp)
+
+        while self.base < self.next_seq and self.acked[self.base]:
+            self.base += 1
+
+        lost = [seq for seq, stamp in self.sent_stamp.items() if stamp < newest_stamp]
+        lost.sort()
+        self.retransmissions += len(lost)
+        if lost:
+            self._on_loss()
+        elif acked:
+            self._on_acked(acked)
+        return lost
+
+
+class ReceiveWindow:
+    """
+    Estado de la ventana del lado del receptor: qué trozos han llegado.
+    """
+    def __init__(self, total_chunks):
+        self.total_chunks = total_chunks
+        self.received = bytearray(total_chunks)
+        # Número de trozos contiguos recibidos desde el 0.
+        self.cumulative = 0
+        self.count = 0
+        # Mayor número de secuencia recibido (-1 si no ha llegado ninguno).
+        self.highest = -1
+
+    def mark(self, seq):
+        """
+        Marca el trozo seq como recibido.
+        Returns:
+            bool: True si el trozo es nuevo, False si es un duplicado o está fuera de rango.
+        """
+        if seq >= self.total_chunks or self.received[seq]:
+            return False
+        self.received[seq] = 1
+        self.count += 1
+        self.highest = max(self.highest, seq)
+        while self.cumulative < self.total_chunks and self.received[self.cumulative]:
+            self.cumulative += 1
+        return True
+
+    def restore(self, cumulative, bitmap):
+        """
+        Marca como recibidos los trozos de un SACK guardado: los cumulative primeros
+        y los que indique el mapa de bits. Sirve para reanudar una descarga.
+        """
+        cumulative = min(cumulative, self.total_chunks)
+        self.received[:cumulative] = b'\x01' * cumulative
+        self.count = self.cumulative = cumulative
+        self.highest = cumulative - 1
+        for seq in iter_bitmap(cumulative, bitmap):
+            self.mark(seq)
+
+    def snapshot(self):
+        """
+        Devuelve todos los trozos recibidos en formato SACK (sin límite de tamaño del mapa).
+        """
+        return self.build_sack(max(self.highest - self.cumulative, 0))
+
+    def is_missing(self, seq):
+        """Indica si seq es un trozo válido que todavía no ha llegado."""
+        return seq < self.total_chunks and not self.received[seq]
+
+    def has_gaps(self):
+        """Indica si hay trozos recibidos por delante de un hueco."""
+        return self.count > self.cumulative
+
+    def complete(self):
+        """Indica si han llegado todos los trozos."""
+        return self.cumulative >= self.total_chunks
+
+    def build_sack(self, max_bits):
+        """
+        Construye el payload de un SACK con, como mucho, max_bits trozos en el mapa.
+        """
+        start = self.cumulative + 1
+        end = min(self.total_chunks, start + max_bits)
+        bitmap = bytearray((max(end - start, 0) + 7) // 8)
+        for seq in range(start, end):
+            if self.received[seq]:
+                offset = seq - start
+                bitmap[offset // 8] |= 0x80 >> (offset % 8)
+        # Quitamos los bytes vacíos del final para ahorrar espacio.
+        return pack_sack(self.cumulative, bytes(bitmap).rstrip(b'\x00'))
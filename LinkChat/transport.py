@@ -0,0 +1,287 @@
+import contextlib
+import ctypes
+import heapq
+import itertools
+import os
+import random
+import selectors
+import socket
+import subprocess
+import threading
+import time
+from config import *
+from utils import obtener_direccion_mac, obtener_mtu
+
+# Bandera de setns(2) para cambiar de espacio de nombres de red
+CLONE_NEWNET = 0x40000000
+
+
+class Endpoint:
+    """
+    Lo que LinkChat necesita de un medio: un socket de tramas Ethernet completas (con send,
+    recv_into y fileno), la MAC con la que se presenta y la MTU. Los hilos de red y el motor
+    asyncio solo usan esto, así que funcionan igual sobre cualquier transporte.
+    """
+    def __init__(self, sock, mac, mtu, name):
+        self.sock = sock
+        self.mac = mac
+        self.mtu = mtu
+        self.name = name
+
+    def close(self):
+        self.sock.close()
+
+
+# --- Socket RAW sobre una interfaz (real o veth) ---
+
+def _setns(fd):
+    if hasattr(os, 'setns'):
+        os.setns(fd, CLONE_NEWNET)
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.setns(fd, CLONE_NEWNET) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+@contextlib.contextmanager
+def network_namespace(name):
+    """
+    Ejecuta el bloque dentro del espacio de nombres de red 'name' (de 'ip netns').
+    Solo cambia el hilo actual, y los sockets abiertos dentro se quedan en ese espacio.
+    Con name=None no hace nada.
+    """
+    if name is None:
+        yield
+        return
+    own = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    target = os.open(f'/var/run/netns/{name}', os.O_RDONLY)
+    try:
+        _setns(target)
+        try:
+            yield
+        finally:
+            _setns(own)
+    finally:
+        os.close(target)
+        os.close(own)
+
+
+def open_raw(interface, netns=None):
+    """
+    Abre el socket AF_PACKET de LinkChat sobre una interfaz (necesita root).
+    Args:
+        interface (str): El nombre de la interfaz.
+        netns (str | None): El espacio de nombres de red en el que está la interfaz.
+    Returns:
+        Endpoint
+    """
+    with network_namespace(netns):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(LINK_CHAT_ETHERTYPE))
+        try:
+            sock.bind((interface, 0))
+            return Endpoint(sock, obtener_direccion_mac(interface), obtener_mtu(interface), interface)
+        except Exception:
+            sock.close()
+            raise
+
+
+def _ip(*args):
+    subprocess.run(('ip',) + args, check=True, capture_output=True)
+
+
+class VethPair:
+    """
+    Un par veth con cada extremo en su propio espacio de nombres de red: un enlace Ethernet
+    de verdad (con el kernel, sus colas y el anillo de recepción) que no necesita NIC ni
+    molesta al resto del sistema. Necesita root y la orden 'ip'.
+    """
+    def __init__(self, prefix='lc', mtu=DEFAULT_MTU, netns=True):
+        self.names = (f'{prefix}a', f'{prefix}b')
+        self.namespaces = (f'{prefix}-ns-a', f'{prefix}-ns-b') if netns else (None, None)
+        self.mtu = mtu
+
+    def open(self):
+        """
+        Crea el par (borrando antes uno anterior con los mismos nombres) y abre un socket en cada extremo.
+        Returns:
+            tuple: (Endpoint, Endpoint)
+        """
+        self.close()
+        for namespace in self.namespaces:
+            if namespace is not None:
+                _ip('netns', 'add', namespace)
+        (name_a, name_b), (ns_a, ns_b) = self.names, self.namespaces
+        _ip('link', 'add', name_a, *(('netns', ns_a) if ns_a else ()),
+            'type', 'veth', 'peer', 'name', name_b, *(('netns', ns_b) if ns_b else ()))
+        for name, namespace in zip(self.names, self.namespaces):
+            _ip(*(('-n', namespace) if namespace else ()), 'link', 'set', name, 'mtu', str(self.mtu), 'up')
+        return tuple(open_raw(name, namespace) for name, namespace in zip(self.names, self.namespaces))
+
+    def close(self):
+        """Borra el par y sus espacios de nombres (borrar un extremo borra también el otro)."""
+        for name, namespace in zip(self.names, self.namespaces):
+            with contextlib.suppress(subprocess.CalledProcessError, FileNotFoundError):
+                if namespace is not None:
+                    _ip('netns', 'del', namespace)
+                else:
+                    _ip('link', 'del', name)
+
+
+# --- Concentrador en memoria ---
+
+class LoopbackHub:
+    """
+    Un segmento Ethernet simulado dentro del proceso, sin root ni interfaces. Cada attach()
+    devuelve un extremo cuyo socket es un socketpair AF_UNIX (SOCK_SEQPACKET, así cada
+    envío es una trama); un hilo del concentrador reparte las tramas según la MAC de destino
+    (las de broadcast, a todos menos al emisor), como haría un switch.
+
+    Por el camino puede perder tramas (loss), retrasarlas (latency más un extra al azar de
+    hasta jitter segundos) y desordenarlas (reorder: la trama se retrasa reorder_delay
+    segundos más para que la adelanten las siguientes). Con 'seed' los resultados se repiten.
+    Si un receptor no da abasto su cola se llena y las tramas se descartan, como en una NIC.
+    """
+    def __init__(self, loss=0.0, reorder=0.0, latency=0.0, jitter=0.0, reorder_delay=0.002,
+                 mtu=DEFAULT_MTU, buffer_size=RX_SOCKET_BUFFER_SIZE, seed=None):
+        self.loss = loss
+        self.reorder = reorder
+        self.latency = latency
+        self.jitter = jitter
+        self.reorder_delay = reorder_delay
+        self.mtu = mtu
+        self.buffer_size = buffer_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # {mac: socket del lado del concentrador}
+        self._ports = {}
+        self._selector = selectors.DefaultSelector()
+        # Tramas retrasadas: (hora de entrega, orden, socket de destino, trama)
+        self._delayed = []
+        self._order = itertools.count()
+        self._macs = itertools.count(1)
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, None)
+        self._closed = False
+        self.forwarded = 0
+        self.lost = 0
+        self.reordered = 0
+        self.overflows = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def attach(self, mac=None):
+        """
+        Conecta un extremo nuevo al segmento.
+        Args:
+            mac (bytes | None): Su MAC; por defecto una administrada localmente (02:4c:43:...).
+        Returns:
+            Endpoint
+        """
+        if mac is None:
+            mac = b'\x02\x4c\x43' + next(self._macs).to_bytes(3, 'big')
+        app_side, hub_side = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        for sock in (app_side, hub_side):
+            for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+                with contextlib.suppress(OSError):
+                    sock.setsockopt(socket.SOL_SOCKET, option, self.buffer_size)
+        hub_side.setblocking(False)
+        with self._lock:
+            self._ports[mac] = hub_side
+        self._selector.register(hub_side, selectors.EVENT_READ, mac)
+        self._wake()
+        return Endpoint(app_side, mac, self.mtu, f"hub:{mac.hex(':')}")
+
+    def _wake(self):
+        with contextlib.suppress(BlockingIOError, OSError):
+            self._wake_write.send(b'\x00')
+
+    def _detach(self, mac):
+        with self._lock:
+            sock = self._ports.pop(mac, None)
+        if sock is not None:
+            with contextlib.suppress(KeyError, ValueError):
+                self._selector.unregister(sock)
+            sock.close()
+
+    def _route(self, src_mac, frame):
+        # Tramas sin cabecera o más grandes que la MTU no pasan, como en una red real
+        if len(frame) < ETH_HEADER_SIZE or len(frame) - ETH_HEADER_SIZE > self.mtu:
+            self.lost += 1
+            return
+        dest_mac = frame[:6]
+        with self._lock:
+            if dest_mac == BROADCAST_MAC:
+                targets = [sock for mac, sock in self._ports.items() if mac != src_mac]
+            else:
+                target = self._ports.get(dest_mac)
+                targets = [target] if target is not None else []
+        now = time.monotonic()
+        for target in targets:
+            if self.loss and self._random.random() < self.loss:
+                self.lost += 1
+                continue
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if self.reorder and self._random.random() < self.reorder:
+                delay += self.reorder_delay
+                self.reordered += 1
+            if delay > 0:
+                heapq.heappush(self._delayed, (now + delay, next(self._order), target, frame))
+            else:
+                self._deliver(target, frame)
+
+    def _deliver(self, target, frame):
+        try:
+            target.send(frame)
+            self.forwarded += 1
+        except BlockingIOError:
+            self.overflows += 1
+        except OSError:
+            # El extremo se cerró
+            pass
+
+    def _run(self):
+        while not self._closed:
+            timeout = None
+            if self._delayed:
+                timeout = max(0.0, self._delayed[0][0] - time.monotonic())
+            for key, _ in self._selector.select(timeout):
+                sock, src_mac = key.fileobj, key.data
+                if src_mac is None:
+                    with contextlib.suppress(BlockingIOError, OSError):
+                        sock.recv(4096)
+                    continue
+                while True:
+                    try:
+                        frame = sock.recv(65536)
+                    except BlockingIOError:
+                        break
+                    except OSError:
+                        frame = b''
+                    if not frame:
+                        # El extremo de la aplicación se cerró
+                        self._detach(src_mac)
+                        break
+                    self._route(src_mac, frame)
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, target, frame = heapq.heappop(self._delayed)
+                self._deliver(target, frame)
+
+    def stats(self):
+        """Devuelve los contadores del concentrador: reenviadas, perdidas, desordenadas y desbordadas."""
+        return {
+            "forwarded": self.forwarded,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "overflows": self.overflows,
+        }
+
+    def close(self):
+        """Para el concentrador y cierra sus extremos (los sockets de la aplicación ven el cierre)."""
+        self._closed = True
+        self._wake()
+        self._thread.join(timeout=1.0)
+        for mac in list(self._ports):
+            self._detach(mac)
@@ -1,6 +1,7 @@
 import socket
 import fcntl
 import struct
+import hashlib
 
 def obtener_direccion_mac(ifname):
     """
@@ -19,6 +20,22 @@ def obtener_direccion_mac(ifname):
     # La dirección MAC se encuentra en los bytes del 18 al 24 de la estructura devuelta.
     return info[18:24]
 
+def obtener_mtu(ifname):
+    """
+    Obtiene la MTU (tamaño máximo del payload de una trama) de una interfaz de red.
+    Args:
+        ifname (str): El nombre de la interfaz (ej: 'eth0', 'wlan0').
+    Returns:
+        int: La MTU en bytes (1500 en Ethernet estándar, 9000 con jumbo frames).
+    """
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    try:
+        # 0x8921 (SIOCGIFMTU) devuelve la MTU en el entero que sigue al nombre (16 bytes).
+        info = fcntl.ioctl(s.fileno(), 0x8921, struct.pack('16si', ifname[:15].encode('utf-8'), 0))
+        return struct.unpack('16si', info)[1]
+    finally:
+        s.close()
+
 def mac_bits_cadena(mac_bytes):
     """
     Convierte una dirección MAC de formato de bytes a una cadena legible.
@@ -43,4 +60,26 @@ def mac_cadena_bits(mac_str):
     """
     # Primero, elimina los dos puntos de la cadena.
     # Luego, convierte la cadena hexadecimal resultante en un objeto de bytes.
-    return bytes.fromhex(mac_str.replace(':', ''))
\ No newline at end of file
+    return bytes.fromhex(mac_str.replace(':', ''))
+
+def resumen_archivo(path, algorithm='sha256', block_size=1 << 20):
+    """
+    Calcula el resumen (hash) del contenido de un archivo.
+    Args:
+        path (str): La ruta del archivo.
+        algorithm (str): El algoritmo de hashlib a usar.
+        block_size (int): Cuánto se lee de cada vez.
+    Returns:
+        bytes: El resumen binario.
+    """
+    digest = hashlib.new(algorithm)
+    # Un búfer reutilizado: se lee por bloques grandes sin crear un objeto bytes por bloque
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.digest()
\ No newline at end of file